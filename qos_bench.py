@@ -0,0 +1,310 @@
+#!/usr/bin/python
+# Benchmarks of the hot paths of the QoS controller (qos_controller.py), compared against a stored baseline.
+# Overall operation:
+#    - every benchmark sets up a fresh controller (the module is reloaded) on emulated connections: the messages the
+#      controller sends are packed, as POX does before writing them to the socket, and then dropped,
+#    - a benchmark prepares its inputs for n operations outside of the timing, n is raised until one run takes at least
+#      --min_time; the run is repeated --repeat times and the median time per operation is kept,
+#    - the results are written as JSON (--json) and compared with the baseline file: a benchmark slower than its
+#      baseline by more than --tolerance is a regression and the exit status is 1; --save stores the results as the new baseline.
+# Baselines depend on the machine and the Python/POX versions: record them with --save on the machine they are compared on.
+# e.g. python qos_bench.py --save
+#      python qos_bench.py --filter=find_matching_link --json=results.json
+#
+# Benchmarks:
+#    packetin/probe                   _handle_PacketIn of a probe: frame parsing, matching and the delay estimate
+#    packetin/arp                     _handle_PacketIn of an ARP request at an edge switch, answered with a PACKET_OUT
+#    portstats/ports=P                _handle_portstats_received of a reply with P ports
+#    find_matching_link/requests=R/links=L   one recompute with R requests over L links, all already placed (the
+#                                     state every recompute but the first one starts from)
+#    flow_mod/encode                  building and packing a flow_mod as setPath builds it
+#    flow_mod/setPath_sent            setPath of a rule that changes (sent to the switch)
+#    flow_mod/setPath_suppressed      setPath of a rule already installed (dropped by the shadow flow table)
+
+import sys
+import os
+import gc
+import re
+import json
+import math
+import random
+import argparse
+import platform
+import socket
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.packet.ethernet import ethernet
+import qos_controller as qos
+from qos_stats import monotonic_ns
+from qos_stubs import Record, SimOpenFlow, arp_request, mac
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "qos_bench_baseline.json")
+
+class BenchConnection(object):
+  def __init__(self, name, dpid, ports):
+    self.name = name
+    self.dpid = dpid
+    self.features = Record(ports=[Record(name="%s-eth%d" % (name, port), port_no=port, hw_addr=None) for port in ports])
+    self.sent = 0
+
+  def send(self, msg):
+    msg.pack()
+    self.sent += 1
+
+def setup(middle=0, hosts=3, options=None, seed=1):
+  # Fresh controller on the qos_net.py diamond, widened by middle switches s6, s7, ... each linked to s1 and s5
+  # (2 links each), with hosts hosts on each of s1 and s5; link delays are drawn between 5 and 50 ms.
+  reload(qos)
+  rnd = random.Random(seed)
+  for i in range(middle):
+    name, port = "s%d" % (6 + i), 7 + i
+    qos.LINK_TABLE.append(("s1-" + name, "s1", port, "0:1:0:0:%x:%x" % divmod(port, 256), name, 1, "0:%x:0:0:0:1" % (6 + i), 1000))
+    qos.LINK_TABLE.append((name + "-s5", name, 2, "0:%x:0:0:0:2" % (6 + i), "s5", port, "0:5:0:0:%x:%x" % divmod(port, 256), 1000))
+  for j in range(3, hosts):
+    qos.HOSTS["a%d" % j] = ("s1", 1000 + j, "10.1.%d.%d" % divmod(j, 256))
+    qos.HOSTS["b%d" % j] = ("s5", 1000 + j, "10.5.%d.%d" % divmod(j, 256))
+  launch = dict(requests=os.devnull, reload_interval=0, api_port=0, echo_rate=0)
+  launch.update(options or {})
+  qos.launch(**launch)
+  for name in sorted(qos.links):
+    qos.links[name].delay = rnd.uniform(5, 50)
+
+  ports = {}
+  for link in qos.links.values():
+    ports.setdefault(link.src, set()).add(link.src_port)
+    ports.setdefault(link.dst, set()).add(link.dst_port)
+  for switch, port, ip in qos.HOSTS.values():
+    ports.setdefault(switch, set()).add(port)
+  openflow = core.openflow
+  openflow.connections.clear()
+  qos.network_ready = True # no timers: the benchmarks call the handlers themselves
+  for dpid, name in enumerate(sorted(ports), 1):
+    connection = BenchConnection(name, dpid, sorted(ports[name]))
+    openflow.connections[dpid] = connection
+    qos._handle_ConnectionUp(Record(connection=connection, dpid=dpid))
+  return rnd
+
+# --- benchmarks: each one sets up the controller and returns prepare(n), which returns the timed function doing n operations ---
+
+def bench_packetin_probe():
+  setup()
+  link = qos.links["s1-s2"]
+  connection = core.openflow.getConnection(qos.switch_dpids[link.dst])
+  def prepare(n):
+    frames = []
+    for i in range(n):
+      link.seq = (link.seq + 1) & 0xFFFFFFFF
+      sent_time = qos.clock.us()
+      qos.pending_probes[(link.id, link.seq)] = sent_time
+      frames.append(link.probe_data(link.seq, sent_time))
+    def run():
+      handler = qos._handle_PacketIn
+      for data in frames:
+        # parsed as POX parses event.parsed
+        handler(Record(connection=connection, dpid=connection.dpid, ofp=of.ofp_packet_in(data=data, in_port=link.dst_port),
+                       parsed=ethernet(data)))
+    return run
+  return prepare
+
+def bench_packetin_arp():
+  setup()
+  connection = core.openflow.getConnection(qos.switch_dpids["s1"])
+  data = arp_request(mac(connection.dpid, 1), "10.0.0.1", "10.0.0.4")
+  def prepare(n):
+    def run():
+      handler = qos._handle_PacketIn
+      for i in xrange(n):
+        handler(Record(connection=connection, dpid=connection.dpid, ofp=of.ofp_packet_in(data=data, in_port=1),
+                       parsed=ethernet(data)))
+    return run
+  return prepare
+
+def bench_portstats(ports):
+  setup(middle=max(0, ports - 6))
+  connection = core.openflow.getConnection(qos.switch_dpids["s5"])
+  stats = [Record(port_no=port.port_no, rx_bytes=0, tx_bytes=0, rx_packets=0, tx_packets=0)
+           for port in connection.features.ports][:ports]
+  def prepare(n):
+    events = []
+    for i in range(n):
+      # counters growing by 1 MB per reply, so that every port gets a rate
+      entries = [Record(port_no=entry.port_no, rx_bytes=i << 20, tx_bytes=i << 20, rx_packets=i << 10, tx_packets=i << 10)
+                 for entry in stats]
+      events.append(Record(connection=connection, dpid=connection.dpid, ofp=Record(xid=0), stats=entries))
+    def run():
+      handler = qos._handle_portstats_received
+      for event in events:
+        handler(event)
+    return run
+  return prepare
+
+def bench_find_matching_link(requests, middle):
+  # requests between distinct hosts of s1 and s5, with bounds met by most parallel paths and bandwidths filling
+  # about 70% of their capacity
+  hosts = max(3, int(math.ceil(math.sqrt(requests))))
+  rnd = setup(middle=middle, hosts=hosts)
+  names = lambda side, first: ["h%d" % i for i in range(first, first + 3)] + ["%s%d" % (side, j) for j in range(3, hosts)]
+  pairs = [(src, dst) for src in names("a", 1) for dst in names("b", 4)]
+  share = min(300.0, 0.7 * 1000 * (3 + middle) / requests)
+  qos.req_conn[:] = [{"src": src, "dst": dst, "min_delay": rnd.uniform(40, 120), "bandwidth": share}
+                     for src, dst in rnd.sample(pairs, requests)]
+  qos.find_matching_link()
+  def prepare(n):
+    def run():
+      for i in xrange(n):
+        qos.find_matching_link()
+    return run
+  return prepare
+
+def bench_flow_mod_encode():
+  setup()
+  def prepare(n):
+    def run():
+      for i in xrange(n):
+        msg = of.ofp_flow_mod()
+        msg.command = of.OFPFC_MODIFY_STRICT
+        msg.priority = 110
+        msg.flags = of.OFPFF_SEND_FLOW_REM
+        msg.match.dl_type = 0x0800
+        msg.match.nw_dst = "10.0.0.4"
+        msg.match.nw_src = "10.0.0.1"
+        msg.actions.append(of.ofp_action_output(port=4))
+        msg.pack()
+    return run
+  return prepare
+
+def bench_setpath(sent):
+  setup()
+  dpid = qos.switch_dpids["s1"]
+  qos.setPath(dpid, "10.0.0.1", "10.0.0.4", 4)
+  def prepare(n):
+    def run():
+      for i in xrange(n):
+        qos.setPath(dpid, "10.0.0.1", "10.0.0.4", 4 + (i & 1 if sent else 0))
+    return run
+  return prepare
+
+BENCHMARKS = [
+  ("packetin/probe", bench_packetin_probe),
+  ("packetin/arp", bench_packetin_arp),
+] + [
+  ("portstats/ports=%d" % ports, lambda ports=ports: bench_portstats(ports)) for ports in (8, 64, 512)
+] + [
+  ("find_matching_link/requests=%d/links=%d" % (requests, 6 + 2 * middle),
+   lambda requests=requests, middle=middle: bench_find_matching_link(requests, middle))
+    for requests in (10, 100, 1000) for middle in (0, 24, 100)
+] + [
+  ("flow_mod/encode", bench_flow_mod_encode),
+  ("flow_mod/setPath_sent", lambda: bench_setpath(True)),
+  ("flow_mod/setPath_suppressed", lambda: bench_setpath(False)),
+]
+
+def timed(run):
+  # duration of run() [s], without garbage collection in the middle (as timeit)
+  gc.collect()
+  gc.disable()
+  try:
+    start = monotonic_ns()
+    run()
+    return (monotonic_ns() - start) / 1e9
+  finally:
+    gc.enable()
+
+def measure(prepare, min_time, repeat):
+  # median and minimum time per operation [us] over repeat runs of n operations, n such that a run takes >= min_time
+  n = 1
+  while True:
+    elapsed = timed(prepare(n))
+    if elapsed >= min_time or n >= 10 ** 7:
+      break
+    n = max(n * 2, int(n * min_time / max(elapsed, 1e-6) * 1.2))
+  times = [elapsed / n]
+  for i in range(repeat - 1):
+    times.append(timed(prepare(n)) / n)
+  times.sort()
+  return {"us_per_op": times[len(times) // 2] * 1e6, "min_us_per_op": times[0] * 1e6,
+          "ops_per_s": 1.0 / times[len(times) // 2], "ops": n, "repeat": repeat}
+
+def environment():
+  return {"python": platform.python_version(), "platform": platform.platform(), "host": socket.gethostname(),
+          "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def compare(results, baseline, tolerance):
+  # rows (name, us/op, baseline us/op, change, regression) and whether any benchmark regressed
+  rows = []
+  regressed = False
+  for name in sorted(results):
+    base = baseline.get(name)
+    us = results[name]["us_per_op"]
+    if base is None:
+      rows.append((name, us, None, None, False))
+      continue
+    change = us / base["us_per_op"] - 1
+    regression = change > tolerance
+    regressed = regressed or regression
+    rows.append((name, us, base["us_per_op"], change, regression))
+  return rows, regressed
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the hot paths of qos_controller against a stored baseline.")
+  parser.add_argument("--filter", help="only the benchmarks whose name matches this regular expression")
+  parser.add_argument("--quick", action="store_true", help="leave out the 1000-request find_matching_link runs")
+  parser.add_argument("--min_time", type=float, default=0.2, help="minimal duration of a timed run [s]")
+  parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+  parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file to compare with (and --save to)")
+  parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown over the baseline counted as a regression")
+  parser.add_argument("--save", action="store_true", help="store the results as the baseline (merged with the benchmarks not run)")
+  parser.add_argument("--json", help="write the results to this file")
+  args = parser.parse_args()
+
+  selected = [(name, bench) for name, bench in BENCHMARKS
+              if (not args.filter or re.search(args.filter, name)) and not (args.quick and "requests=1000/" in name)]
+  core.register("openflow", SimOpenFlow())
+  results = {}
+  stdout = sys.stdout
+  for name, bench in selected:
+    sys.stdout = open(os.devnull, "w") # the controller's own output
+    try:
+      result = measure(bench(), args.min_time, args.repeat)
+    finally:
+      sys.stdout.close()
+      sys.stdout = stdout
+    results[name] = result
+    print "%-45s %12.2f us/op %14.0f op/s" % (name, result["us_per_op"], result["ops_per_s"])
+
+  report = {"environment": environment(), "results": results}
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+
+  stored = None
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as f:
+      stored = json.load(f)
+  status = 0
+  if stored is not None and not args.save:
+    if stored["environment"].get("host") <> report["environment"]["host"] or stored["environment"].get("python") <> report["environment"]["python"]:
+      print "warning: the baseline was recorded on %s with Python %s" % (stored["environment"].get("host"), stored["environment"].get("python"))
+    rows, regressed = compare(results, stored["results"], args.tolerance)
+    print ""
+    print "%-45s %12s %12s %8s" % ("compared with " + os.path.basename(args.baseline), "us/op", "baseline", "change")
+    for name, us, base, change, regression in rows:
+      if base is None:
+        print "%-45s %12.2f %12s %8s" % (name, us, "-", "new")
+      else:
+        print "%-45s %12.2f %12.2f %+7.1f%%%s" % (name, us, base, 100 * change, "  REGRESSION" if regression else "")
+    if regressed:
+      print "slower than the baseline by more than %.0f%%" % (100 * args.tolerance)
+      status = 1
+  if args.save:
+    merged = dict(stored["results"]) if stored is not None else {}
+    merged.update(results)
+    with open(args.baseline, "w") as f:
+      json.dump({"environment": report["environment"], "results": merged}, f, indent=2, sort_keys=True)
+    print "baseline saved to", args.baseline
+  sys.exit(status)
+
+if __name__ == '__main__':
+  main()
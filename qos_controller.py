@@ -15,71 +15,207 @@ from pox.lib.packet.packet_base import packet_base
 from pox.lib.packet.packet_utils import *
 import pox.lib.packet as pkt
 from pox.lib.recoco import Timer
+from qos_routing import Graph, delays_to, constrained_path, path_delay, simple_paths, assign
+from qos_stats import Clock, PortCounters, RingBuffer, make_estimator
+from qos_metrics import Family, Histogram, exposition
+from qos_log import Log
+from qos_store import Writer, KINDS
+from qos_record import Recorder
 
+import sys
 import time
 import json
+import struct
+import zlib
+import os
+import bisect
+import threading
+import signal
+import traceback
+import multiprocessing
+from collections import deque
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
  
 log = core.getLogger()
+
+# Structured log of the periodic output (delays, congestion, paths, request changes): one rate limit per category,
+# records written by a thread of the log, so the handlers and timers never wait for the terminal, see qos_log.py.
+# e.g. ./pox.py qos_controller --log_file=qos.log --log_format=json --log_rate=0.2 --log_rates=delay=1,paths=0
+LOG_FILE = None # records go to stdout unless a file is given
+LOG_FORMAT = "text" # "text" (key=value) or "json" (one object per line)
+LOG_RATE = 1.0 # [records/s] of a category not in LOG_RATES
+LOG_RATES = {"requests": 100.0} # category => records/s, 0 silences the category
+slog = Log(rate=LOG_RATE, rates=LOG_RATES, clock=lambda: clock.us() / 1e6) # rate limits follow the measurement clock
  
-s1_dpid=0
-s2_dpid=0
-s3_dpid=0
-s4_dpid=0
-s5_dpid=0
-
-s2_p1=0
-s3_p1=0
-s4_p1=0
- 
-pre_s2_p1=0
-pre_s3_p1=0
-pre_s4_p1=0
-
-start_time=0
-OWD1=0.0
-OWD2=0.0
-OWD3=0.0
-OWD4=0.0
-
-sent_time1 = 0
-sent_time2 = 0
-sent_time3 = 0
-sent_time4 = 0
-sent_time5 = 0
-sent_time6 = 0
+# all measurement timestamps are integer microseconds from the monotonic clock started by launch()
+clock = Clock()
+
+# Time-series store of the measurements (see qos_store.py), enabled by --store_dir: every delay sample and estimate,
+# lost probe, OWD estimate and port counter delta is appended to fixed-size records on disk, written once per
+# stats interval (or when the buffer is full); segments are closed every STORE_SEGMENT_MB or STORE_SEGMENT_HOURS.
+STORE_DIR = None
+STORE_SEGMENT_MB = 64
+STORE_SEGMENT_HOURS = 24
+STORE_KEEP = 0 # number of segments kept, 0 keeps all
+store = None # qos_store.Writer, times are those of clock [us]
+
+# Recording of the handled events (see qos_record.py), enabled by --record: every ConnectionUp, PacketIn,
+# PortStatsReceived and FlowStatsReceived (and the OWD updates and discovered links they depend on) with the clock
+# time it was handled at, for qos_replay.py to feed them back into the handlers, e.g. to reproduce an incident or to
+# profile the handlers.
+RECORD_FILE = None
+recorder = None # qos_record.Recorder
+
+# per-switch one-way control channel delay (OWD), smoothed over the echo (or stats) request/reply round trips, keyed by dpid [us]
+OWD = {}
+owd_updated = {} # dpid => time of the last OWD sample [us]
+OWD_ALPHA = 0.25 # weight of a new round trip in the smoothed OWD
+OWD_MAX_AGE = 5.0 # [s] an OWD not refreshed for this long is dropped (no compensation until the next reply)
+
+# The OWD is measured with echo requests sent ECHO_RATE times per second, their replies have a fixed small size.
+# Port stats replies grow with the number of ports; they are polled every STATS_INTERVAL seconds for the port
+# counters and are used for the OWD only when echo is disabled (ECHO_RATE = 0).
+ECHO_RATE = 1.0
+STATS_INTERVAL = 1.0
+
+port_counters = PortCounters() # rates of every port of every switch, from the port stats replies
+
+# echo and stats requests in flight: xid => (dpid, sending time), plus the same requests in sending order to expire them
+# (echo requests carry a third field: False for a barrier request whose reply would give no OWD sample)
+REQUEST_TIMEOUT = 2.0 # [s]
+pending_requests = {}
+request_queue = deque()
+requests_lost = {} # dpid => number of requests not answered within REQUEST_TIMEOUT
+
+# switch name (as in qos_net.py, e.g. "s1") <=> dpid, filled in on ConnectionUp
+switch_dpids = {}
+switch_names = {}
 
 network_ready = False
 
+DELAY_HISTORY = 1000 # number of delay samples kept per link
+DELAY_ESTIMATOR = "mean" # how Link.delay is derived from the samples, see qos_stats.ESTIMATORS
+OUTLIER_K = 3.0 # samples further than OUTLIER_K standard deviations from the estimate are dropped, 0 keeps all
+
+DEFAULT_CAPACITY = 1000 # [Mbit/s] capacity of the links not given one, bw=1000 in qos_net.py
+CONGESTION_THRESHOLD = 85 # [%] utilisation above which connections are moved off a link
+RECOMPUTE_INTERVAL = 1.0 # [s] between two runs of find_matching_link
+
 class Link:
-  def __init__(self, name, delay=float("inf")):
+  def __init__(self, name, delay=float("inf"), src=None, src_port=0, src_mac=None, dst=None, dst_port=0, dst_mac=None, capacity=DEFAULT_CAPACITY):
     self.name = name
-    self.delay_hist = []
-    self.delay = delay
-    self.connection = 0
-    self.congestion = 0
+    self.delay_hist = RingBuffer(DELAY_HISTORY) # delay samples [us]
+    self.delay = delay # estimated delay [ms], used for routing
+    self.estimator = make_estimator(DELAY_ESTIMATOR, outlier_k=OUTLIER_K)
+    self.delay_var = 0.0 # variance of the delay samples around the estimate
+    self.connection = [] # requests (or their parts) routed over the link
+    self.capacity = capacity # [Mbit/s] in each direction
+    self.reserved = 0.0 # [Mbit/s] bandwidth reserved by the connections routed over the link
+    self.rate = 0.0 # [bit/s] traffic of the busier direction, from the port counters of dst
+    self.congestion = 0 # utilisation [%]: rate / capacity
+    # link endpoints: switch names, OpenFlow port numbers and interface MACs (see qos_net.py)
+    self.src = src
+    self.src_port = src_port
+    self.src_mac = src_mac
+    self.dst = dst
+    self.dst_port = dst_port
+    self.dst_mac = dst_mac
+    # per-link probe state
+    self.id = 0 # link id carried in the probe header, assigned by add_link
+    self.seq = 0 # sequence number of the last probe sent
+    self.probe_hdr = None # prebuilt L2 header of the probe frame, only the myproto header changes between probes
+    self.probes_sent = 0
+    self.probes_received = 0
+    self.probes_lost = 0 # probes not answered within PROBE_TIMEOUT
+    self.last_probe_time = 0 # [us]
 
-links = {
-  "s1-s2": Link("s1-s2"),
-  "s1-s3": Link("s1-s3"),
-  "s1-s4": Link("s1-s4"),
+  def probe_data(self, seq, timestamp):
+    if self.probe_hdr is None:
+      e = pkt.ethernet()
+      e.src = EthAddr(self.src_mac)
+      e.dst = EthAddr(self.dst_mac)
+      e.type = 0x5577 # unregistered EtherType, here assigned to the probe packet type
+      self.probe_hdr = e.pack()
+    f = myproto()
+    f.timestamp = timestamp
+    f.link_id = self.id
+    f.seq = seq
+    return self.probe_hdr + f.hdr(None)
+
+# link table: every inter-switch link to be probed, probes are sent from src and come back as PacketIn from dst;
+# links found by openflow.discovery (if that component is launched) are added to it at run time
+LINK_TABLE = [
+  # name,   src,  src_port, src_mac,       dst,  dst_port, dst_mac,       capacity [Mbit/s]
+  ("s1-s2", "s1", 4,        "0:1:0:0:0:4", "s2", 1,        "0:2:0:0:0:1", 1000),
+  ("s1-s3", "s1", 5,        "0:1:0:0:0:5", "s3", 1,        "0:3:0:0:0:1", 1000),
+  ("s1-s4", "s1", 6,        "0:1:0:0:0:6", "s4", 1,        "0:4:0:0:0:1", 1000),
+  ("s2-s5", "s2", 2,        "0:2:0:0:0:2", "s5", 1,        "0:5:0:0:0:1", 1000),
+  ("s3-s5", "s3", 2,        "0:3:0:0:0:2", "s5", 2,        "0:5:0:0:0:2", 1000),
+  ("s4-s5", "s4", 2,        "0:4:0:0:0:2", "s5", 3,        "0:5:0:0:0:3", 1000),
+]
+
+# host table: the edge switch and port every host is attached to
+HOSTS = {
+  # host: (switch, port, IP)
+  "h1": ("s1", 1, "10.0.0.1"),
+  "h2": ("s1", 2, "10.0.0.2"),
+  "h3": ("s1", 3, "10.0.0.3"),
+  "h4": ("s5", 4, "10.0.0.4"),
+  "h5": ("s5", 5, "10.0.0.5"),
+  "h6": ("s5", 6, "10.0.0.6"),
 }
 
-# probe protocol packet definition; only timestamp field is present in the header (no payload part)
+links = {}
+links_by_dst = {} # (dst switch name, dst port) => Link, used to match port counters
+links_by_id = {} # link id => Link, used to match probe PacketIns
+next_link_id = 1
+
+def add_link(name, src, src_port, src_mac, dst, dst_port, dst_mac, capacity=DEFAULT_CAPACITY):
+  global next_link_id
+  link = Link(name, src=src, src_port=src_port, src_mac=src_mac, dst=dst, dst_port=dst_port, dst_mac=dst_mac, capacity=capacity)
+  link.id = next_link_id
+  next_link_id = (next_link_id % 0xFFFF) + 1
+  links[name] = link
+  links_by_dst[(dst, dst_port)] = link
+  links_by_id[link.id] = link
+  return link
+
+def remove_link(name):
+  link = links.pop(name, None)
+  if link is not None:
+    links_by_dst.pop((link.dst, link.dst_port), None)
+    links_by_id.pop(link.id, None)
+  return link
+
+configured_links = set() # names of the links from LINK_TABLE, discovery does not remove them
+
+# probe protocol packet definition; the header carries the timestamp, link id and sequence number (no payload part)
 class myproto(packet_base):
   # My Protocol packet struct
   """
   myproto class defines our special type of packet to be sent all the way along including the link between the switches to measure link delays;
-  it adds member attribute named timestamp to carry packet creation/sending time by the controller, and defines the 
-  function hdr() to return the header of measurement packet (header will contain timestamp)
+  it adds member attribute named timestamp to carry packet creation/sending time by the controller, link_id and seq
+  to identify the link and the probe round, and defines the function hdr() to return the header of measurement packet
+  (header will contain timestamp, link_id and seq; the timestamp stays first so that it is where it always was)
   """
   # For more info on packet_base class refer to file pox/lib/packet/packet_base.py
 
   def __init__(self):
      packet_base.__init__(self)
      self.timestamp=0
+     self.link_id=0
+     self.seq=0
 
   def hdr(self, payload):
-     return struct.pack('!I', self.timestamp) # code as unsigned int (I), network byte order (!, big-endian - the most significant byte of a word at the smallest memory address)
+     # timestamp and seq as unsigned int (I), link_id as unsigned short (H), network byte order (!, big-endian - the most significant byte of a word at the smallest memory address)
+     # the timestamp is in us and wraps around every 2**32 us (about 71.6 minutes)
+     return struct.pack('!IHI', self.timestamp & 0xFFFFFFFF, self.link_id, self.seq)
+
+  @staticmethod
+  def parse(raw):
+    # returns (timestamp, link_id, seq) of a received probe header
+    return struct.unpack('!IHI', raw[:10])
 
 def getTheTime():
   # function to create a timestamp
@@ -103,587 +239,1609 @@ def getTheTime():
   then +="]%s.%s.%s" % (hrs,mins,secs)
   return then
 
-def measure_delay(src_dpid, dst_dpid, src_mac, dst_mac, port):
-  global start_time
-  if src_dpid <>0 and not core.openflow.getConnection(src_dpid) is None:
-    # send out port_stats_request packet through switch with src_pid connection (to measure T1)
-    core.openflow.getConnection(src_dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-    sent_time1=time.time() * 1000*10 - start_time # sending time of stats_req: ctrl => switch1
-    # print "sent_time1:", sent_time1
-
-    # sequence of packet formating operations optimised to reduce the delay variation of e-2-e measurements (to measure T3)
-    f = myproto() # create a probe packet object
-    e = pkt.ethernet() # create L2 type packet (frame) object
-    e.src = EthAddr(src_mac)
-    e.dst = EthAddr(dst_mac)
-    e.type=0x5577 # set unregistered EtherType in L2 header type field, here assigned to the probe packet type 
-    msg = of.ofp_packet_out() # create PACKET_OUT message object
-    msg.actions.append(of.ofp_action_output(port=port)) # set the output port for the packet in switch1
-    f.timestamp = int(time.time()*1000*10 - start_time) # set the timestamp in the probe packet
-    # print f.timestamp
-    e.payload = f
-    msg.data = e.pack()
-    core.openflow.getConnection(src_dpid).send(msg)
-    # print "=====> probe sent: f=", f.timestamp, " after=", int(time.time()*1000*10 - start_time), " [10*ms]"
-
-  # the following executes only when a connection to 'switch1' exists (otherwise AttributeError can be raised)
-  if dst_dpid <>0 and not core.openflow.getConnection(dst_dpid) is None:
-    # send out port_stats_request packet through switch1 connection dst_dpid (to measure T2)
-    core.openflow.getConnection(dst_dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-    sent_time2=time.time() * 1000*10 - start_time # sending time of stats_req: ctrl => switch1
-    # print "sent_time2:", sent_time2
-
-  return sent_time1, sent_time2
+def send_stats_request(dpid):
+  # send out port_stats_request packet through switch with dpid connection (to measure its OWD)
+  connection = core.openflow.getConnection(dpid)
+  if connection is None:
+    return False
+  msg = of.ofp_stats_request(body=of.ofp_port_stats_request())
+  connection.send(msg)
+  sent_time = clock.us() # sending time of stats_req: ctrl => switch
+  pending_requests[msg.xid] = (dpid, sent_time)
+  request_queue.append((sent_time, msg.xid))
+  return True
+
+def send_echo_request(dpid):
+  # send out echo_request through switch with dpid connection (to measure its OWD)
+  connection = core.openflow.getConnection(dpid)
+  if connection is None:
+    return False
+  msg = echo_request()
+  connection.send(msg)
+  sent_time = clock.us()
+  # a barrier is answered once the flow_mods sent before it are done: right after flow_mods its reply is late
+  last = flow_mod_times.get(dpid)
+  sample = echo_request is not of.ofp_barrier_request or last is None or sent_time - last >= BARRIER_SETTLE * 1000000
+  pending_requests[msg.xid] = (dpid, sent_time, sample)
+  request_queue.append((sent_time, msg.xid))
+  return True
+
+def _handle_echo_reply (connection, msg):
+  received_time = clock.us()
+  pending = pending_requests.pop(msg.xid, None)
+  if pending is not None and pending[0] == connection.dpid:
+    if not pending[2]:
+      samples_dropped[connection.dpid] = samples_dropped.get(connection.dpid, 0) + 1
+      return
+    echo_matched.add(connection.dpid)
+    update_owd(connection.dpid, (received_time - pending[1]) // 2, received_time)
+
+# POX consumes echo replies itself without raising an event: its handler is wrapped to pass them to
+# _handle_echo_reply. of_01 dispatches through the handlers table it builds from handlerMap at import, so the
+# table is patched (handlerMap only kept in step with it), and connections that carry their own table are patched
+# as they come up. POX versions without the handler map get barrier requests instead, also answered with a
+# bare OpenFlow header, at the cost of waiting for the flow_mods queued before them: the replies to barriers sent
+# within BARRIER_SETTLE of a flow_mod to the switch are matched but give no OWD sample (samples_dropped).
+# Until a switch has answered an echo request its OWD keeps coming from the stats replies (echo_matched), so a
+# hook that does not fire costs the precision of the echo, not the OWDs.
+echo_request = of.ofp_echo_request
+echo_matched = set() # dpids whose echo replies reached _handle_echo_reply
+echo_handler = None # handle_echo_reply wrapper, for the tables of the connections
+BARRIER_SETTLE = 0.5 # [s]
+samples_dropped = {} # dpid => barrier replies not used as OWD samples
+
+def wrap_echo_reply(previous):
+  handle_echo_reply = timed(_handle_echo_reply)
+  def handle_ECHO_REPLY (con, msg):
+    handle_echo_reply(con, msg)
+    previous(con, msg)
+  handle_ECHO_REPLY.wrapped = previous
+  return handle_ECHO_REPLY
+
+def patch_echo_entry(table):
+  # wrap the echo reply entry of a dispatch table (list indexed by message type, or dict), once
+  try:
+    previous = table[of.OFPT_ECHO_REPLY]
+  except (IndexError, KeyError, TypeError):
+    return False
+  if previous is None:
+    return False
+  if getattr(previous, "wrapped", None) is None:
+    table[of.OFPT_ECHO_REPLY] = wrap_echo_reply(previous)
+  return True
+
+def hook_echo_replies():
+  global echo_request, echo_handler
+  import pox.openflow.of_01 as of_01
+  handler_map = getattr(of_01, "handlerMap", None)
+  if handler_map is None or of.OFPT_ECHO_REPLY not in handler_map:
+    echo_request = of.ofp_barrier_request
+    return False
+  patch_echo_entry(handler_map)
+  echo_handler = handler_map[of.OFPT_ECHO_REPLY]
+  table = getattr(of_01, "handlers", None)
+  if table is not None and table is not handler_map:
+    try:
+      table[of.OFPT_ECHO_REPLY] = echo_handler
+    except (IndexError, TypeError):
+      pass
+  return True
+
+def hook_connection_echo(connection):
+  # connections of POX versions that copy the dispatch table get the wrapped handler in their own copy
+  table = getattr(connection, "handlers", None)
+  if echo_handler is not None and table is not None:
+    patch_echo_entry(table)
+
+def expire_requests(now):
+  # drop the requests older than REQUEST_TIMEOUT and the OWDs older than OWD_MAX_AGE
+  while request_queue and now - request_queue[0][0] > REQUEST_TIMEOUT * 1000000:
+    sent_time, xid = request_queue.popleft()
+    pending = pending_requests.pop(xid, None)
+    if pending is not None:
+      requests_lost[pending[0]] = requests_lost.get(pending[0], 0) + 1
+  for dpid, updated in owd_updated.items():
+    if now - updated > OWD_MAX_AGE * 1000000:
+      del owd_updated[dpid]
+      OWD.pop(dpid, None)
+
+def update_owd(dpid, sample, now):
+  if dpid in OWD:
+    OWD[dpid] = int((1 - OWD_ALPHA) * OWD[dpid] + OWD_ALPHA * sample)
+  else:
+    OWD[dpid] = sample
+  owd_updated[dpid] = now
+  if store is not None:
+    store.append(now, "switch:%s" % switch_names.get(dpid, dpid), KINDS["owd"], OWD[dpid])
+  if recorder is not None:
+    recorder.owd(dpid, OWD[dpid]) # echo and barrier replies are not recorded, the OWDs they give are
+
+PROBE_RATE = 1.0 # probes sent per link per second
+PROBE_TIMEOUT = 2.0 # [s] probes not answered within this time are counted as lost
+
+# probes in flight: (link id, seq) => sending time, plus the same probes in sending order to expire them cheaply
+pending_probes = {}
+probe_queue = deque()
+
+def send_probe(link):
+  # send the probe packet out of link.src_port of the source switch (to measure T3)
+  src_dpid = switch_dpids.get(link.src, 0)
+  connection = core.openflow.getConnection(src_dpid) if src_dpid <> 0 else None
+  if connection is None:
+    return False
+  msg = of.ofp_packet_out() # create PACKET_OUT message object
+  msg.actions.append(of.ofp_action_output(port=link.src_port)) # set the output port for the packet in the source switch
+  link.seq = (link.seq + 1) & 0xFFFFFFFF
+  sent_time = clock.us()
+  link.last_probe_time = sent_time
+  msg.data = link.probe_data(link.seq, sent_time) # the L2 header is prebuilt, only myproto is packed here
+  connection.send(msg)
+  pending_probes[(link.id, link.seq)] = sent_time
+  probe_queue.append((sent_time, link.id, link.seq))
+  link.probes_sent += 1
+  return True
+
+def expire_probes(now):
+  # drop the probes older than PROBE_TIMEOUT; probe_queue is in sending order so only expired entries are visited
+  while probe_queue and now - probe_queue[0][0] > PROBE_TIMEOUT * 1000000:
+    sent_time, link_id, seq = probe_queue.popleft()
+    if pending_probes.pop((link_id, seq), None) is not None and link_id in links_by_id:
+      links_by_id[link_id].probes_lost += 1
+      if store is not None:
+        store.append(now, "link:" + links_by_id[link_id].name, KINDS["probe_lost"], 1)
+
+def _probe_func ():
+  # one probe round: one probe per link whose both ends are connected
+  expire_probes(clock.us())
+  for link in links.values():
+    if link.src in switch_dpids and link.dst in switch_dpids:
+      send_probe(link)
+
+def probed_switches():
+  # dpids of the switches that terminate a probed link
+  switches = set()
+  for link in links.values():
+    if link.src in switch_dpids and link.dst in switch_dpids:
+      switches.add(switch_dpids[link.src])
+      switches.add(switch_dpids[link.dst])
+  return switches
+
+def _echo_func ():
+  # one echo request per switch that terminates a probed link, to measure the OWDs
+  expire_requests(clock.us())
+  for dpid in probed_switches():
+    send_echo_request(dpid)
 
 def _timer_func ():
-  global s1_dpid, s2_dpid, s3_dpid, s4_dpid, s5_dpid
-  global start_time, sent_time1, sent_time2, sent_time3, sent_time4, sent_time5, sent_time6
-  
-  sent_time1, sent_time2 = measure_delay(s1_dpid, s2_dpid, "0:1:0:0:0:4", "0:2:0:0:0:1", 4)
-  sent_time3, sent_time4 = measure_delay(s1_dpid, s3_dpid, "0:1:0:0:0:5", "0:3:0:0:0:1", 5)
-  sent_time5, sent_time6 = measure_delay(s1_dpid, s4_dpid, "0:1:0:0:0:6", "0:4:0:0:0:1", 6)
-  
+  # a single stats request per connected switch, for the port counters (and the OWDs without echo)
+  expire_requests(clock.us())
+  for dpid in switch_names:
+    send_stats_request(dpid)
+  for dpid in set(flow[0] for flow in conn_flows.values()):
+    send_flow_stats_request(dpid)
+  if store is not None:
+    store.flush()
+  if recorder is not None:
+    recorder.flush()
+
+  if slog.allow("delay"):
+    slog.write("delay", "estimates_ms", dict((name, link.delay) for name, link in links.items()))
 
 def _handle_portstats_received (event):
   # Observe the handling of port statistics provided by this function.
-  global s1_dpid, s2_dpid, s3_dpid, s4_dpid, s5_dpid
-  global s2_p1, s3_p1, s4_p1
-  global pre_s2_p1, pre_s3_p1, pre_s4_p1
-  global OWD1, OWD2, OWD3, OWD4
-
-  received_time = time.time() * 1000*10 - start_time
-  # measure T1 as of lab guide
-  if event.connection.dpid == s1_dpid:
-    OWD1=0.5*(received_time - sent_time1)
- 
-  # measure T2 as of lab guide
-  elif event.connection.dpid == s2_dpid:
-    OWD2=0.5*(received_time - sent_time2)
-  
-  elif event.connection.dpid == s3_dpid:
-    OWD3=0.5*(received_time - sent_time4)
-  
-  elif event.connection.dpid == s4_dpid:
-    OWD4=0.5*(received_time - sent_time6)
- 
-  if event.connection.dpid==s2_dpid:
-    for f in event.stats:
-      if int(f.port_no)<65534:
-        if f.port_no==1:
-          pre_s2_p1=s2_p1
-          #s2_p1=f.rx_packets
-          s2_p1=f.rx_bytes
-          congestion = s2_p1 - pre_s2_p1
-          links["s1-s2"].congestion = congestion
-    #print getTheTime(), "s2_p1(Received):", congestion
- 
-  if event.connection.dpid==s3_dpid:
-    for f in event.stats:
-      if int(f.port_no)<65534:
-        if f.port_no==1:
-          pre_s3_p1=s3_p1
-          #s3_p1=f.rx_packets
-          s3_p1=f.rx_bytes
-          congestion = s3_p1 - pre_s3_p1
-          links["s1-s3"].congestion = congestion
-    #print getTheTime(), "s3_p1(Received):", congestion
-
-  if event.connection.dpid==s4_dpid:
-    for f in event.stats:
-      if int(f.port_no)<65534:
-        if f.port_no==1:
-          pre_s4_p1=s4_p1
-          #s4_p1=f.rx_packets
-          s4_p1=f.rx_bytes
-          congestion = s4_p1 - pre_s4_p1
-          links["s1-s4"].congestion = congestion
-    #print getTheTime(), "s4_p1(Received):", congestion
+  received_time = clock.us()
+  dpid = event.connection.dpid
+  # measure T1/T2 as of lab guide, for every switch that was sent a stats request (when echo requests are not used,
+  # or none of this switch's echo replies has been seen yet)
+  # the reply is matched to its own request by xid, replies to expired or unknown requests give no OWD sample
+  msg = event.ofp[0] if isinstance(event.ofp, list) else event.ofp # multipart replies come as a list of parts
+  pending = pending_requests.pop(msg.xid, None)
+  if pending is not None and pending[0] == dpid and (ECHO_RATE == 0 or dpid not in echo_matched):
+    update_owd(dpid, (received_time - pending[1]) // 2, received_time)
+
+  # counters of every port are turned into rates over the time between two replies; rx/tx on the destination
+  # port of a link is the traffic carried by that link in each direction
+  name = switch_names.get(dpid)
+  for f in event.stats:
+    if int(f.port_no)<65534:
+      if store is not None:
+        store_counters(name, dpid, f, received_time)
+      i = port_counters.update((dpid, f.port_no), received_time, f.rx_bytes, f.tx_bytes, f.rx_packets, f.tx_packets)
+      link = links_by_dst.get((name, f.port_no))
+      if link is not None:
+        link.rate = max(port_counters.rates[4*i], port_counters.rates[4*i + 1])
+        link.congestion = 100.0 * link.rate / (link.capacity * 1000000)
+        #print getTheTime(), link.name, "(Received):", link.rate
+
+def store_counters(name, dpid, f, now):
+  # byte counter deltas of a port since its previous reply, before port_counters takes the new values
+  i = port_counters.slots.get((dpid, f.port_no))
+  if i is None or port_counters.times[i] < 0:
+    return
+  rx = f.rx_bytes - port_counters.counters[4*i]
+  tx = f.tx_bytes - port_counters.counters[4*i + 1]
+  if rx >= 0 and tx >= 0: # a reset port gives no delta
+    series = "port:%s:%d" % (name, f.port_no)
+    store.append(now, series, KINDS["rx_bytes"], rx)
+    store.append(now, series, KINDS["tx_bytes"], tx)
 
 def _handle_ConnectionUp (event):
-  # waits for connections from all switches, after connecting to all of them it starts a round robin timer for triggering h1-h4 routing changes
-  global s1_dpid, s2_dpid, s3_dpid, s4_dpid, s5_dpid, network_ready
+  # waits for connections from all switches, after connecting to all of them it starts the probe and routing timers
+  global network_ready
   print "ConnectionUp: ",dpidToStr(event.connection.dpid)
+  flow_tables.pop(event.connection.dpid, None) # a (re)connected switch has to get all its rules again
+  echo_matched.discard(event.connection.dpid) # its OWD comes from the stats replies until it answers an echo request
+  if ECHO_RATE > 0:
+    hook_connection_echo(event.connection)
  
   #remember the connection dpid for the switch
   for m in event.connection.features.ports:
-    if m.name == "s1-eth0":
-      # s1_dpid: the DPID (datapath ID) of switch s1;
-      s1_dpid = event.connection.dpid
-      print "s1_dpid=", s1_dpid
-    elif m.name == "s2-eth0":
-      s2_dpid = event.connection.dpid
-      print "s2_dpid=", s2_dpid
-    elif m.name == "s3-eth0":
-      s3_dpid = event.connection.dpid
-      print "s3_dpid=", s3_dpid
-    elif m.name == "s4-eth0":
-      s4_dpid = event.connection.dpid
-      print "s4_dpid=", s4_dpid
-    elif m.name == "s5-eth0":
-      s5_dpid = event.connection.dpid
-      print "s5_dpid=", s5_dpid
+    if "-eth" in m.name:
+      # ports are named <switch>-eth<n> by qos_net.py
+      name = m.name.split("-eth")[0]
+      if switch_dpids.get(name) <> event.connection.dpid:
+        print "%s_dpid=" % name, event.connection.dpid
+      switch_dpids[name] = event.connection.dpid
+      switch_names[event.connection.dpid] = name
  
-  # start 1-second recurring loop timer for QoS routung updates; _timer_func is to be called on timer expiration to change the flow entry in s1 and s5
-  if s1_dpid<>0 and s2_dpid<>0 and s3_dpid<>0 and s4_dpid<>0 and s5_dpid<>0:
+  provision_switch(event.connection)
+
+  # start 1-second recurring loop timers for probing and QoS routing updates once every configured switch is connected
+  required = set(entry[1] for entry in LINK_TABLE) | set(entry[4] for entry in LINK_TABLE) | set(host[0] for host in HOSTS.values())
+  if not network_ready and required.issubset(switch_dpids):
     network_ready = True
-    Timer(1, _timer_func, recurring=True)
-    Timer(1, find_matching_link, recurring=True)
+    Timer(STATS_INTERVAL, timed(_timer_func), recurring=True)
+    if ECHO_RATE > 0:
+      Timer(1.0 / ECHO_RATE, timed(_echo_func), recurring=True)
+    Timer(1.0 / PROBE_RATE, timed(_probe_func), recurring=True)
+    Timer(RECOMPUTE_INTERVAL, timed(find_matching_link), recurring=True)
+
+# Default rules of every switch, pushed once when the switch connects:
+#    - the edge switches s1 and s5 forward IP packets by destination address, towards s2/s3/s4 for the hosts on the other side,
+#    - the transit switches s2, s3, s4 forward ARP (x0806) and IP (x0800) packets between their ports 1 and 2.
+# Routes set by find_matching_link (setPath) replace the edge rules for the requested connections.
+DEFAULT_RULES = [
+  # switch, priority, in_port, dl_type, nw_dst, out_port
+  ("s1", 100, None, 0x0800, "10.0.0.1", 1),
+  ("s1", 100, None, 0x0800, "10.0.0.2", 2),
+  ("s1", 100, None, 0x0800, "10.0.0.3", 3),
+  ("s1", 100, None, 0x0800, "10.0.0.4", 4),
+  ("s1", 100, None, 0x0800, "10.0.0.5", 5),
+  ("s1", 100, None, 0x0800, "10.0.0.6", 6),
+  ("s5", 100, None, 0x0800, "10.0.0.1", 1),
+  ("s5", 100, None, 0x0800, "10.0.0.2", 2),
+  ("s5", 100, None, 0x0800, "10.0.0.3", 3),
+  ("s5", 100, None, 0x0800, "10.0.0.4", 4),
+  ("s5", 100, None, 0x0800, "10.0.0.5", 5),
+  ("s5", 100, None, 0x0800, "10.0.0.6", 6),
+  ("s5", 10,  6,    None,   None,       3),
+] + [
+  (switch, 10, in_port, dl_type, None, 3 - in_port)
+    for switch in ("s2", "s3", "s4") for in_port in (1, 2) for dl_type in (0x0806, 0x0800)
+]
+
+# ports the edge switches send ARP packets to, by target IP
+ARP_PORTS = {
+  "s1": {"10.0.0.1": 1, "10.0.0.2": 2, "10.0.0.3": 3, "10.0.0.4": 4, "10.0.0.5": 5, "10.0.0.6": 6},
+  "s5": {"10.0.0.1": 1, "10.0.0.2": 2, "10.0.0.3": 3, "10.0.0.4": 4, "10.0.0.5": 5, "10.0.0.6": 6},
+}
+
+provisioned = set() # dpids of the switches that confirmed their default rules with a barrier reply
+pending_barriers = {} # dpid => xid of the barrier request sent after the default rules
+
+def provision_switch(connection):
+  # push the default rules of the switch followed by a barrier, the switch counts as provisioned once the barrier is answered
+  dpid = connection.dpid
+  provisioned.discard(dpid)
+  name = switch_names.get(dpid)
+  for switch, priority, in_port, dl_type, nw_dst, out_port in DEFAULT_RULES:
+    if switch <> name:
+      continue
+    msg = of.ofp_flow_mod()
+    msg.priority = priority
+    msg.idle_timeout = 0
+    msg.hard_timeout = 0
+    if in_port is not None:
+      msg.match.in_port = in_port
+    if dl_type is not None:
+      msg.match.dl_type = dl_type
+    if nw_dst is not None:
+      msg.match.nw_dst = nw_dst
+    msg.actions.append(of.ofp_action_output(port = out_port))
+    send_flow_mod(dpid, msg)
+  barrier = of.ofp_barrier_request()
+  pending_barriers[dpid] = barrier.xid
+  connection.send(barrier)
+
+def _handle_BarrierIn (event):
+  if pending_barriers.get(event.dpid) == event.xid:
+    del pending_barriers[event.dpid]
+    provisioned.add(event.dpid)
+    print "provisioned:", switch_names.get(event.dpid, dpidToStr(event.dpid))
+  elif event.xid in pending_requests:
+    _handle_echo_reply(event.connection, event.ofp) # barrier used in place of echo, see hook_echo_replies
+
+def link_between(a, a_port, b, b_port):
+  # the Link between two switch ports, in either direction: one Link (one probe direction, one capacity) per physical link
+  for dst, dst_port, src, src_port in ((b, b_port, a, a_port), (a, a_port, b, b_port)):
+    link = links_by_dst.get((dst, dst_port))
+    if link is not None and (link.src, link.src_port) == (src, src_port):
+      return link
+  return None
+
+def _handle_LinkEvent (event):
+  # keep the link table in sync with the links found by openflow.discovery; discovery reports each direction of a
+  # link, the first one creates the Link and the other one is the same physical link
+  l = event.link
+  src = switch_names.get(l.dpid1, dpidToStr(l.dpid1))
+  dst = switch_names.get(l.dpid2, dpidToStr(l.dpid2))
+  link = link_between(src, l.port1, dst, l.port2)
+  if event.added:
+    if link is not None or (dst, l.port2) in links_by_dst:
+      return # already in the link table, in this or the other direction
+    src_conn = core.openflow.getConnection(l.dpid1)
+    dst_conn = core.openflow.getConnection(l.dpid2)
+    if src_conn is None or dst_conn is None:
+      return
+    add_link("%s-%s" % (src, dst), src, l.port1, src_conn.ports[l.port1].hw_addr, dst, l.port2, dst_conn.ports[l.port2].hw_addr)
+  elif event.removed:
+    if link is not None and link.name not in configured_links:
+      remove_link(link.name)
 
 def calculate_delay(received_time, d, OWD1, OWD2, link_name):
+    # all times in us; a compensation larger than the measured time (measurement noise) gives a zero delay
     global links
-    delay_c = int((received_time - d - OWD1 - OWD2) / 10)
-    links[link_name].delay_hist.append(delay_c)
-    links[link_name].delay = sum(links[link_name].delay_hist[-2:]) / 2
+    delay_c = max(0, received_time - d - OWD1 - OWD2)
+    link = links[link_name]
+    link.delay_hist.append(delay_c)
+    link.delay = link.estimator.update(delay_c / 1000.0)
+    link.delay_var = link.estimator.variance
+    if store is not None:
+      store.append(received_time, "link:" + link_name, KINDS["delay_sample"], delay_c / 1000.0)
+      store.append(received_time, "link:" + link_name, KINDS["delay_estimate"], link.delay)
+
+# shadow flow tables: controller-side copy of the permanent rules installed in every switch, so that a flow_mod
+# is only sent when it changes what the switch already has
+flow_tables = {} # dpid => {flow_key: (output ports, idle_timeout, hard_timeout)}
+flow_mods_sent = 0
+flow_mod_times = {} # dpid => time the last flow_mod was sent to the switch [us]
+flow_mods_suppressed = 0
+
+def flow_key(priority, match):
+  return (priority, match.in_port, match.dl_type, str(match.nw_src), str(match.nw_dst), match.nw_proto, match.tp_src, match.tp_dst)
+
+def send_flow_mod(dpid, msg):
+  # send msg to the switch unless its shadow table shows the same rule is already installed
+  global flow_mods_sent, flow_mods_suppressed
+  connection = core.openflow.getConnection(dpid)
+  if connection is None:
+    return False
+  table = flow_tables.setdefault(dpid, {})
+  key = flow_key(msg.priority, msg.match)
+  value = (tuple(action.port for action in msg.actions), msg.idle_timeout, msg.hard_timeout)
+  if msg.command in (of.OFPFC_DELETE, of.OFPFC_DELETE_STRICT):
+    table.pop(key, None)
+  elif table.get(key) == value:
+    flow_mods_suppressed += 1
+    return False
+  elif msg.idle_timeout == 0 and msg.hard_timeout == 0:
+    table[key] = value
+  else:
+    table.pop(key, None) # an expiring rule replaces what was there, the next update of that rule has to be sent
+  connection.send(msg)
+  flow_mods_sent += 1
+  flow_mod_times[dpid] = clock.us()
+  return True
 
-flag = 0
+def _handle_FlowRemoved (event):
+  # a rule expired or was deleted in the switch, forget it so that it is installed again when needed
+  key = flow_key(event.ofp.priority, event.ofp.match)
+  flow_tables.get(event.connection.dpid, {}).pop(key, None)
+  entry = microflows.pop((event.connection.dpid, key), None)
+  if entry is not None:
+    bucket_flows.get(entry[0], {}).pop(entry[1], None)
 
-def setPath(dpid, srcIP, dstIP, port):
+# Match granularity of the QoS rules set by setPath:
+#    - "dst": destination address only, like the edge rules; connections sharing a host share the rules towards it,
+#      so they are kept on the same links,
+#    - "pair": source and destination address, every connection is placed on its own path,
+#    - "5tuple": every transport flow (protocol and ports) gets its own expiring rule, set when its first packet reaches
+#      the controller; the flows of a connection are hashed into FLOW_BUCKETS buckets, each placed on its own path.
+GRANULARITY = "pair"
+FLOW_BUCKETS = 4
+FLOW_IDLE_TIMEOUT = 10 # [s] the rules of a transport flow expire when it is idle for this long
+FLOW_PRIORITY = 120 # rules of single transport flows, above the connection rules
+
+def path_priority():
+  # the destination rules replace the edge rules (same match), the finer ones are set above them
+  return 100 if GRANULARITY == "dst" else 110
+
+def setPath(dpid, srcIP, dstIP, port, flow=None):
+  # flow: (nw_proto, tp_src, tp_dst) for the rule of a single transport flow, None for the connection rule
   if dpid<>0:
     msg = of.ofp_flow_mod()
     msg.command=of.OFPFC_MODIFY_STRICT
-    msg.priority = 100
-    msg.idle_timeout = 0
+    msg.priority = path_priority() if flow is None else FLOW_PRIORITY
+    msg.idle_timeout = 0 if flow is None else FLOW_IDLE_TIMEOUT
     msg.hard_timeout = 0
+    msg.flags = of.OFPFF_SEND_FLOW_REM
+    msg.match.dl_type = 0x0800
+    msg.match.nw_dst = str(dstIP)
+    if GRANULARITY <> "dst":
+      msg.match.nw_src = str(srcIP)
+    if flow is not None:
+      msg.match.nw_proto, msg.match.tp_src, msg.match.tp_dst = flow
+    msg.actions.append(of.ofp_action_output(port = port))
+    send_flow_mod(dpid, msg)
+    return flow_key(msg.priority, msg.match)
+
+def install_path(path, src, dst, flow=None):
+  # set the route src => dst hop by hop on every switch of the path, and the way back on the same switches;
+  # returns (dpid, flow_key) of the rule the traffic src => dst enters the network through
+  src_switch, src_port, srcIP = HOSTS[src]
+  dst_switch, dst_port, dstIP = HOSTS[dst]
+  back = None if flow is None else (flow[0], flow[2], flow[1])
+  ingress = None
+  for edge in path:
+    key = setPath(switch_dpids.get(edge.src, 0), srcIP, dstIP, edge.out_port, flow)
+    if ingress is None:
+      ingress = (switch_dpids.get(edge.src, 0), key)
+    setPath(switch_dpids.get(edge.dst, 0), dstIP, srcIP, edge.in_port, back)
+  key = setPath(switch_dpids.get(dst_switch, 0), srcIP, dstIP, dst_port, flow)
+  setPath(switch_dpids.get(src_switch, 0), dstIP, srcIP, src_port, back)
+  return ingress if ingress is not None else (switch_dpids.get(dst_switch, 0), key)
+
+def deletePath(dpid, srcIP, dstIP, flow=None):
+  # remove the rule set by setPath with the same arguments
+  if dpid<>0:
+    msg = of.ofp_flow_mod()
+    msg.command=of.OFPFC_DELETE_STRICT
+    msg.priority = path_priority() if flow is None else FLOW_PRIORITY
     msg.match.dl_type = 0x0800
     msg.match.nw_dst = str(dstIP)
-    #msg.match.nw_src = str(srcIP)
-    msg.actions.append(of.ofp_action_output(port = port+2))
-    core.openflow.getConnection(dpid).send(msg)
+    if GRANULARITY <> "dst":
+      msg.match.nw_src = str(srcIP)
+    if flow is not None:
+      msg.match.nw_proto, msg.match.tp_src, msg.match.tp_dst = flow
+    send_flow_mod(dpid, msg)
+
+def path_switches(path, src):
+  # the switches install_path sets rules on
+  return [HOSTS[src][0]] + [edge.dst for edge in path]
+
+def clear_path(path, src, dst, flow=None, switches=None):
+  # remove the rules set by install_path, in both directions; on the given switches of the path only
+  srcIP, dstIP = HOSTS[src][2], HOSTS[dst][2]
+  back = None if flow is None else (flow[0], flow[2], flow[1])
+  for switch in (path_switches(path, src) if switches is None else switches):
+    deletePath(switch_dpids.get(switch, 0), srcIP, dstIP, flow)
+    deletePath(switch_dpids.get(switch, 0), dstIP, srcIP, back)
+
+# 5-tuple granularity: the connection rules at both ends send the packets to the controller, which places every new
+# transport flow on the path of its bucket
+flow_conns = {} # (source IP, destination IP) => (request, True if in the request's direction)
+microflows = {} # (dpid, flow_key) of the ingress rule of a transport flow => (bucket key, flow)
+bucket_flows = {} # bucket key => {flow: links of the path its rules were set on}
+
+def install_punt(conn):
+  src_switch, src_port, srcIP = HOSTS[conn["src"]]
+  dst_switch, dst_port, dstIP = HOSTS[conn["dst"]]
+  setPath(switch_dpids.get(src_switch, 0), srcIP, dstIP, of.OFPP_CONTROLLER)
+  setPath(switch_dpids.get(dst_switch, 0), dstIP, srcIP, of.OFPP_CONTROLLER)
+  flow_conns[(srcIP, dstIP)] = (conn, True)
+  flow_conns[(dstIP, srcIP)] = (conn, False)
+
+def install_flow(key, conn, flow, path):
+  microflows[install_path(path, conn["src"], conn["dst"], flow)] = (key, flow)
+  bucket_flows.setdefault(key, {})[flow] = [edge.key for edge in path]
+
+def flow_bucket(srcIP, dstIP, flow):
+  # stable hash of the 5-tuple (in the request's direction), the same on every controller run
+  return zlib.crc32("%s %s %s %s %s" % ((srcIP, dstIP) + flow)) % FLOW_BUCKETS
+
+def handle_new_flow(event, packet):
+  # first packet of a transport flow of a requested connection: set its rules along the path of its bucket
+  # (or of the next placed bucket if its own is queued) and send the packet on
+  ip = packet.find('ipv4')
+  entry = flow_conns.get((str(ip.srcip), str(ip.dstip))) if ip else None
+  if entry is None:
+    return
+  conn, forward = entry
+  srcIP, dstIP = HOSTS[conn["src"]][2], HOSTS[conn["dst"]][2]
+  l4 = packet.find('tcp') or packet.find('udp')
+  if l4 is None:
+    flow = (ip.protocol, None, None) # no ports, all such packets of the connection are one flow
+  elif forward:
+    flow = (ip.protocol, l4.srcport, l4.dstport)
+  else:
+    flow = (ip.protocol, l4.dstport, l4.srcport)
+  bucket = flow_bucket(srcIP, dstIP, flow)
+  keys = [bucket_key(conn, (bucket + i) % FLOW_BUCKETS) for i in range(FLOW_BUCKETS)]
+  key = next((key for key in keys if key in conn_paths), None)
+  if key is None:
+    return
+  path = conn_paths[key]
+  install_flow(key, conn, flow, path)
+  if forward:
+    port = path[0].out_port if path else HOSTS[conn["dst"]][1]
+  else:
+    port = path[-1].in_port if path else HOSTS[conn["src"]][1]
+  msg = of.ofp_packet_out(data=event.ofp)
+  msg.actions.append(of.ofp_action_output(port=port))
+  event.connection.send(msg)
+
+# per-connection demand: byte counters of the ingress rule of every routed connection, polled with flow stats
+flow_counters = PortCounters() # same arrays as for the ports, keyed by (dpid, flow_key)
+conn_flows = {} # "src<->dst" => (dpid, flow_key) of the connection's ingress rule (dpid, bucket key for 5-tuple buckets)
+
+def send_flow_stats_request(dpid):
+  # one request per switch for all its IP rules; the QoS rules are picked from the reply
+  connection = core.openflow.getConnection(dpid)
+  if connection is None:
+    return False
+  connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request(match=of.ofp_match(dl_type=0x0800))))
+  return True
+
+def _handle_flowstats_received (event):
+  received_time = clock.us()
+  dpid = event.connection.dpid
+  buckets = {} # bucket key => [bytes, packets] summed over its transport flows
+  for f in event.stats:
+    key = flow_key(f.priority, f.match)
+    if f.priority == path_priority():
+      flow_counters.update((dpid, key), received_time, f.byte_count, 0, f.packet_count, 0)
+    elif (dpid, key) in microflows:
+      totals = buckets.setdefault(microflows[(dpid, key)][0], [0, 0])
+      totals[0] += f.byte_count
+      totals[1] += f.packet_count
+  # a transport flow expiring makes the sum go back, which is taken as a reset: no rate until the next reply
+  for key, (byte_count, packet_count) in buckets.items():
+    flow_counters.update((dpid, key), received_time, byte_count, 0, packet_count, 0)
+
+def demand(conn):
+  # measured rate of a connection [bit/s], 0 until its ingress rule has been polled twice
+  flow = conn_flows.get(conn_key(conn))
+  return flow_counters.get(flow)[0] if flow is not None else 0.0
 
 def _handle_PacketIn(event):
-  global s1_dpid, s2_dpid, s3_dpid, s4_dpid, s5_dpid
-  
-  global start_time, OWD1, OWD2, links, flag
+  global links
 
-  received_time = time.time() * 1000*10 - start_time # amount of time elapsed from start_time
+  received_time = clock.us() # amount of time elapsed since launch [us]
 
   packet = event.parsed
   
   if packet.type == 0x5577:
-    flag += 1
     c = packet.find('ethernet').payload
-    d, = struct.unpack('!I', c)
-  
-    if event.connection.dpid == s2_dpid:
-      calculate_delay(received_time, d, OWD1, OWD2, "s1-s2")
-    elif event.connection.dpid == s3_dpid:
-      calculate_delay(received_time, d, OWD1, OWD3, "s1-s3")
-    elif event.connection.dpid == s4_dpid:
-      calculate_delay(received_time, d, OWD1, OWD4, "s1-s4")
-
-    if flag%3 == 0:
-      sorted_delays = sorted(links.items())
-      print "delay " + ' | '.join("{}: {:<3} [ms]".format(link_name, delay_value.delay) for link_name, delay_value in sorted_delays)  
+    d, link_id, seq = myproto.parse(c)
+
+    # every probe is matched to its own sending time; late (expired) or unknown probes are dropped, and the
+    # timestamp has to agree (modulo its 32-bit wraparound) so that a reused (link_id, seq) is not mismatched
+    sent_time = pending_probes.pop((link_id, seq), None)
+    link = links_by_id.get(link_id)
+    if sent_time is not None and link is not None and sent_time & 0xFFFFFFFF == d:
+      link.probes_received += 1
+      calculate_delay(received_time, sent_time, OWD.get(switch_dpids[link.src], 0), OWD.get(event.connection.dpid, 0), link.name)
+    return
+
+  if packet.type == 0x0800 and GRANULARITY == "5tuple":
+    handle_new_flow(event, packet)
+    return
   
   #print "_handle_PacketIn is called, packet.type:", packet.type, " event.connection.dpid:", event.connection.dpid
 
-  # Below, set the default/initial routing rules for all switches and ports.
-  # All rules are set up in a given switch on packet_in event received from the switch which means no flow entry has been found in the flow table.
-  # This setting up may happen either at the very first pactet being sent or after flow entry expirationn inn the switch
- 
-  if event.connection.dpid==s1_dpid:
-     a=packet.find('arp')					                      # If packet object does not encapsulate a packet of the type indicated, find() returns None
-     if a and a.protodst=="10.0.0.4":
-       msg = of.ofp_packet_out(data=event.ofp)			    # Create packet_out message; use the incoming packet as the data for the packet out
-       msg.actions.append(of.ofp_action_output(port=4))	# Add an action to send to the specified port
-       event.connection.send(msg)				                # Send message to switch
- 
-     if a and a.protodst=="10.0.0.5": 
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=5))
-       event.connection.send(msg)
- 
-     if a and a.protodst=="10.0.0.6":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=6))
-       event.connection.send(msg)
- 
-     if a and a.protodst=="10.0.0.1":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=1))
-       event.connection.send(msg)
- 
-     if a and a.protodst=="10.0.0.2":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=2))
-       event.connection.send(msg)
- 
-     if a and a.protodst=="10.0.0.3":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=3))
-       event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800		# rule for IP packets (x0800)
-     msg.match.nw_dst = "10.0.0.1"
-     msg.actions.append(of.ofp_action_output(port = 1))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.2"
-     msg.actions.append(of.ofp_action_output(port = 2))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.3"
-     msg.actions.append(of.ofp_action_output(port = 3))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 1
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.4"
-     msg.actions.append(of.ofp_action_output(port = 4))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.5"
-     msg.actions.append(of.ofp_action_output(port = 5))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.6"
-     msg.actions.append(of.ofp_action_output(port = 6))
-     event.connection.send(msg)
- 
-  elif event.connection.dpid==s2_dpid: 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 1
-     msg.match.dl_type=0x0806		# rule for ARP packets (x0806)
-     msg.actions.append(of.ofp_action_output(port = 2))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 1
-     msg.match.dl_type=0x0800
-     msg.actions.append(of.ofp_action_output(port = 2))
-     event.connection.send(msg)
-  
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 2
-     msg.match.dl_type=0x0806
-     msg.actions.append(of.ofp_action_output(port = 1))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 2
-     msg.match.dl_type=0x0800
-     msg.actions.append(of.ofp_action_output(port = 1))
-     event.connection.send(msg)
- 
-  elif event.connection.dpid==s3_dpid: 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 1
-     msg.match.dl_type=0x0806
-     msg.actions.append(of.ofp_action_output(port = 2))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 1
-     msg.match.dl_type=0x0800
-     msg.actions.append(of.ofp_action_output(port = 2))
-     event.connection.send(msg)
-  
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 2
-     msg.match.dl_type=0x0806
-     msg.actions.append(of.ofp_action_output(port = 1))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 2
-     msg.match.dl_type=0x0800
-     msg.actions.append(of.ofp_action_output(port = 1))
-     event.connection.send(msg)
-  
-  elif event.connection.dpid==s4_dpid: 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 1
-     msg.match.dl_type=0x0806
-     msg.actions.append(of.ofp_action_output(port = 2))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 1
-     msg.match.dl_type=0x0800
-     msg.actions.append(of.ofp_action_output(port = 2))
-     event.connection.send(msg)
-  
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 2
-     msg.match.dl_type=0x0806
-     msg.actions.append(of.ofp_action_output(port = 1))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 2
-     msg.match.dl_type=0x0800
-     msg.actions.append(of.ofp_action_output(port = 1))
-     event.connection.send(msg)
- 
-  elif event.connection.dpid==s5_dpid: 
-     a=packet.find('arp')
-     if a and a.protodst=="10.0.0.4":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=4))
-       event.connection.send(msg)
- 
-     if a and a.protodst=="10.0.0.5":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=5))
-       event.connection.send(msg)
- 
-     if a and a.protodst=="10.0.0.6":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=6))
-       event.connection.send(msg)
- 
-     if a and a.protodst=="10.0.0.1":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=1))
-       event.connection.send(msg)
- 
-     if a and a.protodst=="10.0.0.2":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=2))
-       event.connection.send(msg)
- 
-     if a and a.protodst=="10.0.0.3":
-       msg = of.ofp_packet_out(data=event.ofp)
-       msg.actions.append(of.ofp_action_output(port=3))
-       event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.1"
-     msg.actions.append(of.ofp_action_output(port = 1))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =10
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.in_port = 6
-     msg.actions.append(of.ofp_action_output(port = 3))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.1"
-     msg.actions.append(of.ofp_action_output(port = 1))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.2"
-     msg.actions.append(of.ofp_action_output(port = 2))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.3"
-     msg.actions.append(of.ofp_action_output(port = 3))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.4"
-     msg.actions.append(of.ofp_action_output(port = 4))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.5"
-     msg.actions.append(of.ofp_action_output(port = 5))
-     event.connection.send(msg)
- 
-     msg = of.ofp_flow_mod()
-     msg.priority =100
-     msg.idle_timeout = 0
-     msg.hard_timeout = 0
-     msg.match.dl_type = 0x0800
-     msg.match.nw_dst = "10.0.0.6"
-     msg.actions.append(of.ofp_action_output(port = 6))
-     event.connection.send(msg)
+  # The edge switches have no ARP rules, ARP packets are forwarded by the controller to the port towards the target host.
+  # All flow rules are installed proactively on ConnectionUp (see DEFAULT_RULES), so nothing else is done here.
+  ports = ARP_PORTS.get(switch_names.get(event.connection.dpid))
+  a = packet.find('arp') if ports else None # If packet object does not encapsulate a packet of the type indicated, find() returns None
+  if a and str(a.protodst) in ports:
+    msg = of.ofp_packet_out(data=event.ofp)                           # Create packet_out message; use the incoming packet as the data for the packet out
+    msg.actions.append(of.ofp_action_output(port=ports[str(a.protodst)])) # Add an action to send to the specified port
+    event.connection.send(msg)                                        # Send message to switch
 
 def read_req_conn(file_path):
   try:
       with open(file_path, 'r') as file:
           data = json.load(file)
-          return data.get('connections', [])
   except IOError:
-      print "Error: File '%s' not found." % file_path
+      slog.log("requests", "file_not_found", file=file_path)
       return []
+  except ValueError as e:
+      slog.log("requests", "invalid_json", file=file_path, error=e) # e.g. caught while being written, read again on the next change
+      return None
+  if not isinstance(data, dict) or not isinstance(data.get('connections', []), list):
+      slog.log("requests", "invalid_file", file=file_path, error='expected {"connections": [...]}')
+      return None
+  return data.get('connections', [])
 
 req_conn = []
 MAX_CONNECTIONS_PER_LINK = 3
+DEFAULT_BANDWIDTH = float(DEFAULT_CAPACITY) / MAX_CONNECTIONS_PER_LINK # [Mbit/s] for requests without "bandwidth"
+DELAY_TOLERANCE = 1.2 # a path is accepted if its delay is within min_delay * DELAY_TOLERANCE
+conn_paths = {} # "src<->dst" => list of qos_routing.Edge currently used by the connection
+placed_conns = {} # "src<->dst" => request, for the connections in conn_paths
+PLACEMENT = "spread" # "spread": the least reserved SLA-compliant path first, "pack": the path using most of the delay budget first
+
+# Route-flap damping, the same for both solvers: a connection keeps its path while the path meets its delay bound and
+# has room for it. A better path is only taken once the hold-down of the connection has passed and if it is better by
+# REROUTE_THRESHOLD: by that share of the capacity on its busiest link, and only while that link is reserved above
+# CONGESTION_THRESHOLD ("spread"), or by that fraction of the path delay ("pack"). Going back to
+# one of the last FLAP_HISTORY paths the connection left, within FLAP_WINDOW, counts as a flap (A-B-A as well as
+# cycles over more paths) and doubles the hold-down of the connection, up to MAX_HOLD_DOWN.
+REROUTE_THRESHOLD = 0.1
+HOLD_DOWN = 10.0 # [s]
+MAX_HOLD_DOWN = 300.0 # [s]
+FLAP_HISTORY = 4
+FLAP_WINDOW = 300.0 # [s]
+
+class Route:
+  def __init__(self, hops, now):
+    self.hops = hops # (src switch, dst switch, link name) of every edge of the current path
+    self.recent = deque(maxlen=FLAP_HISTORY) # (hops, time it was left [us]) of the last paths used before this one
+    self.changed = now # time of the last change [us]
+    self.hold_down = HOLD_DOWN # [s]
+    self.reroutes = 0
+    self.flaps = 0
+
+routes = {} # "src<->dst" => Route
+
+class RoutingState:
+  # What the routing decisions read and update, passed to them explicitly: the controller's own (live_state) or a
+  # copy built from a snapshot (snapshot_state), so a computation on a copy never shows through the module globals
+  # that the other threads (control API) read.
+  def __init__(self, links, routes, conn_paths, placed_conns, clock):
+    self.links = links
+    self.routes = routes
+    self.conn_paths = conn_paths
+    self.placed_conns = placed_conns
+    self.clock = clock
+
+def live_state():
+  return RoutingState(links, routes, conn_paths, placed_conns, clock)
+
+# Placement of all requests at each recompute: "assign" solves them together with qos_routing.assign over the
+# MAX_PATHS shortest paths of each switch pair (most requests admitted, then the lowest highest link utilisation);
+# "greedy" routes them one by one in request order. Destination rules tie connections sharing a host together,
+# they are always placed greedily.
+SOLVER = "assign"
+MAX_PATHS = 32
+
+# Admission control: a connection is routed only over links with enough unreserved capacity for its bandwidth.
+# A request that does not fit is either kept and retried every recompute ("queue") or, if it has never been
+# admitted, dropped from the request list ("reject"). Connections admitted once are always retried.
+ADMISSION_POLICY = "queue"
+admitted = set() # "src<->dst" of the connections admitted at least once
+rejected_conn = []
+
+def conn_key(conn):
+  if "bucket" in conn:
+    return bucket_key(conn, conn["bucket"])
+  return conn["src"] + "<->" + conn["dst"]
+
+def bucket_key(conn, bucket):
+  return "%s<->%s#%d" % (conn["src"], conn["dst"], bucket)
+
+def placements(conn):
+  # the parts of a request placed on a path of their own: the whole connection, or one per hash bucket
+  # with 5-tuple rules, each reserving its share of the bandwidth
+  if GRANULARITY <> "5tuple":
+    return [conn]
+  share = bandwidth(conn) / FLOW_BUCKETS
+  return [dict(conn, bucket=i, bandwidth=share) for i in range(FLOW_BUCKETS)]
+
+def pinned_links(state, conn):
+  # With destination rules the connections sharing a host share the rules towards it: a connection can only use
+  # the links of the placed connections it shares a host with (all on the same links, otherwise no path at all).
+  # None when the connection is free to take any path.
+  if GRANULARITY <> "dst":
+    return None
+  key = conn_key(conn)
+  hosts = set((conn["src"], conn["dst"]))
+  pinned = None
+  for other_key, other in state.placed_conns.items():
+    if other_key == key or not hosts & set((other["src"], other["dst"])):
+      continue
+    names = set(edge.key for edge in state.conn_paths[other_key])
+    if pinned is not None and names <> pinned:
+      return set()
+    pinned = names
+  return pinned
+
+def bandwidth(conn):
+  return float(conn.get("bandwidth", DEFAULT_BANDWIDTH))
+
+def build_graph(state):
+  # every measured link can be used in both directions with the same delay
+  graph = Graph()
+  for link in state.links.values():
+    if link.delay == float("inf"):
+      continue
+    graph.add_edge(link.src, link.dst, link.delay, link.name, link.src_port, link.dst_port)
+    graph.add_edge(link.dst, link.src, link.delay, link.name, link.dst_port, link.src_port)
+  return graph
+
+def usable_edges(state, conn, excluded=None, rate=0):
+  # edges a connection can be routed over: links that still have room for it (and, with rate [bit/s], that stay
+  # below CONGESTION_THRESHOLD once that much traffic is added)
+  needed = bandwidth(conn)
+  key = conn_key(conn)
+  pinned = pinned_links(state, conn)
+  def usable(edge):
+    link = state.links[edge.key]
+    if rate and link.rate + rate > CONGESTION_THRESHOLD / 100.0 * link.capacity * 1000000:
+      return False
+    if link.reserved + needed > link.capacity + 1e-9 and edge not in state.conn_paths.get(key, ()):
+      return False
+    if pinned is not None and edge.key not in pinned:
+      return False
+    return edge.key <> excluded
+  return usable
+
+def route_connection(state, graph, conn, h_cache, excluded=None, rate=0):
+  # delay-constrained path for a requested connection over the edges given by usable_edges
+  src_switch = HOSTS[conn["src"]][0]
+  dst_switch = HOSTS[conn["dst"]][0]
+  if dst_switch not in h_cache:
+    h_cache[dst_switch] = delays_to(graph, dst_switch)
+  needed = bandwidth(conn)
+  key = conn_key(conn)
+  usable = usable_edges(state, conn, excluded, rate)
+  def load(edge):
+    # share of the link reserved once the connection is on it
+    link = state.links[edge.key]
+    reserved = link.reserved if edge not in state.conn_paths.get(key, ()) else link.reserved - needed
+    return (reserved + needed) / link.capacity
+  cost = load if PLACEMENT == "spread" else None
+  return constrained_path(graph, src_switch, dst_switch, conn["min_delay"] * DELAY_TOLERANCE, h_cache[dst_switch], usable, cost)
+
+def path_edges(graph, hops):
+  # the edges of graph along hops, None if one of them is no longer there (link down or not measured)
+  path = []
+  for src, dst, name in hops:
+    edge = next((edge for edge in graph.adj.get(src, ()) if edge.dst == dst and edge.key == name), None)
+    if edge is None:
+      return None
+    path.append(edge)
+  return path
+
+def max_share(state, conn, path):
+  # largest share of a link capacity reserved along path once the connection is on it
+  needed = bandwidth(conn)
+  return max([(state.links[edge.key].reserved + needed) / state.links[edge.key].capacity for edge in path] or [0.0])
+
+def stable_path(state, graph, conn, candidate):
+  # the path to use for conn given the best path found now, see REROUTE_THRESHOLD
+  route = state.routes.get(conn_key(conn))
+  if route is None:
+    return candidate
+  current = path_edges(graph, route.hops)
+  if current is None or path_delay(current) > conn["min_delay"] * DELAY_TOLERANCE:
+    return candidate # delay bound violated or link gone: rerouted right away
+  usable = usable_edges(state, conn)
+  if not all(usable(edge) for edge in current):
+    return candidate
+  if candidate is None or candidate == current:
+    return current
+  if state.clock.us() - route.changed < route.hold_down * 1000000:
+    return current
+  if PLACEMENT == "spread":
+    share = max_share(state, conn, current)
+    better = share > CONGESTION_THRESHOLD / 100.0 and max_share(state, conn, candidate) < share - REROUTE_THRESHOLD
+  else:
+    better = path_delay(candidate) > path_delay(current) * (1 + REROUTE_THRESHOLD)
+  return candidate if better else current
+
+def solve_placements(state, graph, parts):
+  # paths for all parts at once: "src<->dst" => path, None for the parts left out
+  names = sorted(state.links)
+  index = dict((name, i) for i, name in enumerate(names))
+  capacity = [state.links[name].capacity for name in names]
+  bounds = {} # (src switch, dst switch) => largest delay bound of the parts between them
+  for part in parts:
+    pair = (HOSTS[part["src"]][0], HOSTS[part["dst"]][0])
+    bounds[pair] = max(bounds.get(pair, 0), part["min_delay"] * DELAY_TOLERANCE)
+  pair_paths = {} # pair => (paths by increasing delay, their delays, link indices, {hops: position})
+  for pair, bound in bounds.items():
+    paths = simple_paths(graph, pair[0], pair[1], bound, MAX_PATHS)
+    pair_paths[pair] = (paths, [path_delay(path) for path in paths], [tuple(index[edge.key] for edge in path) for path in paths],
+                        dict((tuple((edge.src, edge.dst, edge.key) for edge in path), c) for c, path in enumerate(paths)))
+
+  # the parts with the same pair and the same paths within their bound share one candidate list, in order of
+  # preference: shortest first to spread (assign balances them), the most delay budget used first to pack
+  shared = {}
+  demands, candidates, keep, hold, orders = [], [], [], [], []
+  now = state.clock.us()
+  for part in parts:
+    pair = (HOSTS[part["src"]][0], HOSTS[part["dst"]][0])
+    paths, delays, indices, positions = pair_paths[pair]
+    k = bisect.bisect_right(delays, part["min_delay"] * DELAY_TOLERANCE)
+    if (pair, k) not in shared:
+      order = range(k) if PLACEMENT == "spread" else range(k - 1, -1, -1)
+      shared[(pair, k)] = ([indices[c] for c in order], order)
+    cands, order = shared[(pair, k)]
+    route = state.routes.get(conn_key(part))
+    current = positions.get(tuple(route.hops)) if route is not None else None
+    held = route is not None and now - route.changed < route.hold_down * 1000000
+    if current is not None and current < k and PLACEMENT == "pack" and not held and delays[k - 1] > delays[current] * (1 + REROUTE_THRESHOLD):
+      current = None # a path using more of the delay budget by REROUTE_THRESHOLD, as in stable_path
+    if current is not None and current < k:
+      keep.append(current if PLACEMENT == "spread" else k - 1 - current)
+    else:
+      keep.append(None)
+    hold.append(held)
+    demands.append(bandwidth(part))
+    candidates.append(cands)
+    orders.append(order)
+  choice = assign(demands, candidates, capacity, keep, hold, spread=PLACEMENT == "spread", gain=REROUTE_THRESHOLD,
+                  limit=CONGESTION_THRESHOLD / 100.0)
+  result = {}
+  for i, part in enumerate(parts):
+    pair = (HOSTS[part["src"]][0], HOSTS[part["dst"]][0])
+    result[conn_key(part)] = pair_paths[pair][0][orders[i][choice[i]]] if choice[i] is not None else None
+  return result
+
+def record_route(key, path):
+  now = clock.us()
+  hops = [(edge.src, edge.dst, edge.key) for edge in path]
+  route = routes.get(key)
+  if route is None:
+    routes[key] = Route(hops, now)
+    return
+  if hops == route.hops:
+    return
+  if any(old == hops and now - left < FLAP_WINDOW * 1000000 for old, left in route.recent):
+    route.flaps += 1
+    route.hold_down = min(2 * route.hold_down, MAX_HOLD_DOWN)
+  else:
+    route.hold_down = HOLD_DOWN
+  route.reroutes += 1
+  route.recent.append((route.hops, now))
+  route.hops = hops
+  route.changed = now
+
+def unplace(conn):
+  # drop the reservation of a part left without a path; its rules stay until it is placed again or released
+  key = conn_key(conn)
+  for edge in conn_paths.pop(key, ()):
+    link = links.get(edge.key)
+    if link is not None and conn in link.connection:
+      link.connection.remove(conn)
+      link.reserved -= bandwidth(conn)
+  placed_conns.pop(key, None)
+  conn_flows.pop(key, None)
+
+def reserve_path(state, conn, path):
+  # move the bandwidth reserved by conn onto the links of path
+  key = conn_key(conn)
+  for edge in state.conn_paths.get(key, ()):
+    link = state.links.get(edge.key) # None if the link has been removed since
+    if link is not None and conn in link.connection:
+      link.connection.remove(conn)
+      link.reserved -= bandwidth(conn)
+  for edge in path:
+    state.links[edge.key].connection.append(conn)
+    state.links[edge.key].reserved += bandwidth(conn)
+  state.conn_paths[key] = path
+  state.placed_conns[key] = conn
+
+def assign_path(conn, path, previous=None):
+  # previous: the path conn was routed over until now, None if it was not placed
+  key = conn_key(conn)
+  reserve_path(live_state(), conn, path)
+  record_route(key, path)
+  if GRANULARITY <> "5tuple":
+    conn_flows[key] = install_path(path, conn["src"], conn["dst"])
+    if previous is not None and GRANULARITY == "pair":
+      # the rules of the switches the connection no longer crosses are removed once the new ones are set; destination
+      # rules stay, as in release_request, and the rules of transport flows expire on their own
+      left = set(path_switches(previous, conn["src"])) - set(path_switches(path, conn["src"]))
+      if left:
+        clear_path(previous, conn["src"], conn["dst"], switches=sorted(left))
+    return
+  # the transport flows already in the bucket follow it to its new path
+  install_punt(conn)
+  conn_flows[key] = (switch_dpids.get(HOSTS[conn["src"]][0], 0), key)
+  names = [edge.key for edge in path]
+  for flow, flow_path in bucket_flows.get(key, {}).items():
+    if flow_path <> names:
+      install_flow(key, conn, flow, path)
+
+def move_rate(state, path, rate):
+  # account for rate [bit/s] moving onto (rate > 0) or off (rate < 0) the links of path until the next counters
+  for edge in path:
+    link = state.links[edge.key]
+    link.rate = max(0.0, link.rate + rate)
+    link.congestion = 100.0 * link.rate / (link.capacity * 1000000)
+
+def redistribute(state, graph, h_cache, link, demands):
+  # Move connections off a congested link using their measured demand (demands: "src<->dst" => [bit/s]): first the
+  # smallest connection that alone brings the link back under CONGESTION_THRESHOLD (best fit), otherwise the heaviest
+  # ones until it is. A connection is only moved to a path that can take its demand; without measurements every
+  # connection is tried. Returns the moves as ("src<->dst", name of the congested link, hops).
+  limit = CONGESTION_THRESHOLD / 100.0 * link.capacity * 1000000
+  demand_of = lambda conn: demands.get(conn_key(conn), 0.0)
+  conns = sorted(link.connection, key=demand_of)
+  best_fit = [conn for conn in conns if demand_of(conn) >= link.rate - limit][:1]
+  moves = []
+  for conn in best_fit + [conn for conn in reversed(conns) if conn not in best_fit]:
+    if link.rate <= limit:
+      break
+    rate = demand_of(conn)
+    path = route_connection(state, graph, conn, h_cache, excluded=link.name, rate=rate)
+    if path is not None:
+      move_rate(state, state.conn_paths[conn_key(conn)], -rate)
+      reserve_path(state, conn, path)
+      move_rate(state, path, rate)
+      moves.append((conn_key(conn), link.name, path_hops(path)))
+  return moves
+
+# Routing work (the placement of all requests, then the redistribution off congested links) can run in a pool of
+# worker processes: find_matching_link takes a snapshot of the link state, routes and requests, a worker takes the
+# decisions on it and returns the hops of every path, and the POX thread only applies them (reservations and
+# flow_mods), so probes and PacketIns are never held up behind a recompute. Requests added while a computation runs
+# are placed on their own when its result is applied; a recompute is skipped while the previous one still runs.
+# The workers are forked by launch before the log writer and the API server start their threads (POX's own
+# scheduler threads are already running then, the workers never use them), and keep the settings they were forked with.
+# ROUTING_WORKERS = 0 takes the decisions on the POX thread, on the same snapshot.
+ROUTING_WORKERS = 0
+ROUTING_TIMEOUT = 10.0 # [s] after which a computation is given up (its result ignored) and the next one started
+routing_pool = None # multiprocessing.Pool
+routing_pending = None # (generation, time submitted [us]) of the computation running in the pool
+routing_generation = 0
+routing_skipped = 0 # recomputes skipped because the previous computation was still running
+
+class LinkState:
+  # what the routing decisions read and update of a Link, in a snapshot
+  def __init__(self, name, src, src_port, dst, dst_port, delay, capacity, rate):
+    self.name = name
+    self.src = src
+    self.src_port = src_port
+    self.dst = dst
+    self.dst_port = dst_port
+    self.delay = delay
+    self.capacity = capacity
+    self.rate = rate
+    self.congestion = 100.0 * rate / (capacity * 1000000)
+    self.connection = []
+    self.reserved = 0.0
+
+class SnapshotClock:
+  # clock stopped at the time of a snapshot [us]
+  def __init__(self, now):
+    self.now = now
+
+  def us(self):
+    return self.now
+
+def path_hops(path):
+  return [(edge.src, edge.dst, edge.key) for edge in path]
+
+def routing_snapshot(requests):
+  # plain data (sent to a worker process) of everything the decisions depend on; the demands are those of the
+  # ingress rules of the current paths
+  return {
+    "now": clock.us(),
+    "links": [(link.name, link.src, link.src_port, link.dst, link.dst_port, link.delay, link.capacity, link.rate) for link in links.values()],
+    "routes": dict((key, (route.hops, route.changed, route.hold_down)) for key, route in routes.items()),
+    "requests": requests,
+    "demands": dict((conn_key(part), demand(part)) for node in requests for part in placements(node)),
+  }
+
+def snapshot_state(snapshot):
+  # a routing state of its own, built from snapshot; nothing of the live state is shared
+  state = RoutingState({}, {}, {}, {}, SnapshotClock(snapshot["now"]))
+  for entry in snapshot["links"]:
+    state.links[entry[0]] = LinkState(*entry)
+  for key, (hops, changed, hold_down) in snapshot["routes"].items():
+    route = state.routes[key] = Route(hops, changed)
+    route.hold_down = hold_down
+  return state
+
+def compute_routes(snapshot):
+  # the decisions for snapshot, in a worker process or on the POX thread
+  return decide_routes(snapshot_state(snapshot), snapshot["requests"], snapshot["demands"])
+
+def decide_routes(state, requests, demands):
+  # "src<->dst" of every part => hops of its path (None if not placed), and the moves off congested links
+  graph = build_graph(state)
+  h_cache = {}
+  solved = None
+  if SOLVER == "assign" and GRANULARITY <> "dst":
+    solved = solve_placements(state, graph, [part for node in requests for part in placements(node)])
+  decisions = {}
+  for node in requests:
+    for part in placements(node):
+      if solved is not None:
+        path = solved[conn_key(part)]
+      else:
+        path = stable_path(state, graph, part, route_connection(state, graph, part, h_cache))
+      if path is not None:
+        reserve_path(state, part, path)
+      decisions[conn_key(part)] = path_hops(path) if path is not None else None
+  # Load redistribution if links are congested
+  moves = []
+  for link in sorted(state.links.values(), key=lambda link: link.delay, reverse=True):
+    if link.congestion > CONGESTION_THRESHOLD:
+      moves.extend(redistribute(state, graph, h_cache, link, demands))
+  return decisions, moves
+
+def routing_worker(generation, snapshot):
+  # run in the pool: exceptions are returned, a failed computation has no result to hand back otherwise
+  start = time.time()
+  try:
+    return generation, compute_routes(snapshot), None, time.time() - start
+  except Exception:
+    return generation, None, traceback.format_exc(), time.time() - start
+
+def ignore_interrupt():
+  signal.signal(signal.SIGINT, signal.SIG_IGN) # ^C stops POX, which terminates the pool
 
 def find_matching_link():
-  global links, req_conn, s1_dpid, s5_dpid, network_ready, MAX_CONNECTIONS_PER_LINK
+  global links, req_conn, network_ready, routing_pending, routing_generation, routing_skipped
   if not network_ready:
-    print "could not set path"
+    slog.log("paths", "network_not_ready")
     return
 
-  total_congestion = float(links["s1-s2"].congestion + links["s1-s3"].congestion + links["s1-s4"].congestion) / 100
-  if total_congestion<>0:
-    links["s1-s2"].congestion = links["s1-s2"].congestion / total_congestion
-    links["s1-s3"].congestion = links["s1-s3"].congestion / total_congestion
-    links["s1-s4"].congestion = links["s1-s4"].congestion / total_congestion
-    print "congestion: %.2f, %.2f, %.2f" % (links["s1-s2"].congestion, links["s1-s3"].congestion, links["s1-s4"].congestion)
-  else:
-    print "congestion: ", 0, 0, 0
+  # congestion is the utilisation of a link's capacity, from its port counters [%]
+  if slog.allow("congestion"):
+    slog.write("congestion", "utilisation_percent", dict((name, link.congestion) for name, link in links.items()))
 
-  sorted_links = sorted(links.values(), key=lambda link: link.delay, reverse=True)
-  for link in sorted_links: 
-    link.connection = []
+  if routing_pool is not None and routing_pending is not None:
+    if clock.us() - routing_pending[1] < ROUTING_TIMEOUT * 1000000:
+      routing_skipped += 1
+      return
+    slog.log("paths", "computation_abandoned", generation=routing_pending[0])
 
-  print "path for:",
-  paths = []
-  links_choosen = []
+  seen = set()
+  requests = []
   for node in req_conn:
-    src = node["src"]
-    dst = node["dst"]
-    min_delay = node["min_delay"]
-
-    paths.append(src + "<->" + dst)
-    matching_path_found = False
-
-    for link in sorted_links:
-      if link.delay <= min_delay * 1.2 and len(link.connection) < MAX_CONNECTIONS_PER_LINK:
-        matching_path_found = True
-        link.connection.append(node)
-        links_choosen.append(link.name)
-        link_port = int(link.name.split("-")[1][1:])
-        dstIP = "10.0.0." + dst[1:]
-        srcIP = "10.0.0." + src[1:]
-        setPath(s1_dpid, srcIP, dstIP, link_port)
-        setPath(s5_dpid, dstIP, srcIP, link_port-3)
-        break
-
-    if not matching_path_found:
-      links_choosen.append("None")
-
-  for path, link in zip(paths, links_choosen):
-    print path, link + " | ",
-  
-  print ""
-  # Load redistribution if a link is congested
-  congested_link = None
-  for link in sorted_links:
-    if link.congestion > 85:
-      congested_link = link
-      break
+    if conn_key(node) not in seen:
+      seen.add(conn_key(node))
+      requests.append(node)
+  snapshot = routing_snapshot(requests)
+  if routing_pool is None:
+    decisions, moves = compute_routes(snapshot)
+    apply_routes(snapshot, decisions, moves)
+    return
+  routing_generation += 1
+  routing_pending = (routing_generation, snapshot["now"])
+  # the callback runs in a thread of the pool, the result is applied on the POX thread
+  routing_pool.apply_async(routing_worker, (routing_generation, snapshot),
+                           callback=lambda result: core.callLater(timed(routing_done), snapshot, result))
+
+def routing_done(snapshot, result):
+  global routing_pending
+  generation, decided, error, elapsed = result
+  if routing_pending is None or routing_pending[0] <> generation:
+    return # given up after ROUTING_TIMEOUT, a later computation is running
+  routing_pending = None
+  handler_times.setdefault("compute_routes", Histogram()).observe(elapsed)
+  if error is not None:
+    slog.write("paths", "computation_failed", error=error)
+    return
+  apply_routes(snapshot, *decided)
+
+def apply_routes(snapshot, decisions, moves):
+  # the paths decided on snapshot, for the requests that are still the same; the requests added or changed since
+  # are placed on their own, on the current link state. Only the parts whose path changed get rules and reservations
+  # updated, the others keep theirs (their edges are taken from the current graph, for the current delays).
+  graph = build_graph(live_state())
+  decided = dict((conn_key(node), node) for node in snapshot["requests"])
+  seen = set()
+  late = []
+  states_by_key = {} # "src<->dst" => links of its path(s), "queued", "rejected" or "duplicate"
+  for node in list(req_conn):
+    key = conn_key(node)
+    if key in seen:
+      states_by_key[key + " (duplicate)"] = "duplicate"
+      continue
+    seen.add(key)
+    if decided.get(key) <> node:
+      late.append(node)
+      continue
+    states = []
+    for part in placements(node):
+      part_key = conn_key(part)
+      hops = decisions[part_key]
+      path = path_edges(graph, hops) if hops is not None else None # None as well if a link went down since
+      current = conn_paths.get(part_key)
+      if path is None:
+        if current is not None:
+          unplace(part)
+        states.append("queued")
+        continue
+      if current is not None and path_hops(current) == hops:
+        conn_paths[part_key] = path
+      else:
+        assign_path(part, path, current)
+      states.append(",".join(edge.key for edge in path))
+    if len(states) > states.count("queued"):
+      admitted.add(key)
+      state = " / ".join(states)
+    elif key in admitted or ADMISSION_POLICY == "queue":
+      state = "queued"
+    else:
+      req_conn.remove(node)
+      rejected_conn.append(node)
+      state = "rejected"
+    states_by_key[key] = state
+  for node in late:
+    # placed by add_request when it came in, unless there was no room for it then
+    parts = [conn_paths.get(conn_key(part)) for part in placements(node)]
+    if any(path is not None for path in parts):
+      states_by_key[conn_key(node)] = " / ".join(",".join(edge.key for edge in path) if path is not None else "queued" for path in parts)
+    else:
+      states_by_key[conn_key(node)] = place_request(node)
+
+  if slog.allow("paths"):
+    slog.write("paths", "placed", states_by_key, flow_mods_sent=flow_mods_sent, flow_mods_suppressed=flow_mods_suppressed,
+               reroutes=sum(route.reroutes for route in routes.values()), flaps=sum(route.flaps for route in routes.values()))
+  # the moves were decided on the rates of the snapshot: a move is made only if its link is still congested now,
+  # and the rate moved is the connection's demand as measured now, so the rates of the last counters are adjusted
+  # once, by the traffic that actually moves
+  state = live_state()
+  for key, name, hops in moves:
+    conn = placed_conns.get(key)
+    link = links.get(name)
+    path = path_edges(graph, hops)
+    if conn is None or link is None or path is None or link.congestion <= CONGESTION_THRESHOLD:
+      continue
+    if name not in [edge.key for edge in conn_paths[key]]:
+      continue
+    rate = demand(conn)
+    move_rate(state, conn_paths[key], -rate)
+    assign_path(conn, path, conn_paths[key])
+    move_rate(state, path, rate)
+
+# Runtime changes of the request list: the request file is checked every RELOAD_INTERVAL seconds and the control API
+# (HTTP on 127.0.0.1:API_PORT) adds and removes single requests. Only the changed connections are placed or released
+# right away, the others keep their paths and rules.
+REQUESTS_FILE = "/home/student/Desktop/projekt/conn_req_parralel.json"
+RELOAD_INTERVAL = 1.0 # [s], 0 disables the reload
+API_PORT = 8085 # 0 disables the API
+file_conn = {} # "src<->dst" => request, as last read from REQUESTS_FILE
+file_stamp = None # (mtime, size) of REQUESTS_FILE when last read
+
+def check_request(conn):
+  # error message for a malformed request, None if it can be added
+  if not isinstance(conn, dict):
+    return "a request is a JSON object"
+  for field in ("src", "dst"):
+    if not isinstance(conn.get(field), basestring) or conn[field] not in HOSTS:
+      return "unknown %s host %r" % (field, conn.get(field))
+  if conn["src"] == conn["dst"]:
+    return "src and dst are the same host"
+  if "min_delay" not in conn:
+    return "min_delay is required"
+  for field in ("min_delay", "bandwidth"):
+    value = conn.get(field, DEFAULT_BANDWIDTH) # only bandwidth has a default
+    if isinstance(value, bool) or not isinstance(value, (int, long, float)) or value <= 0:
+      return "%s must be a positive number" % field
+  return None
+
+def place_request(conn):
+  # route a new request on the current link state, without recomputing the other connections
+  state = live_state()
+  graph = build_graph(state)
+  h_cache = {}
+  states = []
+  for part in placements(conn):
+    path = route_connection(state, graph, part, h_cache)
+    if path is not None:
+      assign_path(part, path)
+    states.append(",".join(edge.key for edge in path) if path is not None else "queued")
+  if len(states) > states.count("queued"):
+    admitted.add(conn_key(conn))
+  slog.log("requests", "placed", connection=conn_key(conn), path=" / ".join(states))
+  return " / ".join(states)
+
+def release_request(conn):
+  # free the bandwidth of a request and remove its rules; destination rules are left in place, the edge
+  # rules they replaced forwarded to the same host
+  for part in placements(conn):
+    key = conn_key(part)
+    path = conn_paths.pop(key, None)
+    placed_conns.pop(key, None)
+    conn_flows.pop(key, None)
+    routes.pop(key, None)
+    bucket_flows.pop(key, None)
+    if path is None:
+      continue
+    for edge in path:
+      link = links.get(edge.key)
+      if link is not None and part in link.connection:
+        link.connection.remove(part)
+        link.reserved -= bandwidth(part)
+    if GRANULARITY == "pair":
+      clear_path(path, conn["src"], conn["dst"])
+  if GRANULARITY == "5tuple":
+    # the rules of the transport flows already set expire on their own
+    src_switch, src_port, srcIP = HOSTS[conn["src"]]
+    dst_switch, dst_port, dstIP = HOSTS[conn["dst"]]
+    deletePath(switch_dpids.get(src_switch, 0), srcIP, dstIP)
+    deletePath(switch_dpids.get(dst_switch, 0), dstIP, srcIP)
+    flow_conns.pop((srcIP, dstIP), None)
+    flow_conns.pop((dstIP, srcIP), None)
+  admitted.discard(conn_key(conn))
+
+def add_request(conn):
+  # add a request, or replace the one between the same hosts; returns False if nothing changed
+  key = conn_key(conn)
+  old = next((node for node in req_conn if conn_key(node) == key), None)
+  if old == conn:
+    return False
+  if old is not None:
+    remove_request(key)
+  req_conn.append(conn)
+  slog.log("requests", "added", connection=key, request=json.dumps(conn, sort_keys=True))
+  if network_ready:
+    place_request(conn)
+  return True
+
+def remove_request(key):
+  # remove the request "src<->dst"; returns False if there was none
+  old = [node for node in req_conn if conn_key(node) == key]
+  for node in old:
+    req_conn.remove(node)
+  if not old:
+    return False
+  slog.log("requests", "removed", connection=key)
+  if network_ready:
+    release_request(old[0])
+  return True
+
+def apply_requests(conns):
+  # apply the request file as a diff against its previous contents; requests added through the API are kept
+  global file_conn
+  if not isinstance(conns, list):
+    slog.log("requests", "ignored", error="the requests are not a JSON list")
+    return
+  new = {}
+  for conn in conns:
+    error = check_request(conn)
+    if error is not None:
+      slog.log("requests", "ignored", request=json.dumps(conn, sort_keys=True), error=error)
+    else:
+      new.setdefault(conn_key(conn), conn)
+  for key in file_conn:
+    if key not in new:
+      remove_request(key)
+  for conn in conns:
+    key = conn_key(conn) if check_request(conn) is None else None
+    if new.get(key) is conn and file_conn.get(key) <> conn:
+      add_request(conn)
+  file_conn = new
+
+def _reload_func ():
+  global file_stamp
+  try:
+    st = os.stat(REQUESTS_FILE)
+  except OSError:
+    return
+  stamp = (st.st_mtime, st.st_size)
+  if stamp == file_stamp:
+    return
+  conns = read_req_conn(REQUESTS_FILE)
+  if conns is not None:
+    file_stamp = stamp
+    apply_requests(conns)
+
+# Metrics served on the control API (GET /metrics). The handlers and timers registered by launch are wrapped by
+# timed() to measure their execution time; the other values are read from the controller state when scraped.
+METRICS_TIMEOUT = 2.0 # [s] to wait for the POX thread to collect the metrics (or the requests of GET /requests)
+handler_times = {} # handler name => Histogram of its execution times [s]
+
+def timed(func):
+  histogram = handler_times.setdefault(func.__name__, Histogram())
+  return histogram.time(func)
+
+def recorded(kind, handler):
+  # handler preceded by the recording of its event by recorder.<kind>, when there is a recording
+  if recorder is None:
+    return handler
+  write = getattr(recorder, kind)
+  def record_event(event):
+    write(event)
+    return handler(event)
+  record_event.__name__ = handler.__name__
+  return record_event
+
+def request_state(conn):
+  if conn in rejected_conn:
+    return "rejected"
+  if any(conn_key(part) in conn_paths for part in placements(conn)):
+    return "routed"
+  return "queued"
+
+def metrics():
+  delay = Family("qos_link_delay_ms", "gauge", "Estimated link delay used for routing.")
+  variance = Family("qos_link_delay_variance_ms2", "gauge", "Variance of the link delay samples around the estimate.")
+  utilisation = Family("qos_link_utilisation_ratio", "gauge", "Traffic of the busier direction over the link capacity, from the port counters.")
+  rate = Family("qos_link_rate_bits_per_second", "gauge", "Traffic of the busier direction of the link.")
+  capacity = Family("qos_link_capacity_mbps", "gauge", "Link capacity in each direction.")
+  reserved = Family("qos_link_reserved_mbps", "gauge", "Bandwidth reserved by the connections routed over the link.")
+  probes_sent = Family("qos_link_probes_sent_total", "counter", "Delay probes sent over the link.")
+  probes_received = Family("qos_link_probes_received_total", "counter", "Delay probes received back.")
+  probes_lost = Family("qos_link_probes_lost_total", "counter", "Delay probes not received within the probe timeout.")
+  probe_loss = Family("qos_link_probe_loss_ratio", "gauge", "Share of the answered or expired probes that were lost.")
+  for name in sorted(links):
+    link = links[name]
+    delay.add(link.delay if link.delay <> float("inf") else None, link=name)
+    variance.add(link.delay_var, link=name)
+    utilisation.add(link.congestion / 100.0, link=name)
+    rate.add(link.rate, link=name)
+    capacity.add(link.capacity, link=name)
+    reserved.add(link.reserved, link=name)
+    probes_sent.add(link.probes_sent, link=name)
+    probes_received.add(link.probes_received, link=name)
+    probes_lost.add(link.probes_lost, link=name)
+    done = link.probes_received + link.probes_lost
+    probe_loss.add(float(link.probes_lost) / done if done else 0.0, link=name)
+
+  state = Family("qos_connection_state", "gauge", "1 for the current state of a requested connection (routed, queued or rejected).")
+  sla = Family("qos_connection_sla_met", "gauge", "1 if every part of the connection is routed within its delay bound.")
+  bound = Family("qos_connection_delay_bound_ms", "gauge", "Delay bound of the connection (min_delay * tolerance).")
+  path_info = Family("qos_connection_path_info", "gauge", "Links of the path a connection (or hash bucket) is routed over.")
+  path_delay_ms = Family("qos_connection_path_delay_ms", "gauge", "Estimated delay of the path of a connection (or hash bucket).")
+  demand_rate = Family("qos_connection_rate_bits_per_second", "gauge", "Measured rate of a connection (or hash bucket).")
+  reroutes = Family("qos_connection_reroutes_total", "counter", "Path changes of a connection (or hash bucket).")
+  flaps = Family("qos_connection_flaps_total", "counter", "Path changes back to the previous path.")
+  hold_down = Family("qos_connection_hold_down_seconds", "gauge", "Current hold-down of a connection (or hash bucket) after a path change.")
+  for conn in list(req_conn) + list(rejected_conn):
+    key = conn_key(conn)
+    current = request_state(conn)
+    for name in ("routed", "queued", "rejected"):
+      state.add(int(name == current), connection=key, state=name)
+    limit = conn["min_delay"] * DELAY_TOLERANCE
+    bound.add(limit, connection=key)
+    met = current == "routed"
+    for part in placements(conn):
+      part_key = conn_key(part)
+      path = conn_paths.get(part_key)
+      if path is None:
+        met = False
+        continue
+      met = met and path_delay(path) <= limit
+      path_info.add(1, connection=part_key, path=",".join(edge.key for edge in path))
+      path_delay_ms.add(path_delay(path), connection=part_key)
+      demand_rate.add(demand(part), connection=part_key)
+    sla.add(int(met), connection=key)
+  for key in sorted(routes):
+    route = routes[key]
+    reroutes.add(route.reroutes, connection=key)
+    flaps.add(route.flaps, connection=key)
+    hold_down.add(route.hold_down, connection=key)
+
+  owd = Family("qos_switch_owd_us", "gauge", "Smoothed one-way controller <=> switch delay.")
+  lost = Family("qos_switch_requests_lost_total", "counter", "Echo or stats requests not answered within the request timeout.")
+  dropped = Family("qos_switch_owd_samples_dropped_total", "counter", "Barrier replies not used as OWD samples, being right after flow_mods.")
+  provisioned_switch = Family("qos_switch_provisioned", "gauge", "1 once the switch confirmed its default rules.")
+  for dpid in sorted(switch_names):
+    name = switch_names[dpid]
+    owd.add(OWD.get(dpid), switch=name)
+    lost.add(requests_lost.get(dpid, 0), switch=name)
+    dropped.add(samples_dropped.get(dpid, 0), switch=name)
+    provisioned_switch.add(int(dpid in provisioned), switch=name)
+
+  handlers = Family("qos_handler_duration_seconds", "histogram", "Execution time of the event handlers and timers.")
+  for name in sorted(handler_times):
+    handlers.add_histogram(handler_times[name], handler=name)
+  return [delay, variance, utilisation, rate, capacity, reserved, probes_sent, probes_received, probes_lost, probe_loss,
+          state, sla, bound, path_info, path_delay_ms, demand_rate, reroutes, flaps, hold_down, owd, lost, dropped,
+          provisioned_switch,
+          Family("qos_flow_mods_sent_total", "counter", "Flow_mods sent to the switches.").add(flow_mods_sent),
+          Family("qos_flow_mods_suppressed_total", "counter", "Flow_mods not sent, the shadow flow table has the rule.").add(flow_mods_suppressed),
+          Family("qos_probes_pending", "gauge", "Probes sent and not yet received or expired.").add(len(pending_probes)),
+          Family("qos_routing_skipped_total", "counter", "Recomputes skipped while the previous computation was running.").add(routing_skipped),
+          handlers]
+
+def requests_state():
+  # body of GET /requests
+  paths = dict((key, [edge.key for edge in path]) for key, path in conn_paths.items())
+  return {"connections": list(req_conn), "paths": paths, "rejected": list(rejected_conn)}
+
+class RequestAPIHandler(BaseHTTPRequestHandler):
+  # GET /requests: requests, their paths and the rejected ones
+  # POST /requests: add (or replace) the request in the JSON body, e.g. {"src": "h1", "dst": "h4", "min_delay": 100}
+  # DELETE /requests/<src>/<dst>: remove the request between src and dst
+  # GET /metrics: link, connection and controller metrics in the Prometheus text format, see metrics()
+  # Changes are handed to the POX thread with core.callLater, so they are answered with 202 before being applied.
+
+  def do_GET(self):
+    if self.path.rstrip("/") == "/metrics":
+      return self.get_metrics()
+    if self.path.rstrip("/") <> "/requests":
+      return self.reply(404, {"error": "not found"})
+    body = self.collect(requests_state)
+    if body is None:
+      return self.reply(503, {"error": "the controller did not answer within %.1f s" % METRICS_TIMEOUT})
+    self.reply(200, body)
+
+  def do_POST(self):
+    if self.path.rstrip("/") <> "/requests":
+      return self.reply(404, {"error": "not found"})
+    try:
+      conn = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+    except ValueError as e:
+      return self.reply(400, {"error": "invalid JSON: %s" % e})
+    error = check_request(conn)
+    if error is not None:
+      return self.reply(400, {"error": error})
+    core.callLater(add_request, conn)
+    self.reply(202, {"accepted": conn_key(conn)})
+
+  def do_DELETE(self):
+    parts = self.path.strip("/").split("/")
+    if len(parts) <> 3 or parts[0] <> "requests":
+      return self.reply(404, {"error": "not found"})
+    key = parts[1] + "<->" + parts[2]
+    core.callLater(remove_request, key)
+    self.reply(202, {"accepted": key})
 
-  if congested_link:
-    available_links = [link for link in sorted_links if link != congested_link]
-    if available_links:
-      for conn in congested_link.connection:
-        src = conn["src"]
-        dst = conn["dst"]
-        min_delay = conn["min_delay"]
-        for link in available_links:
-          if link.delay <= min_delay * 1.2 and len(link.connection) < MAX_CONNECTIONS_PER_LINK:
-            congested_link.connection.remove(conn)
-            link.connection.append(conn)
-            link_port = int(link.name.split("-")[1][1:])
-            dstIP = "10.0.0." + dst[1:]
-            srcIP = "10.0.0." + src[1:]
-            setPath(s1_dpid, srcIP, dstIP, link_port)
-            setPath(s5_dpid, dstIP, srcIP, link_port - 3)
-            break
-    
-
-def launch ():
-  global start_time, req_conn
-  start_time = time.time() * 1000*10 # factor * 10 applied to increase the accuracy for short delays (capture tenths of ms)
-  print "start:", start_time/10
-
-  conn_req_path = "/home/student/Desktop/projekt/conn_req_parralel.json"
-  print "loading requested connections data from file", conn_req_path
-
-  req_conn = read_req_conn(conn_req_path)
+  def collect(self, func):
+    # func() run on the POX thread, so that no handler (or recompute) changes the state while it is read;
+    # None if the POX thread did not answer within METRICS_TIMEOUT
+    done = threading.Event()
+    result = []
+    def run():
+      try:
+        result.append(func())
+      finally:
+        done.set()
+    core.callLater(run)
+    if not done.wait(METRICS_TIMEOUT) or not result:
+      return None
+    return result[0]
+
+  def get_metrics(self):
+    text = self.collect(lambda: exposition(metrics()))
+    if text is None:
+      return self.reply(503, {"error": "the controller did not answer within %.1f s" % METRICS_TIMEOUT})
+    self.reply(200, text, "text/plain; version=0.0.4")
+
+  def reply(self, code, body, content_type="application/json"):
+    data = json.dumps(body) if content_type == "application/json" else body
+    self.send_response(code)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, format, *args):
+    pass
+
+class RequestAPIServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+def start_api(port):
+  # serve the control API on the loopback interface only, from its own thread
+  try:
+    server = RequestAPIServer(("127.0.0.1", port), RequestAPIHandler)
+  except Exception as e:
+    print "Error: control API not started on port %d (%s)" % (port, e)
+    return None
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  print "control API on http://127.0.0.1:%d/requests, metrics on http://127.0.0.1:%d/metrics" % (port, port)
+  return server
+
+def launch (history=DELAY_HISTORY, estimator=DELAY_ESTIMATOR, outlier_k=OUTLIER_K, probe_rate=PROBE_RATE, probe_timeout=PROBE_TIMEOUT,
+            echo_rate=ECHO_RATE, stats_interval=STATS_INTERVAL, admission=ADMISSION_POLICY, granularity=GRANULARITY,
+            buckets=FLOW_BUCKETS, placement=PLACEMENT, hysteresis=REROUTE_THRESHOLD, hold_down=HOLD_DOWN,
+            requests=REQUESTS_FILE, reload_interval=RELOAD_INTERVAL, api_port=API_PORT, solver=SOLVER, max_paths=MAX_PATHS,
+            log_file=LOG_FILE, log_format=LOG_FORMAT, log_rate=LOG_RATE, log_rates=None,
+            store_dir=STORE_DIR, store_segment_mb=STORE_SEGMENT_MB, store_segment_hours=STORE_SEGMENT_HOURS, store_keep=STORE_KEEP,
+            record=RECORD_FILE, routing_workers=ROUTING_WORKERS):
+  # e.g. ./pox.py qos_controller --history=3600 --estimator=kalman --outlier_k=4 --probe_rate=50 --echo_rate=10 --stats_interval=5
+  #      ./pox.py qos_controller --granularity=5tuple --buckets=8 --placement=pack
+  #      ./pox.py qos_controller --hysteresis=0.2 --hold_down=30
+  #      ./pox.py qos_controller --requests=conn_req.json --reload_interval=5 --api_port=8085
+  #      ./pox.py qos_controller --solver=greedy --max_paths=100
+  #      ./pox.py qos_controller --log_file=qos.log --log_format=json --log_rates=delay=5,congestion=0
+  #      ./pox.py qos_controller --store_dir=/var/lib/qos --store_segment_hours=6 --store_keep=28
+  #      ./pox.py qos_controller --record=incident.qrec
+  #      ./pox.py qos_controller --routing_workers=2
+  global clock, req_conn, DELAY_HISTORY, DELAY_ESTIMATOR, OUTLIER_K, PROBE_RATE, PROBE_TIMEOUT, ECHO_RATE, STATS_INTERVAL
+  global ADMISSION_POLICY, GRANULARITY, FLOW_BUCKETS, PLACEMENT, REROUTE_THRESHOLD, HOLD_DOWN
+  global REQUESTS_FILE, RELOAD_INTERVAL, API_PORT, SOLVER, MAX_PATHS, LOG_FILE, LOG_FORMAT, LOG_RATE
+  global STORE_DIR, STORE_SEGMENT_MB, STORE_SEGMENT_HOURS, STORE_KEEP, store, RECORD_FILE, recorder
+  global ROUTING_WORKERS, routing_pool
+  options = dict(locals()) # the launch options, kept with a recording
+  rates = {}
+  for entry in (log_rates or "").split(","):
+    if entry:
+      category, rate = entry.split("=", 1)
+      rates[category] = float(rate)
+  LOG_FILE = log_file
+  LOG_FORMAT = log_format
+  LOG_RATE = float(log_rate)
+  LOG_RATES.update(rates)
+  # the output is fixed now: the records are written later, from the thread of the log
+  slog.configure(stream=open(LOG_FILE, "a") if LOG_FILE else sys.stdout, fmt=LOG_FORMAT, rate=LOG_RATE, rates=LOG_RATES)
+  if admission not in ("queue", "reject"):
+    raise ValueError("admission must be 'queue' or 'reject'")
+  ADMISSION_POLICY = admission
+  if granularity not in ("dst", "pair", "5tuple"):
+    raise ValueError("granularity must be 'dst', 'pair' or '5tuple'")
+  GRANULARITY = granularity
+  FLOW_BUCKETS = int(buckets)
+  if FLOW_BUCKETS < 1:
+    raise ValueError("buckets must be at least 1")
+  if placement not in ("spread", "pack"):
+    raise ValueError("placement must be 'spread' or 'pack'")
+  PLACEMENT = placement
+  REROUTE_THRESHOLD = float(hysteresis)
+  if solver not in ("assign", "greedy"):
+    raise ValueError("solver must be 'assign' or 'greedy'")
+  SOLVER = solver
+  MAX_PATHS = int(max_paths)
+  HOLD_DOWN = float(hold_down)
+  ECHO_RATE = float(echo_rate)
+  STATS_INTERVAL = float(stats_interval)
+  if ECHO_RATE > 0 and not hook_echo_replies():
+    print "echo replies are not passed on by this POX version, barrier requests are used to measure the OWD"
+  PROBE_RATE = float(probe_rate)
+  PROBE_TIMEOUT = float(probe_timeout)
+  DELAY_HISTORY = int(history)
+  make_estimator(estimator) # fail at start-up on an unknown name
+  DELAY_ESTIMATOR = estimator
+  OUTLIER_K = float(outlier_k)
+  for entry in LINK_TABLE:
+    add_link(*entry)
+  configured_links.update(links)
+
+  ROUTING_WORKERS = int(routing_workers)
+  if ROUTING_WORKERS > 0:
+    # forked now, with the settings above and before the log writer and the API server start their threads (a
+    # child of a fork only has the forking thread, locks held by the others would stay held in it); more than one
+    # worker lets a computation start while an abandoned one still runs
+    routing_pool = multiprocessing.Pool(ROUTING_WORKERS, initializer=ignore_interrupt)
+    core.addListenerByName("GoingDownEvent", lambda event: routing_pool.terminate())
+    print "routing computed by %d worker processes" % ROUTING_WORKERS
+
+  clock = Clock() # monotonic, us resolution: sub-millisecond delays are measured too
+  STORE_DIR = store_dir
+  STORE_SEGMENT_MB = float(store_segment_mb)
+  STORE_SEGMENT_HOURS = float(store_segment_hours)
+  STORE_KEEP = int(store_keep)
+  if STORE_DIR:
+    store = Writer(STORE_DIR, origin=int(time.time() * 1000000) - clock.us(), segment_bytes=int(STORE_SEGMENT_MB * (1 << 20)),
+                   segment_seconds=STORE_SEGMENT_HOURS * 3600, keep=STORE_KEEP)
+    core.addListenerByName("GoingDownEvent", lambda event: store.close()) # the index of the last segment
+    print "measurements stored in", STORE_DIR
+  print "start:", time.time()*1000
+
+  REQUESTS_FILE = requests
+  RELOAD_INTERVAL = float(reload_interval)
+  API_PORT = int(api_port)
+  print "loading requested connections data from file", REQUESTS_FILE
+
+  if not os.path.exists(REQUESTS_FILE):
+    print "Error: File '%s' not found." % REQUESTS_FILE # then checked again every RELOAD_INTERVAL, quietly
+  _reload_func()
   print "Requested connections:"
   for node in req_conn:
     print "\t",node
+  if RELOAD_INTERVAL > 0:
+    Timer(RELOAD_INTERVAL, timed(_reload_func), recurring=True)
+  if API_PORT:
+    start_api(API_PORT)
 
-  core.openflow.addListenerByName("PortStatsReceived",_handle_portstats_received)
-  core.openflow.addListenerByName("ConnectionUp", _handle_ConnectionUp)
-  core.openflow.addListenerByName("PacketIn",_handle_PacketIn)
-  
+  RECORD_FILE = record
+  if RECORD_FILE:
+    # the requests are kept as loaded now, later changes (reload, API) are not recorded
+    recorder = Recorder(RECORD_FILE, clock=lambda: clock.us(), header={"options": options, "requests": req_conn})
+    core.addListenerByName("GoingDownEvent", lambda event: recorder.close())
+    print "events recorded to", RECORD_FILE
 
-  
+  core.openflow.addListenerByName("PortStatsReceived", recorded("port_stats", timed(_handle_portstats_received)))
+  core.openflow.addListenerByName("FlowStatsReceived", recorded("flow_stats", timed(_handle_flowstats_received)))
+  core.openflow.addListenerByName("ConnectionUp", recorded("connection_up", timed(_handle_ConnectionUp)))
+  core.openflow.addListenerByName("PacketIn", recorded("packet_in", timed(_handle_PacketIn)))
+  core.openflow.addListenerByName("FlowRemoved", timed(_handle_FlowRemoved))
+  core.openflow.addListenerByName("BarrierIn", timed(_handle_BarrierIn))
+
+  # links can also be discovered at run time, e.g.: ./pox.py openflow.discovery qos_controller
+  def _start_discovery ():
+    core.openflow_discovery.addListenerByName("LinkEvent", recorded("link", timed(_handle_LinkEvent)))
+  core.call_when_ready(_start_discovery, "openflow_discovery")
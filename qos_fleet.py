@@ -0,0 +1,420 @@
+#!/usr/bin/python
+# Emulated fleet of OpenFlow 1.0 switches to load-test the QoS controller (qos_controller.py) without Mininet or root.
+# The module does not depend on POX; it speaks OpenFlow 1.0 over TCP to a running controller, e.g.:
+#    ./pox.py openflow.discovery qos_controller --api_port=0
+#    python qos_fleet.py --switches=1000 --storm=5000 --ramp=2 --json=fleet.json
+# Overall operation:
+#    - every switch opens its own connection to the controller and answers hello, features, config, echo, barrier,
+#      description and port/flow stats requests; flow_mods are counted,
+#    - s1..s5 are wired as the diamond of qos_net.py (same port numbers, so LINK_TABLE probes find their way), the other
+#      switches form a ring; a PACKET_OUT with data sent out of a linked port comes back as a PACKET_IN from the peer
+#      switch after --delay (+ --jitter) ms, which loops the controller's probes and the LLDP of openflow.discovery,
+#    - --storm PacketIns per second are sent as ARP requests from the host ports of s1/s5 (the controller answers them
+#      with a PACKET_OUT), each with its own buffer_id so the answer gives the controller's response latency,
+#    - with --ramp the storm rate is multiplied by that factor every --step seconds; the highest rate at which at least
+#      --sustain of the PacketIns were answered is the sustained rate.
+# A report is printed every --step seconds and at the end (and written to --json).
+
+import argparse
+import errno
+import heapq
+import json
+import random
+import select
+import socket
+import struct
+import sys
+import time
+
+from qos_stubs import arp_request, mac
+
+OFP_VERSION = 0x01
+OFPT_HELLO, OFPT_ERROR, OFPT_ECHO_REQUEST, OFPT_ECHO_REPLY, OFPT_VENDOR = 0, 1, 2, 3, 4
+OFPT_FEATURES_REQUEST, OFPT_FEATURES_REPLY, OFPT_GET_CONFIG_REQUEST, OFPT_GET_CONFIG_REPLY, OFPT_SET_CONFIG = 5, 6, 7, 8, 9
+OFPT_PACKET_IN, OFPT_FLOW_REMOVED, OFPT_PORT_STATUS, OFPT_PACKET_OUT, OFPT_FLOW_MOD = 10, 11, 12, 13, 14
+OFPT_PORT_MOD, OFPT_STATS_REQUEST, OFPT_STATS_REPLY, OFPT_BARRIER_REQUEST, OFPT_BARRIER_REPLY = 15, 16, 17, 18, 19
+OFPST_DESC, OFPST_FLOW, OFPST_AGGREGATE, OFPST_TABLE, OFPST_PORT = 0, 1, 2, 3, 4
+OFPAT_OUTPUT = 0
+OFPR_NO_MATCH = 0
+OFPET_BAD_REQUEST, OFPBRC_BAD_TYPE, OFPBRC_BAD_VENDOR = 1, 1, 3
+NO_BUFFER = 0xFFFFFFFF
+
+HEADER = struct.Struct("!BBHI")
+PORT = struct.Struct("!H6s16sIIIIII")
+PORT_STATS = struct.Struct("!H6x12Q")
+
+# s1..s5 as in qos_net.py: (switch, port, peer switch, peer port)
+DIAMOND = [
+  (1, 4, 2, 1), (1, 5, 3, 1), (1, 6, 4, 1),
+  (2, 2, 5, 1), (3, 2, 5, 2), (4, 2, 5, 3),
+]
+HOST_PORTS = {1: (1, 2, 3), 5: (4, 5, 6)}
+HOST_IPS = ["10.0.0.%d" % i for i in range(1, 7)]
+
+class Stats(object):
+  def __init__(self):
+    self.packet_in = 0 # PacketIns sent by the storm
+    self.answered = 0 # storm PacketIns answered with a PACKET_OUT
+    self.latencies = [] # [ms] PacketIn => PACKET_OUT of the answered storm PacketIns
+    self.looped = 0 # PACKET_OUTs sent back as PACKET_IN over a link
+    self.dropped = 0 # PACKET_OUTs with data to a port without a link
+    self.flow_mods = 0
+    self.stats_requests = 0
+    self.echo_replies = 0 # answers to the controller's echo requests
+
+  def snapshot(self):
+    return dict(self.__dict__)
+
+def percentile(values, p):
+  if not values:
+    return None
+  values = sorted(values)
+  return values[max(0, min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1)))))]
+
+class Switch(object):
+  def __init__(self, fleet, dpid, ports):
+    self.fleet = fleet
+    self.dpid = dpid
+    self.name = "s%d" % dpid
+    self.ports = ports
+    self.sock = None
+    self.inbuf = b""
+    self.outbuf = b""
+    self.connected = False
+    self.features = False # features reply sent, the controller knows the switch
+    self.xid = 0
+    self.counters = dict((port, [0, 0, 0, 0]) for port in ports) # rx_packets, tx_packets, rx_bytes, tx_bytes
+
+  def connect(self, address):
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.sock.setblocking(False)
+    err = self.sock.connect_ex(address)
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+      raise socket.error(err, "connect to %s:%d failed" % address)
+    self.connected = True
+    self.send(OFPT_HELLO, b"")
+
+  def next_xid(self):
+    self.xid = (self.xid + 1) & 0xFFFFFFFF
+    return self.xid
+
+  def send(self, msg_type, body, xid=None):
+    if xid is None:
+      xid = self.next_xid()
+    self.outbuf += HEADER.pack(OFP_VERSION, msg_type, HEADER.size + len(body), xid) + body
+    self.flush()
+
+  def flush(self):
+    if not self.outbuf:
+      return
+    try:
+      sent = self.sock.send(self.outbuf)
+      self.outbuf = self.outbuf[sent:]
+    except socket.error as e:
+      if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOTCONN):
+        self.fleet.disconnect(self, e)
+    self.fleet.want_write(self, bool(self.outbuf))
+
+  def receive(self):
+    try:
+      data = self.sock.recv(65536)
+    except socket.error as e:
+      if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return
+      return self.fleet.disconnect(self, e)
+    if not data:
+      return self.fleet.disconnect(self, "closed by the controller")
+    self.inbuf += data
+    while len(self.inbuf) >= HEADER.size:
+      version, msg_type, length, xid = HEADER.unpack_from(self.inbuf)
+      if length < HEADER.size:
+        return self.fleet.disconnect(self, "bad message length %d" % length)
+      if len(self.inbuf) < length:
+        break
+      body = self.inbuf[HEADER.size:length]
+      self.inbuf = self.inbuf[length:]
+      self.handle(msg_type, xid, body)
+
+  def handle(self, msg_type, xid, body):
+    stats = self.fleet.stats
+    if msg_type == OFPT_ECHO_REQUEST:
+      self.send(OFPT_ECHO_REPLY, body, xid)
+      stats.echo_replies += 1
+    elif msg_type == OFPT_FEATURES_REQUEST:
+      self.send(OFPT_FEATURES_REPLY, self.features_reply(), xid)
+      self.features = True
+    elif msg_type == OFPT_GET_CONFIG_REQUEST:
+      self.send(OFPT_GET_CONFIG_REPLY, struct.pack("!HH", 0, 0xFFFF), xid)
+    elif msg_type == OFPT_BARRIER_REQUEST:
+      self.send(OFPT_BARRIER_REPLY, b"", xid)
+    elif msg_type == OFPT_STATS_REQUEST:
+      self.stats_reply(xid, body)
+    elif msg_type == OFPT_PACKET_OUT:
+      self.packet_out(body)
+    elif msg_type == OFPT_FLOW_MOD:
+      stats.flow_mods += 1
+    elif msg_type == OFPT_VENDOR:
+      msg = HEADER.pack(OFP_VERSION, msg_type, HEADER.size + len(body), xid) + body
+      self.send(OFPT_ERROR, struct.pack("!HH", OFPET_BAD_REQUEST, OFPBRC_BAD_VENDOR) + msg[:64], xid)
+    elif msg_type in (OFPT_HELLO, OFPT_SET_CONFIG, OFPT_PORT_MOD, OFPT_ERROR):
+      pass
+    else:
+      msg = HEADER.pack(OFP_VERSION, msg_type, HEADER.size + len(body), xid) + body
+      self.send(OFPT_ERROR, struct.pack("!HH", OFPET_BAD_REQUEST, OFPBRC_BAD_TYPE) + msg[:64], xid)
+
+  def features_reply(self):
+    body = struct.pack("!QIB3xII", self.dpid, 256, 1, 0, 1) # 256 buffers, 1 table, OFPC_FLOW_STATS, output action only
+    for port in self.ports:
+      name = ("%s-eth%d" % (self.name, port)).encode("ascii")
+      body += PORT.pack(port, mac(self.dpid, port), name, 0, 0, 0, 0, 0, 0)
+    return body
+
+  def stats_reply(self, xid, body):
+    self.fleet.stats.stats_requests += 1
+    stats_type, flags = struct.unpack_from("!HH", body)
+    if stats_type == OFPST_PORT:
+      reply = b"".join(PORT_STATS.pack(port, c[0], c[1], c[2], c[3], 0, 0, 0, 0, 0, 0, 0, 0)
+                       for port, c in sorted(self.counters.items()))
+    elif stats_type == OFPST_DESC:
+      reply = struct.pack("!256s256s256s32s256s", b"qos_fleet", b"emulated switch", b"1.0", self.name.encode("ascii"), b"")
+    elif stats_type == OFPST_AGGREGATE:
+      reply = struct.pack("!QQI4x", 0, 0, 0)
+    else:
+      reply = b"" # no flow or table entries
+    self.send(OFPT_STATS_REPLY, struct.pack("!HH", stats_type, 0) + reply, xid)
+
+  def packet_out(self, body):
+    buffer_id, in_port, actions_len = struct.unpack_from("!IHH", body)
+    actions = body[8:8 + actions_len]
+    data = body[8 + actions_len:]
+    fleet = self.fleet
+    if buffer_id != NO_BUFFER:
+      sent = fleet.storm_buffers.pop((self.dpid, buffer_id), None)
+      if sent is not None:
+        fleet.stats.answered += 1
+        fleet.stats.latencies.append((time.time() - sent) * 1000)
+    if not data:
+      return
+    offset = 0
+    while offset + 4 <= len(actions):
+      action_type, action_len = struct.unpack_from("!HH", actions, offset)
+      if action_len < 8:
+        break
+      if action_type == OFPAT_OUTPUT:
+        port = struct.unpack_from("!H", actions, offset + 4)[0]
+        fleet.forward(self, port, data)
+      offset += action_len
+
+  def packet_in(self, port, data, buffer_id=NO_BUFFER):
+    counters = self.counters.get(port)
+    if counters is not None:
+      counters[0] += 1
+      counters[2] += len(data)
+    self.send(OFPT_PACKET_IN, struct.pack("!IHHBx", buffer_id, len(data), port, OFPR_NO_MATCH) + data)
+
+class Fleet(object):
+  def __init__(self, switches, address, delay=1.0, jitter=0.0, seed=1):
+    self.address = address
+    self.delay = delay / 1000.0
+    self.jitter = jitter / 1000.0
+    self.random = random.Random(seed)
+    self.stats = Stats()
+    self.timers = []
+    self.sequence = 0
+    self.storm_buffers = {} # (dpid, buffer_id) => sending time of a storm PacketIn
+    self.buffer_id = 0
+
+    # wiring: (dpid, port) => (peer dpid, peer port)
+    self.peers = {}
+    ports = dict((dpid, set(HOST_PORTS.get(dpid, ()))) for dpid in range(1, switches + 1))
+    wires = [wire for wire in DIAMOND if wire[0] <= switches and wire[2] <= switches]
+    ring = list(range(6, switches + 1))
+    if len(ring) > 1:
+      wires += [(ring[i], 1, ring[(i + 1) % len(ring)], 2) for i in range(len(ring))]
+    for a, a_port, b, b_port in wires:
+      self.peers[(a, a_port)] = (b, b_port)
+      self.peers[(b, b_port)] = (a, a_port)
+      ports[a].add(a_port)
+      ports[b].add(b_port)
+    self.switches = dict((dpid, Switch(self, dpid, sorted(ports[dpid]))) for dpid in ports)
+    self.by_fd = {}
+    self.poller = select.epoll() if hasattr(select, "epoll") else select.poll()
+    self.write_flag = select.EPOLLOUT if hasattr(select, "epoll") else select.POLLOUT
+    self.read_flag = select.EPOLLIN if hasattr(select, "epoll") else select.POLLIN
+
+  def schedule(self, delay, func, *args):
+    heapq.heappush(self.timers, (time.time() + delay, self.sequence, func, args))
+    self.sequence += 1
+
+  def start(self, connect_rate=200.0):
+    # connect the switches at connect_rate per second, not to flood the controller's accept queue
+    for i, switch in enumerate(sorted(self.switches.values(), key=lambda switch: switch.dpid)):
+      self.schedule(i / connect_rate, self.connect, switch)
+
+  def connect(self, switch):
+    switch.connect(self.address)
+    self.by_fd[switch.sock.fileno()] = switch
+    self.poller.register(switch.sock.fileno(), self.read_flag)
+
+  def disconnect(self, switch, reason):
+    if not switch.connected:
+      return
+    sys.stderr.write("%s disconnected: %s\n" % (switch.name, reason))
+    switch.connected = False
+    fd = switch.sock.fileno()
+    self.by_fd.pop(fd, None)
+    try:
+      self.poller.unregister(fd)
+    except (IOError, OSError, ValueError):
+      pass
+    switch.sock.close()
+
+  def want_write(self, switch, flag):
+    if switch.connected and switch.sock.fileno() in self.by_fd:
+      self.poller.modify(switch.sock.fileno(), self.read_flag | (self.write_flag if flag else 0))
+
+  def forward(self, switch, port, data):
+    peer = self.peers.get((switch.dpid, port))
+    if peer is None:
+      if port not in HOST_PORTS.get(switch.dpid, ()):
+        self.stats.dropped += 1
+      return
+    counters = switch.counters.get(port)
+    if counters is not None:
+      counters[1] += 1
+      counters[3] += len(data)
+    self.stats.looped += 1
+    delay = self.delay + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+    self.schedule(delay, self.deliver, peer[0], peer[1], data)
+
+  def deliver(self, dpid, port, data):
+    switch = self.switches[dpid]
+    if switch.connected and switch.features:
+      switch.packet_in(port, data)
+
+  def storm(self, count):
+    # count ARP requests from the hosts of s1/s5 to hosts behind the other edge switch
+    edges = [self.switches[dpid] for dpid in HOST_PORTS if dpid in self.switches and self.switches[dpid].features]
+    if not edges:
+      return
+    now = time.time()
+    for i in range(count):
+      switch = edges[i % len(edges)]
+      port = HOST_PORTS[switch.dpid][i % 3]
+      src_ip = HOST_IPS[port - 1]
+      dst_ip = HOST_IPS[self.random.randrange(len(HOST_IPS))]
+      self.buffer_id = (self.buffer_id + 1) % NO_BUFFER
+      self.storm_buffers[(switch.dpid, self.buffer_id)] = now
+      switch.packet_in(port, arp_request(mac(switch.dpid, port), src_ip, dst_ip), self.buffer_id)
+      self.stats.packet_in += 1
+
+  def run(self, duration, storm=0.0, ramp=1.0, step=5.0, tick=0.01, sustain=0.95, quiet=False):
+    end = time.time() + duration
+    rate = float(storm)
+    credit = 0.0
+    last = time.time()
+    next_report = last + step
+    previous = self.stats.snapshot()
+    self.intervals = []
+    while time.time() < end:
+      timeout = tick
+      if self.timers:
+        timeout = max(0.0, min(timeout, self.timers[0][0] - time.time()))
+      for fd, event in self.poller.poll(timeout):
+        switch = self.by_fd.get(fd)
+        if switch is None:
+          continue
+        if event & self.read_flag:
+          switch.receive()
+        if switch.connected and event & self.write_flag:
+          switch.flush()
+      now = time.time()
+      while self.timers and self.timers[0][0] <= now:
+        at, sequence, func, args = heapq.heappop(self.timers)
+        func(*args)
+      if rate > 0:
+        credit += rate * (now - last)
+        if credit >= 1:
+          self.storm(int(credit))
+          credit -= int(credit)
+      last = now
+      if now >= next_report:
+        interval = self.report_interval(previous, now - (next_report - step), rate)
+        self.intervals.append(interval)
+        if not quiet:
+          print(self.format_interval(interval))
+        previous = self.stats.snapshot()
+        self.stats.latencies = []
+        next_report = now + step
+        rate *= ramp
+    return self.summary(sustain)
+
+  def report_interval(self, previous, elapsed, rate):
+    stats = self.stats
+    sent = stats.packet_in - previous["packet_in"]
+    answered = stats.answered - previous["answered"]
+    # storm PacketIns older than 1 s without an answer are counted as lost
+    cutoff = time.time() - 1.0
+    for key in [key for key, sent_time in self.storm_buffers.items() if sent_time < cutoff]:
+      del self.storm_buffers[key]
+    return {
+      "connected": sum(1 for switch in self.switches.values() if switch.features),
+      "storm_rate": rate,
+      "packet_in_per_s": sent / elapsed,
+      "answered_per_s": answered / elapsed,
+      "answered_ratio": float(answered) / sent if sent else None,
+      "latency_ms_p50": percentile(stats.latencies, 50),
+      "latency_ms_p99": percentile(stats.latencies, 99),
+      "flow_mods_per_s": (stats.flow_mods - previous["flow_mods"]) / elapsed,
+      "probes_looped_per_s": (stats.looped - previous["looped"]) / elapsed,
+      "stats_requests_per_s": (stats.stats_requests - previous["stats_requests"]) / elapsed,
+    }
+
+  def format_interval(self, i):
+    latency = "-" if i["latency_ms_p50"] is None else "%.2f/%.2f ms" % (i["latency_ms_p50"], i["latency_ms_p99"])
+    ratio = "-" if i["answered_ratio"] is None else "%.1f%%" % (100 * i["answered_ratio"])
+    return ("switches %d | PacketIn %.0f/s answered %.0f/s (%s) latency p50/p99 %s | flow_mod %.0f/s | looped %.0f/s | stats %.0f/s" %
+            (i["connected"], i["packet_in_per_s"], i["answered_per_s"], ratio, latency, i["flow_mods_per_s"],
+             i["probes_looped_per_s"], i["stats_requests_per_s"]))
+
+  def summary(self, sustain):
+    sustained = [i["answered_per_s"] for i in self.intervals if i["answered_ratio"] is not None and i["answered_ratio"] >= sustain]
+    return {
+      "switches": len(self.switches),
+      "connected": sum(1 for switch in self.switches.values() if switch.features),
+      "max_sustained_packet_in_per_s": max(sustained) if sustained else None,
+      "max_flow_mods_per_s": max([i["flow_mods_per_s"] for i in self.intervals] or [0.0]),
+      "totals": dict((key, value) for key, value in self.stats.snapshot().items() if key != "latencies"),
+      "intervals": self.intervals,
+    }
+
+def main():
+  parser = argparse.ArgumentParser(description="Emulated OpenFlow 1.0 switches to load-test the QoS controller.")
+  parser.add_argument("--controller", default="127.0.0.1:6633", help="host:port of the controller")
+  parser.add_argument("--switches", type=int, default=5, help="number of switches, s1..s5 form the qos_net.py diamond")
+  parser.add_argument("--delay", type=float, default=1.0, help="link delay of the looped PACKET_OUTs [ms]")
+  parser.add_argument("--jitter", type=float, default=0.0, help="uniform noise added to the link delay [ms]")
+  parser.add_argument("--storm", type=float, default=0.0, help="ARP PacketIns per second sent from the edge switches")
+  parser.add_argument("--ramp", type=float, default=1.0, help="factor applied to the storm rate every step")
+  parser.add_argument("--step", type=float, default=5.0, help="reporting interval [s]")
+  parser.add_argument("--sustain", type=float, default=0.95, help="answered share for a storm rate to count as sustained")
+  parser.add_argument("--duration", type=float, default=60.0, help="[s]")
+  parser.add_argument("--connect_rate", type=float, default=200.0, help="new connections per second")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--json", help="write the summary to this file")
+  args = parser.parse_args()
+
+  host, port = args.controller.rsplit(":", 1)
+  fleet = Fleet(args.switches, (host, int(port)), args.delay, args.jitter, args.seed)
+  fleet.start(args.connect_rate)
+  summary = fleet.run(args.duration, args.storm, args.ramp, args.step, sustain=args.sustain)
+  print("max sustained PacketIn rate: %s/s, max flow_mod rate: %.0f/s, switches connected: %d/%d" % (
+    "-" if summary["max_sustained_packet_in_per_s"] is None else "%.0f" % summary["max_sustained_packet_in_per_s"],
+    summary["max_flow_mods_per_s"], summary["connected"], summary["switches"]))
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(summary, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,135 @@
+# Structured, rate-limited log of the QoS controller (qos_controller.py).
+# The module does not depend on POX so the same code can be used by offline tools.
+# Overall operation:
+#    - a record is a category (e.g. "delay"), an event name and fields; every category has its own rate limit
+#      (token bucket), records over the limit are dropped and counted, the next record of the category carries the count,
+#    - records are queued as they are and formatted and written by a writer thread: the caller never waits for the
+#      terminal or the disk, a full queue drops records (counted as well) instead of blocking.
+
+import atexit
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+class RateLimit:
+  # token bucket: rate records per second on average, up to burst at once
+  def __init__(self, rate, burst=None):
+    self.rate = float(rate)
+    self.burst = float(burst if burst is not None else max(1.0, self.rate))
+    self.tokens = self.burst
+    self.last = None
+
+  def allow(self, now):
+    if self.rate <= 0:
+      return False
+    if self.last is not None:
+      self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+    self.last = now
+    if self.tokens >= 1:
+      self.tokens -= 1
+      return True
+    return False
+
+def format_value(value):
+  if isinstance(value, float):
+    return "%.3f" % value
+  if isinstance(value, (list, tuple)):
+    value = ",".join(str(item) for item in value)
+  text = str(value)
+  if not text or any(c in text for c in ' ="\n'):
+    return json.dumps(text)
+  return text
+
+class Log:
+  def __init__(self, stream=None, fmt="text", rate=1.0, rates=None, capacity=10000, clock=time.time, interval=0.2):
+    self.stream = stream # file object written to, sys.stdout (as it is when the first record is written) if None
+    self.fmt = fmt # "text": one "key=value" line per record, "json": one JSON object per line
+    self.rate = rate # default records per second of a category
+    self.rates = dict(rates or {}) # category => records per second, 0 silences the category
+    self.clock = clock # time the rate limits follow [s]
+    self.interval = interval # [s] between two writes of the queued records
+    self.limits = {} # category => RateLimit
+    self.suppressed = {} # category => records dropped by the rate limit since the last one written
+    self.queue = deque(maxlen=capacity)
+    self.dropped = 0 # records dropped because the queue was full
+    self.writer = None
+    self.lock = threading.Lock() # one writer at a time (writer thread and flush)
+
+  def configure(self, stream=None, fmt=None, rate=None, rates=None):
+    if stream is not None:
+      self.stream = stream
+    if fmt is not None:
+      if fmt not in ("text", "json"):
+        raise ValueError("log format must be 'text' or 'json'")
+      self.fmt = fmt
+    if rate is not None:
+      self.rate = float(rate)
+    if rates is not None:
+      self.rates.update(rates)
+    self.limits.clear()
+
+  def allow(self, category):
+    # True if a record of category can be written now; to skip building the fields of a record that would be dropped
+    limit = self.limits.get(category)
+    if limit is None:
+      limit = self.limits[category] = RateLimit(self.rates.get(category, self.rate))
+    if limit.allow(self.clock()):
+      return True
+    self.suppressed[category] = self.suppressed.get(category, 0) + 1
+    return False
+
+  def write(self, category, event, fields=None, **kw):
+    # queue a record without checking the rate limit
+    if fields:
+      kw.update(fields)
+    suppressed = self.suppressed.pop(category, 0)
+    if suppressed:
+      kw["suppressed"] = suppressed
+    if len(self.queue) == self.queue.maxlen:
+      self.dropped += 1
+    self.queue.append((time.time(), category, event, kw))
+    if self.writer is None:
+      self.start()
+
+  def log(self, category, event, fields=None, **kw):
+    if self.allow(category):
+      self.write(category, event, fields, **kw)
+
+  def start(self):
+    self.writer = threading.Thread(target=self.run)
+    self.writer.daemon = True
+    self.writer.start()
+    atexit.register(self.flush) # the records still queued at exit
+
+  def run(self):
+    while True:
+      time.sleep(self.interval)
+      self.flush()
+
+  def flush(self):
+    # write the queued records
+    with self.lock:
+      lines = []
+      while self.queue:
+        lines.append(self.format(*self.queue.popleft()))
+      if self.dropped:
+        dropped, self.dropped = self.dropped, 0
+        lines.append(self.format(time.time(), "log", "queue_full", {"dropped": dropped}))
+      if not lines:
+        return
+      stream = self.stream or sys.stdout
+      try:
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+      except (IOError, OSError, ValueError):
+        pass # a closed or broken output loses the records, not the controller
+
+  def format(self, stamp, category, event, fields):
+    if self.fmt == "json":
+      record = {"time": round(stamp, 6), "category": category, "event": event}
+      record.update(fields)
+      return json.dumps(record, sort_keys=True)
+    head = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stamp)) + ".%03d" % (int(stamp * 1000) % 1000)
+    return " ".join([head, category, event] + ["%s=%s" % (key, format_value(fields[key])) for key in sorted(fields)])
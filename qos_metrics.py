@@ -0,0 +1,91 @@
+# Metrics of the QoS controller (qos_controller.py) in the Prometheus text exposition format (version 0.0.4).
+# The module does not depend on POX so the same code can be used by offline tools.
+
+from qos_stats import monotonic_ns
+
+# execution time buckets of the handlers and timers [s]
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+class Histogram:
+  # cumulative histogram of observed values, as exported: counts per upper bound, plus their number and sum
+  def __init__(self, buckets=TIME_BUCKETS):
+    self.buckets = tuple(buckets)
+    self.counts = [0] * len(self.buckets) # per bucket, not cumulative
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value):
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[i] += 1
+        break
+    self.count += 1
+    self.sum += value
+
+  def time(self, func):
+    # func wrapped to observe its execution time [s]
+    def timed(*args, **kw):
+      start = monotonic_ns()
+      try:
+        return func(*args, **kw)
+      finally:
+        self.observe((monotonic_ns() - start) / 1e9)
+    timed.__name__ = func.__name__
+    return timed
+
+  def samples(self, name, labels):
+    # (name, labels, value) of the _bucket, _sum and _count series
+    result = []
+    total = 0
+    for bound, count in zip(self.buckets, self.counts):
+      total += count
+      result.append((name + "_bucket", dict(labels, le=format_value(bound)), total))
+    result.append((name + "_bucket", dict(labels, le="+Inf"), self.count))
+    result.append((name + "_sum", labels, self.sum))
+    result.append((name + "_count", labels, self.count))
+    return result
+
+class Family:
+  # one metric: its type, help text and samples
+  def __init__(self, name, kind, help):
+    self.name = name
+    self.kind = kind # "gauge", "counter" or "histogram"
+    self.help = help
+    self.samples = [] # (sample name, labels, value)
+
+  def add(self, value, **labels):
+    if value is not None:
+      self.samples.append((self.name, labels, value))
+    return self
+
+  def add_histogram(self, histogram, **labels):
+    self.samples.extend(histogram.samples(self.name, labels))
+    return self
+
+def format_value(value):
+  if isinstance(value, bool):
+    return "1" if value else "0"
+  if isinstance(value, float):
+    if value != value:
+      return "NaN"
+    if value in (float("inf"), float("-inf")):
+      return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+  return str(value)
+
+def escape(value):
+  return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def exposition(families):
+  # the text format of a list of families
+  lines = []
+  for family in families:
+    lines.append("# HELP %s %s" % (family.name, family.help.replace("\\", "\\\\").replace("\n", "\\n")))
+    lines.append("# TYPE %s %s" % (family.name, family.kind))
+    for name, labels, value in family.samples:
+      if labels:
+        label_text = ",".join('%s="%s"' % (key, escape(labels[key])) for key in sorted(labels))
+        lines.append("%s{%s} %s" % (name, label_text, format_value(value)))
+      else:
+        lines.append("%s %s" % (name, format_value(value)))
+  return "\n".join(lines) + "\n"
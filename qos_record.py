@@ -0,0 +1,166 @@
+# Recording of the OpenFlow events handled by the QoS controller (qos_controller.py), replayed by qos_replay.py.
+# The module does not depend on POX (the events are read through their attributes) so recordings can be read offline.
+# Overall operation:
+#    - a recording starts with the magic and a JSON header (the launch options and the requests of the recorded
+#      controller), then one record per event: a 21-byte header (time [us] of the controller clock, type, dpid,
+#      length of the payload) and the payload of its type, little-endian,
+#    - records are packed by the handler that recorded them and written by flush() (once per stats interval, or when
+#      the buffer is full), so recording costs a handler a struct pack.
+
+import io
+import json
+import socket
+import struct
+
+from qos_stubs import Record
+
+MAGIC = b"QOSREC\x00\x01"
+FILE_HEADER = struct.Struct("<8sI") # magic, length of the JSON header
+EVENT = struct.Struct("<qBQI") # time [us], type, dpid, payload length
+
+CONNECTION_UP, PACKET_IN, PORT_STATS, OWD, LINK, FLOW_STATS = 1, 2, 3, 4, 5, 6
+TYPE_NAMES = {CONNECTION_UP: "ConnectionUp", PACKET_IN: "PacketIn", PORT_STATS: "PortStatsReceived", OWD: "owd", LINK: "LinkEvent",
+              FLOW_STATS: "FlowStatsReceived"}
+
+PORT = struct.Struct("<H6s16s") # port_no, hw_addr, name
+PACKET_IN_HEADER = struct.Struct("<HI") # in_port, buffer_id, followed by the frame
+PORT_STATS_HEADER = struct.Struct("<IH") # xid, number of ports
+PORT_COUNTERS = struct.Struct("<HQQQQ") # port_no, rx_bytes, tx_bytes, rx_packets, tx_packets
+OWD_VALUE = struct.Struct("<q") # smoothed OWD [us]
+LINK_CHANGE = struct.Struct("<HQHB") # port1, dpid2, port2, added
+FLOW_COUNTERS = struct.Struct("<HBHH4s4sBHHQQ") # priority, match fields set, the fields, byte_count, packet_count
+# the match fields qos_controller tells its rules apart by (flow_key), a bit each in the order of the struct
+MATCH_FIELDS = ("in_port", "dl_type", "nw_src", "nw_dst", "nw_proto", "tp_src", "tp_dst")
+
+def raw_mac(hw_addr):
+  if hw_addr is None:
+    return b"\x00" * 6
+  return hw_addr.toRaw() if hasattr(hw_addr, "toRaw") else bytes(hw_addr)
+
+def pack_flow(f):
+  match = f.match
+  present = 0
+  values = []
+  for i, name in enumerate(MATCH_FIELDS):
+    value = getattr(match, name, None)
+    if value is not None:
+      present |= 1 << i
+    if name in ("nw_src", "nw_dst"):
+      values.append(socket.inet_aton(str(value)) if value is not None else b"\x00" * 4)
+    else:
+      values.append(int(value) if value is not None else 0)
+  return FLOW_COUNTERS.pack(f.priority, present, *(values + [f.byte_count, f.packet_count]))
+
+def unpack_flow(payload, offset):
+  fields = FLOW_COUNTERS.unpack_from(payload, offset)
+  priority, present, values = fields[0], fields[1], fields[2:9]
+  match = {} # the fields set, addresses as strings
+  for i, name in enumerate(MATCH_FIELDS):
+    if present & (1 << i):
+      match[name] = socket.inet_ntoa(values[i]) if name in ("nw_src", "nw_dst") else values[i]
+  return Record(priority=priority, match=match, byte_count=fields[9], packet_count=fields[10])
+
+class Recorder:
+  def __init__(self, path, clock, header=None, buffer_size=1 << 16):
+    self.clock = clock # function returning the controller time [us]
+    self.file = io.open(path, "wb")
+    header = json.dumps(header or {}, sort_keys=True).encode("utf-8")
+    self.file.write(FILE_HEADER.pack(MAGIC, len(header)) + header)
+    self.parts = [] # packed records not yet written
+    self.size = 0
+    self.buffer_size = buffer_size
+    self.events = 0
+
+  def add(self, kind, dpid, payload):
+    self.parts.append(EVENT.pack(self.clock(), kind, dpid, len(payload)))
+    self.parts.append(payload)
+    self.size += EVENT.size + len(payload)
+    self.events += 1
+    if self.size >= self.buffer_size:
+      self.flush()
+
+  def connection_up(self, event):
+    ports = event.connection.features.ports
+    self.add(CONNECTION_UP, event.connection.dpid, struct.pack("<H", len(ports)) + b"".join(
+      PORT.pack(port.port_no, raw_mac(port.hw_addr), port.name.encode("utf-8")) for port in ports))
+
+  def packet_in(self, event):
+    ofp = event.ofp
+    buffer_id = ofp.buffer_id if ofp.buffer_id is not None and ofp.buffer_id >= 0 else 0xFFFFFFFF
+    self.add(PACKET_IN, event.connection.dpid, PACKET_IN_HEADER.pack(ofp.in_port, buffer_id) + bytes(ofp.data))
+
+  def port_stats(self, event):
+    msg = event.ofp[0] if isinstance(event.ofp, list) else event.ofp
+    self.add(PORT_STATS, event.connection.dpid, PORT_STATS_HEADER.pack(msg.xid, len(event.stats)) + b"".join(
+      PORT_COUNTERS.pack(f.port_no, f.rx_bytes, f.tx_bytes, f.rx_packets, f.tx_packets) for f in event.stats))
+
+  def flow_stats(self, event):
+    self.add(FLOW_STATS, event.connection.dpid, struct.pack("<H", len(event.stats)) + b"".join(pack_flow(f) for f in event.stats))
+
+  def owd(self, dpid, value):
+    self.add(OWD, dpid, OWD_VALUE.pack(value))
+
+  def link(self, event):
+    l = event.link
+    self.add(LINK, l.dpid1, LINK_CHANGE.pack(l.port1, l.dpid2, l.port2, 1 if event.added else 0))
+
+  def flush(self):
+    if self.parts:
+      self.file.write(b"".join(self.parts))
+      self.file.flush()
+      self.parts = []
+      self.size = 0
+
+  def close(self):
+    if self.file is not None:
+      self.flush()
+      self.file.close()
+      self.file = None
+
+def read_events(path):
+  # (JSON header, iterator over the events as Records: time, type, dpid and the fields of the type)
+  f = io.open(path, "rb")
+  magic, length = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+  if magic != MAGIC:
+    f.close()
+    raise ValueError("%s: not a recording" % path)
+  options = json.loads(f.read(length).decode("utf-8"))
+  def events():
+    with f:
+      while True:
+        header = f.read(EVENT.size)
+        if len(header) < EVENT.size:
+          return # end of the file, or a record cut by the end of the recording
+        t, kind, dpid, length = EVENT.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length:
+          return
+        yield decode(t, kind, dpid, payload)
+  return options, events()
+
+def decode(t, kind, dpid, payload):
+  event = Record(time=t, type=kind, dpid=dpid)
+  if kind == CONNECTION_UP:
+    count = struct.unpack_from("<H", payload)[0]
+    event.ports = []
+    for i in range(count):
+      port_no, hw_addr, name = PORT.unpack_from(payload, 2 + i * PORT.size)
+      event.ports.append(Record(port_no=port_no, hw_addr=hw_addr, name=name.rstrip(b"\x00").decode("utf-8")))
+  elif kind == PACKET_IN:
+    event.in_port, event.buffer_id = PACKET_IN_HEADER.unpack_from(payload)
+    event.data = payload[PACKET_IN_HEADER.size:]
+  elif kind == PORT_STATS:
+    event.xid, count = PORT_STATS_HEADER.unpack_from(payload)
+    event.stats = []
+    for i in range(count):
+      port_no, rx_bytes, tx_bytes, rx_packets, tx_packets = PORT_COUNTERS.unpack_from(payload, PORT_STATS_HEADER.size + i * PORT_COUNTERS.size)
+      event.stats.append(Record(port_no=port_no, rx_bytes=rx_bytes, tx_bytes=tx_bytes, rx_packets=rx_packets, tx_packets=tx_packets))
+  elif kind == FLOW_STATS:
+    count = struct.unpack_from("<H", payload)[0]
+    event.stats = [unpack_flow(payload, 2 + i * FLOW_COUNTERS.size) for i in range(count)]
+  elif kind == OWD:
+    event.owd = OWD_VALUE.unpack(payload)[0]
+  elif kind == LINK:
+    event.port1, event.dpid2, event.port2, added = LINK_CHANGE.unpack(payload)
+    event.added = bool(added)
+  return event
@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# Replay of a recording of the QoS controller (./pox.py qos_controller --record=<file>, see qos_record.py) into
+# qos_controller's handlers, no switches needed.
+# Overall operation:
+#    - the controller is launched with the recorded options and requests, and runs on a virtual clock that takes the
+#      recorded time of every event before its handler is called, so the same recording always gives the same decisions,
+#    - ConnectionUp, PacketIn, PortStatsReceived, FlowStatsReceived and discovered links are handed to the handlers
+#      as POX events (the flow stats give the demands the redistribution off congested links is decided on);
+#      the recorded OWDs are set as they were, the probe a recorded PacketIn carries is expected as if it had been sent
+#      by this controller (its sending time is in its header),
+#    - find_matching_link and the stats timer run every RECOMPUTE_INTERVAL / STATS_INTERVAL of recorded time;
+#      probes are not sent (they are in the recording) and the messages to the switches are only packed,
+#    - events are replayed as fast as possible, or at --speed times the recorded pace; the time taken by every
+#      handler is reported at the end, --profile adds the functions the time is spent in.
+# e.g. python qos_replay.py incident.qrec --json=replay.json
+#      python qos_replay.py incident.qrec --speed=1 --verbose
+#      python qos_replay.py incident.qrec --profile --option solver=greedy
+
+import sys
+import os
+import json
+import heapq
+import argparse
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+from pox.lib.packet.ethernet import ethernet
+import qos_controller as qos
+from qos_stats import Clock, RingBuffer, monotonic_ns
+from qos_stubs import Record, SimOpenFlow
+from qos_record import read_events, TYPE_NAMES, CONNECTION_UP, PACKET_IN, PORT_STATS, OWD, LINK, FLOW_STATS
+
+class ReplayConnection(object):
+  def __init__(self, dpid, ports):
+    self.dpid = dpid
+    self.features = Record(ports=[Record(port_no=port.port_no, name=port.name, hw_addr=EthAddr(port.hw_addr)) for port in ports])
+    self.ports = dict((port.port_no, port) for port in self.features.ports)
+    self.sent = 0
+
+  def send(self, msg):
+    msg.pack() # what sending costs the handler, the message goes nowhere
+    self.sent += 1
+
+class Replay(object):
+  def __init__(self, path, speed=0.0, timers=True):
+    self.header, self.events = read_events(path)
+    self.speed = speed # 0: as fast as possible, 1: the recorded pace
+    self.timers = timers
+    self.now = 0 # virtual time [ns]
+    self.queue = [] # (time [ns], sequence, interval [s], func) of the controller's timers
+    self.sequence = 0
+    self.counts = {} # event type name => events replayed
+    self.skipped = 0 # events of switches that were not connected
+    self.times = {} # handler name => RingBuffer of its execution times [ms]
+
+  def now_ns(self):
+    return self.now
+
+  def install(self):
+    # the recorded switches take the place of the openflow component, before qos_controller.launch registers its listeners
+    self.openflow = SimOpenFlow()
+    core.register("openflow", self.openflow)
+
+  def options(self, overrides):
+    # launch options of the recorded controller, without its outputs (API, request file, store, recording), with
+    # the routing on the replay's thread so that its decisions follow the virtual clock
+    options = dict(self.header.get("options", {}))
+    options.update(overrides)
+    options.update(requests=os.devnull, reload_interval=0, api_port=0, store_dir=None, record=None, routing_workers=0)
+    return options
+
+  def call(self, func, *args):
+    # func(*args), its execution time added to those of its name
+    start = monotonic_ns()
+    func(*args)
+    times = self.times.get(func.__name__)
+    if times is None:
+      times = self.times[func.__name__] = RingBuffer(1000000)
+    times.append((monotonic_ns() - start) / 1e6)
+
+  def schedule(self, t, interval, func):
+    heapq.heappush(self.queue, (t + int(interval * 1000000000), self.sequence, interval, func))
+    self.sequence += 1
+
+  def run_timers(self, until):
+    while self.queue and self.queue[0][0] <= until:
+      t, sequence, interval, func = heapq.heappop(self.queue)
+      self.wait(t)
+      self.now = t
+      self.call(func)
+      self.schedule(t, interval, func)
+
+  def wait(self, t):
+    # sleep until the recorded time t [ns] is due at the replay speed
+    if self.speed > 0:
+      delay = self.wall_start + (t - self.first) / 1e9 / self.speed - time.time()
+      if delay > 0:
+        time.sleep(delay)
+
+  def expect_probe(self, packet, t):
+    # the probe as pending since its sending time: the latest time before t [us] with the low 32 bits of its timestamp
+    d, link_id, seq = qos.myproto.parse(packet.payload)
+    sent = t - ((t - d) & 0xFFFFFFFF)
+    if t - sent <= qos.PROBE_TIMEOUT * 1000000: # a later probe had been expired by the recorded controller
+      qos.pending_probes[(link_id, seq)] = sent
+
+  def dispatch(self, event):
+    if event.type == CONNECTION_UP:
+      connection = ReplayConnection(event.dpid, event.ports)
+      self.openflow.connections[event.dpid] = connection
+      self.call(qos._handle_ConnectionUp, Record(connection=connection, dpid=event.dpid))
+    elif event.type == OWD:
+      qos.OWD[event.dpid] = event.owd
+      qos.owd_updated[event.dpid] = event.time
+    elif event.type == LINK:
+      link = Record(dpid1=event.dpid, port1=event.port1, dpid2=event.dpid2, port2=event.port2)
+      self.call(qos._handle_LinkEvent, Record(link=link, added=event.added, removed=not event.added))
+    else:
+      connection = self.openflow.connections.get(event.dpid)
+      if connection is None:
+        self.skipped += 1
+        return
+      if event.type == PACKET_IN:
+        packet = ethernet(event.data)
+        if packet.type == 0x5577:
+          self.expect_probe(packet, event.time)
+        buffer_id = event.buffer_id if event.buffer_id != 0xFFFFFFFF else None
+        ofp = of.ofp_packet_in(in_port=event.in_port, buffer_id=buffer_id, data=event.data)
+        self.call(qos._handle_PacketIn, Record(connection=connection, dpid=event.dpid, port=event.in_port, ofp=ofp, parsed=packet, data=event.data))
+      elif event.type == PORT_STATS:
+        # without the xid: the stats requests of the recorded controller are not pending here
+        self.call(qos._handle_portstats_received, Record(connection=connection, dpid=event.dpid, ofp=[Record(xid=None)], stats=event.stats))
+      elif event.type == FLOW_STATS:
+        stats = [Record(priority=f.priority, match=of.ofp_match(**f.match), byte_count=f.byte_count, packet_count=f.packet_count)
+                 for f in event.stats]
+        self.call(qos._handle_flowstats_received, Record(connection=connection, dpid=event.dpid, stats=stats))
+    name = TYPE_NAMES.get(event.type, str(event.type))
+    self.counts[name] = self.counts.get(name, 0) + 1
+
+  def run(self):
+    qos.clock = Clock(source=self.now_ns)
+    qos.apply_requests(self.header.get("requests") or [])
+    qos.network_ready = True # the controller's timers are run by the replay
+    self.first = None
+    self.wall_start = time.time()
+    start = monotonic_ns()
+    for event in self.events:
+      t = event.time * 1000
+      if self.first is None:
+        self.first = t
+        if self.timers:
+          self.schedule(t, qos.STATS_INTERVAL, qos._timer_func)
+          self.schedule(t, qos.RECOMPUTE_INTERVAL, qos.find_matching_link)
+      self.run_timers(t)
+      self.wait(t)
+      self.now = t
+      self.dispatch(event)
+    self.elapsed = (monotonic_ns() - start) / 1e9
+    self.duration = (self.now - self.first) / 1e9 if self.first is not None else 0.0
+
+  def report(self):
+    handlers = {}
+    for name, times in self.times.items():
+      handlers[name] = {"calls": len(times), "mean_ms": times.mean(), "p50_ms": times.percentile(50),
+                        "p99_ms": times.percentile(99), "max_ms": times.max()}
+    events = sum(self.counts.values())
+    return {
+      "recorded_s": self.duration,
+      "wall_s": self.elapsed,
+      "speedup": self.duration / self.elapsed if self.elapsed > 0 else None,
+      "events": self.counts,
+      "events_per_s": events / self.elapsed if self.elapsed > 0 else None,
+      "skipped": self.skipped,
+      "handlers": handlers,
+      "delays_ms": dict((name, link.delay if link.delay != float("inf") else None) for name, link in qos.links.items()),
+      "routes": dict((key, [edge.key for edge in path]) for key, path in qos.conn_paths.items()),
+      "flow_mods": {"sent": qos.flow_mods_sent, "suppressed": qos.flow_mods_suppressed},
+    }
+
+def print_report(report):
+  print "replayed %.1f s of recording in %.2f s (%.1fx, %.0f events/s)" % (
+    report["recorded_s"], report["wall_s"], report["speedup"] or 0, report["events_per_s"] or 0)
+  line = "events: " + ", ".join("%s %d" % (name, count) for name, count in sorted(report["events"].items()))
+  if report["skipped"]:
+    line += " (%d of switches not connected skipped)" % report["skipped"]
+  print line
+  for name, entry in sorted(report["handlers"].items()):
+    print "%-28s %8d calls, mean %.3f ms, p50 %.3f ms, p99 %.3f ms, max %.3f ms" % (name, entry["calls"],
+      entry["mean_ms"], entry["p50_ms"], entry["p99_ms"], entry["max_ms"])
+  for name, delay in sorted(report["delays_ms"].items()):
+    print "%-10s %s" % (name, "%.3f ms" % delay if delay is not None else "no estimate")
+  for key, path in sorted(report["routes"].items()):
+    print "%-10s %s" % (key, " ".join(path))
+  print "flow_mods: sent %d, suppressed %d" % (report["flow_mods"]["sent"], report["flow_mods"]["suppressed"])
+
+def main():
+  parser = argparse.ArgumentParser(description="Replay a recording of qos_controller (--record) into its handlers.")
+  parser.add_argument("recording")
+  parser.add_argument("--speed", type=float, default=0.0, help="replay pace relative to the recording, 0: as fast as possible")
+  parser.add_argument("--no_timers", action="store_true", help="do not run find_matching_link and the stats timer")
+  parser.add_argument("--option", action="append", default=[], metavar="NAME=VALUE",
+                      help="qos_controller.launch option replacing the recorded one, e.g. --option solver=greedy (repeatable)")
+  parser.add_argument("--profile", action="store_true", help="show the functions the replay spent the most time in")
+  parser.add_argument("--json", help="write the report to this file")
+  parser.add_argument("--verbose", action="store_true", help="show the controller output")
+  args = parser.parse_args()
+
+  replay = Replay(args.recording, args.speed, not args.no_timers)
+  options = replay.options(dict(option.split("=", 1) for option in args.option))
+  profile = None
+  if args.profile:
+    import cProfile
+    profile = cProfile.Profile()
+  stdout = sys.stdout
+  if not args.verbose:
+    sys.stdout = open(os.devnull, "w")
+  try:
+    replay.install()
+    qos.launch(**options)
+    if profile is not None:
+      profile.enable()
+    replay.run()
+    if profile is not None:
+      profile.disable()
+  finally:
+    sys.stdout = stdout
+  report = replay.report()
+  print_report(report)
+  if profile is not None:
+    import pstats
+    pstats.Stats(profile, stream=sys.stdout).sort_stats("cumulative").print_stats(25)
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+  main()
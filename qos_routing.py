@@ -0,0 +1,327 @@
+# Path computation for the QoS controller (qos_controller.py).
+# The module does not depend on POX so the same code can be used by offline tools.
+# Overall operation:
+#    - the network is a directed graph of switches, every edge carries the measured delay of the link it is part of,
+#    - delays_to() runs one reverse Dijkstra per destination switch, giving the lowest possible delay from every switch to it,
+#    - constrained_path() walks from the source switch and uses those values to prune every branch that cannot meet the delay bound.
+
+import heapq
+
+INF = float("inf")
+
+class Edge(object):
+  __slots__ = ("src", "dst", "delay", "key", "out_port", "in_port")
+
+  def __init__(self, src, dst, delay, key, out_port, in_port):
+    self.src = src           # switch the edge leaves
+    self.dst = dst           # switch the edge enters
+    self.delay = delay       # measured delay [ms]
+    self.key = key           # name of the (bidirectional) link the edge belongs to
+    self.out_port = out_port # port of src the traffic is sent to
+    self.in_port = in_port   # port of dst the traffic comes in through
+
+class Graph:
+  def __init__(self):
+    self.adj = {} # switch => list of edges leaving it
+    self.radj = {} # switch => list of edges entering it
+
+  def add_edge(self, src, dst, delay, key, out_port, in_port):
+    edge = Edge(src, dst, delay, key, out_port, in_port)
+    self.adj.setdefault(src, []).append(edge)
+    self.adj.setdefault(dst, [])
+    self.radj.setdefault(dst, []).append(edge)
+    self.radj.setdefault(src, [])
+    return edge
+
+def delays_to(graph, dst):
+  # reverse Dijkstra: lowest delay from every switch to dst (switches that cannot reach dst are left out)
+  radj = graph.radj
+  dist = {dst: 0}
+  heap = [(0, dst)]
+  done = set()
+  push, pop = heapq.heappush, heapq.heappop
+  while heap:
+    d, v = pop(heap)
+    if v in done:
+      continue
+    done.add(v)
+    for edge in radj.get(v, ()):
+      u = edge.src
+      if u in done:
+        continue
+      nd = d + edge.delay
+      if nd < dist.get(u, INF):
+        dist[u] = nd
+        push(heap, (nd, u))
+  return dist
+
+def path_delay(path):
+  return sum(edge.delay for edge in path)
+
+def constrained_path(graph, src, dst, max_delay, h=None, usable=None, cost=None):
+  # Find a path src => dst with a total delay <= max_delay, over edges accepted by usable(edge) (all if None).
+  # h are the lower bounds returned by delays_to(graph, dst); they can be shared by all requests towards dst.
+  # Among the feasible next hops the one using most of the delay budget is tried first, which keeps the fastest
+  # links free for requests with tighter bounds (same preference as the original s1->sX link selection).
+  # With cost(edge) the feasible next hops are tried by increasing cost instead, e.g. the load of their link to
+  # spread connections over parallel paths; the delay budget only breaks ties.
+  # Every switch is expanded at most once, so a single search is O(E).
+  if src == dst:
+    return []
+  if h is None:
+    h = delays_to(graph, dst)
+  if h.get(src, INF) > max_delay:
+    return None
+
+  visited = set([src])
+  path = []
+  stack = [(src, 0, iter(_next_hops(graph, src, 0, max_delay, h, usable, visited, cost)))]
+  while stack:
+    node, acc, hops = stack[-1]
+    edge = next(hops, None)
+    if edge is None:
+      stack.pop()
+      if path:
+        path.pop()
+      continue
+    if edge.dst in visited:
+      continue
+    visited.add(edge.dst)
+    path.append(edge)
+    if edge.dst == dst:
+      return path
+    nacc = acc + edge.delay
+    stack.append((edge.dst, nacc, iter(_next_hops(graph, edge.dst, nacc, max_delay, h, usable, visited, cost))))
+  return None
+
+def _next_hops(graph, node, acc, max_delay, h, usable, visited, cost):
+  hops = []
+  for edge in graph.adj.get(node, ()):
+    if edge.dst in visited:
+      continue
+    bound = acc + edge.delay + h.get(edge.dst, INF)
+    if bound > max_delay:
+      continue
+    if usable is not None and not usable(edge):
+      continue
+    hops.append((bound, edge))
+  if cost is None:
+    hops.sort(key=lambda hop: hop[0], reverse=True)
+  else:
+    hops.sort(key=lambda hop: (cost(hop[1]), -hop[0]))
+  return [edge for bound, edge in hops]
+
+def simple_paths(graph, src, dst, max_delay, k, h=None, max_expansions=None):
+  # Up to k simple paths src => dst with a delay <= max_delay, by increasing delay. Best-first search over partial
+  # paths ordered by their delay plus the lower bound h of the rest, so the paths reach dst shortest first.
+  # max_expansions (default 1000 * k) bounds the work on graphs with very many paths within the bound.
+  if src == dst:
+    return [[]]
+  if h is None:
+    h = delays_to(graph, dst)
+  if h.get(src, INF) > max_delay:
+    return []
+  if max_expansions is None:
+    max_expansions = 1000 * k
+  push, pop = heapq.heappush, heapq.heappop
+  paths = []
+  heap = [(h[src], 0, 0, src, None)] # (bound, tie breaker, delay so far, switch, partial path as (edge, parent))
+  counter = 1
+  while heap and len(paths) < k and max_expansions > 0:
+    bound, _, acc, node, partial = pop(heap)
+    if node == dst:
+      path = []
+      while partial is not None:
+        path.append(partial[0])
+        partial = partial[1]
+      path.reverse()
+      paths.append(path)
+      continue
+    max_expansions -= 1
+    on_path = set([src])
+    p = partial
+    while p is not None:
+      on_path.add(p[0].dst)
+      p = p[1]
+    for edge in graph.adj.get(node, ()):
+      if edge.dst in on_path:
+        continue
+      nacc = acc + edge.delay
+      nbound = nacc + h.get(edge.dst, INF)
+      if nbound > max_delay:
+        continue
+      push(heap, (nbound, counter, nacc, edge.dst, (edge, partial)))
+      counter += 1
+  return paths
+
+EPS = 1e-9
+
+def assign(demands, candidates, capacity, keep=None, hold=None, spread=True, gain=0.0, limit=None, depth=1, branch=4):
+  # Assign every request to at most one of its candidate paths so that no link carries more than its capacity:
+  #    - demands[i] is the bandwidth of request i, candidates[i] its paths as tuples of link indices, in order of
+  #      preference, capacity[l] the capacity of link l (same unit as the demands),
+  #    - keep[i] is the index of the path request i is on now (or None), it is placed there first if it still fits,
+  #      hold[i] true forbids moving it once placed, to balance the load or to make room for another request (both per
+  #      request, optional).
+  # Returns the index of the chosen path per request (None for the requests left out).
+  # Steps:
+  #    1. the kept paths,
+  #    2. the other requests, most constrained first (fewest candidates, then largest demand, then by their paths),
+  #       each on the candidate with the lowest utilisation of its busiest link once the request is added (spread),
+  #       or on the first one that fits (not spread): the result does not depend on the order of the requests
+  #       (requests with the same demand and paths are interchangeable),
+  #    3. every request still out: augmenting chains as in bipartite matching, a request that blocks one of its
+  #       candidates (and is not held) is moved to another path of its own (recursively up to depth, trying the branch
+  #       smallest ones),
+  #    4. with spread, while the busiest link is used above limit (share of its capacity, None: whatever its use),
+  #       requests not held are moved off it if that lowers the highest utilisation by more than gain.
+  # Placing unsplittable requests on shared links is NP-hard; the chains find every request that can be admitted by
+  # moving up to depth others, which is exact for single-link bottlenecks and equal demands (b-matching).
+  n = len(demands)
+  inv = [1.0 / c if c > 0 else INF for c in capacity]
+  load = [0.0] * len(capacity)
+  users = [set() for c in capacity]
+  choice = [None] * n
+
+  def place(i, c):
+    d = demands[i]
+    for l in candidates[i][c]:
+      load[l] += d
+      users[l].add(i)
+    choice[i] = c
+
+  def unplace(i):
+    d = demands[i]
+    for l in candidates[i][choice[i]]:
+      load[l] -= d
+      users[l].discard(i)
+    choice[i] = None
+
+  def fits(path, d):
+    for l in path:
+      if load[l] + d > capacity[l] + EPS:
+        return False
+    return True
+
+  def best(i):
+    d = demands[i]
+    chosen, chosen_util = None, INF
+    for c, path in enumerate(candidates[i]):
+      if not fits(path, d):
+        continue
+      if not spread:
+        return c
+      util = max([(load[l] + d) * inv[l] for l in path] or [0.0])
+      if util < chosen_util:
+        chosen, chosen_util = c, util
+    return chosen
+
+  order = sorted(range(n), key=lambda i: (len(candidates[i]), -demands[i], candidates[i]))
+  rank = [0] * n # position in order, breaks the ties of the later steps by request rather than by index
+  for r, i in enumerate(order):
+    rank[i] = r
+  if keep is not None:
+    for i in order:
+      c = keep[i]
+      if c is not None and fits(candidates[i][c], demands[i]):
+        place(i, c)
+
+  # Requests sharing a candidate list share a heap of its paths by utilisation of their busiest link. Loads only
+  # grow in this step, so an entry is at most too low: it is refreshed when popped and used once it is current.
+  heaps = {}
+  def best_shared(i):
+    d = demands[i]
+    paths = candidates[i]
+    heap = heaps.get(id(paths))
+    if heap is None:
+      heap = heaps[id(paths)] = [(max([load[l] * inv[l] for l in path] or [0.0]), c) for c, path in enumerate(paths)]
+      heapq.heapify(heap)
+    while heap:
+      util, c = heap[0]
+      current = max([load[l] * inv[l] for l in paths[c]] or [0.0])
+      if current > util:
+        heapq.heapreplace(heap, (current, c))
+        continue
+      if fits(paths[c], d):
+        return c
+      return best(i) # the least used path is full for d, other capacities may still take it
+    return None
+
+  for i in order:
+    if choice[i] is None:
+      c = best_shared(i) if spread else best(i)
+      if c is not None:
+        place(i, c)
+
+  def augment(i, level, busy):
+    d = demands[i]
+    c = best(i)
+    if c is not None:
+      place(i, c)
+      return True
+    if level == 0:
+      return False
+    for c, path in enumerate(candidates[i]):
+      blocking = [l for l in path if load[l] + d > capacity[l] + EPS]
+      tried = 0
+      for q in sorted(users[blocking[0]], key=rank.__getitem__):
+        if tried == branch:
+          break
+        if q in busy or (hold is not None and hold[q]):
+          continue
+        qpath = candidates[q][choice[q]]
+        dq = demands[q]
+        if any(load[l] - (dq if l in qpath else 0) + d > capacity[l] + EPS for l in path):
+          continue
+        tried += 1
+        old = choice[q]
+        unplace(q)
+        place(i, c)
+        busy.add(q)
+        if augment(q, level - 1, busy):
+          return True
+        busy.discard(q)
+        unplace(i)
+        place(q, old)
+    return False
+
+  failed = {} # id of a candidate list => smallest demand that could not be admitted over it
+  for i in order:
+    if choice[i] is not None or not candidates[i]:
+      continue
+    key = id(candidates[i])
+    if demands[i] >= failed.get(key, INF):
+      continue
+    if not augment(i, depth, set([i])):
+      failed[key] = demands[i]
+
+  if spread:
+    moved = True
+    rounds = n
+    while moved and rounds > 0:
+      moved = False
+      rounds -= 1
+      top = max(range(len(capacity)), key=lambda l: load[l] * inv[l]) if capacity else None
+      if top is None:
+        break
+      util = load[top] * inv[top]
+      if limit is not None and util <= limit + EPS:
+        break
+      for i in sorted(users[top], key=lambda i: (-demands[i], rank[i])):
+        if hold is not None and hold[i]:
+          continue
+        d = demands[i]
+        c_old = choice[i]
+        unplace(i)
+        chosen, chosen_util = None, util - gain - EPS
+        for c, path in enumerate(candidates[i]):
+          if top in path or not fits(path, d):
+            continue
+          new_util = max([(load[l] + d) * inv[l] for l in path] or [0.0])
+          if new_util < chosen_util:
+            chosen, chosen_util = c, new_util
+        place(i, c_old if chosen is None else chosen)
+        if chosen is not None:
+          moved = True
+          break
+  return choice
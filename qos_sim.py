@@ -0,0 +1,454 @@
+#!/usr/bin/python
+# Offline discrete-event simulator for the QoS controller (qos_controller.py), no Mininet or Open vSwitch needed.
+# Overall operation:
+#    - the switches of the link table are emulated: the controller's messages are answered after the simulated
+#      control channel delay, probes come back as PacketIn after the delay the trace gives their link at that time,
+#    - the controller runs on a virtual clock and its timers are events of the simulation, so a run takes the time
+#      the controller needs to compute, not the simulated time,
+#    - link delays and per-connection traffic follow a trace: a JSON file, or by default the cDelay1/2/3 schedule of qos_net.py,
+#    - the true delay of every routed connection is checked against its bound; SLA violations, reroutes, flow_mods
+#      and the time taken by find_matching_link are reported at the end,
+#    - with --fast_forward the steady stretches between trace changes are skipped: once the paths, delay estimates
+#      and link rates have stayed the same for FAST_FORWARD_SETTLE recomputes (and no route is held down), the
+#      simulation jumps to the next change of the trace (by whole periods of the controller's timers). The
+#      controller's clock does not move over a jump, the trace moves closer; the SLA state found before the jump is
+#      counted for the time skipped.
+# e.g. python qos_sim.py --duration=3600 --option solver=greedy --option estimator=kalman --json=report.json
+#      python qos_sim.py --duration=604800 --trace=week.json --fast_forward
+#
+# Trace format (times in s, delays in ms, rates in Mbit/s, every field optional):
+#    {"delays": [{"time": 0, "link": "s1-s2", "delay": 200}, ...],
+#     "traffic": [{"time": 0, "conn": "h1<->h4", "rate": 300}, ...],
+#     "requests": [{"src": "h1", "dst": "h4", "min_delay": 100}, ...],
+#     "jitter": 1.0, "control_delay": 1.0}
+
+import sys
+import os
+import json
+import heapq
+import random
+import argparse
+import time
+from fractions import gcd
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01 as of_01
+import qos_controller as qos
+from qos_stats import Clock, RingBuffer, monotonic_ns
+from qos_stubs import Record, SimOpenFlow
+
+# qos_net.py: initial delays, then cDelay1, cDelay2, cDelay3 every 30 s [ms]
+QOS_NET_DELAYS = [
+  # s1-s2, s1-s3, s1-s4
+  (200, 50, 10),
+  (10, 200, 50),
+  (50, 10, 200),
+  (200, 50, 10),
+]
+QOS_NET_INTERVAL = 30
+
+FAST_FORWARD_SETTLE = 5 # recomputes with the same decisions before a jump
+FAST_FORWARD_TOLERANCE = 0.01 # relative change of a delay estimate or link rate still counted as the same
+
+def qos_net_trace(duration):
+  # the delay schedule of qos_net.py up to duration [s]; the s2/s3/s4-s5 links have no delay
+  delays = [{"time": 0, "link": name, "delay": 0} for name in ("s2-s5", "s3-s5", "s4-s5")]
+  for name, delay in zip(("s1-s2", "s1-s3", "s1-s4"), QOS_NET_DELAYS[0]):
+    delays.append({"time": 0, "link": name, "delay": delay})
+  t, turn = 0, 0
+  while t < duration:
+    for name, delay in zip(("s1-s2", "s1-s3", "s1-s4"), QOS_NET_DELAYS[1 + turn]):
+      delays.append({"time": t, "link": name, "delay": delay})
+    t += QOS_NET_INTERVAL
+    turn = (turn + 1) % 3
+  return {"delays": delays}
+
+class ProbePacket(object):
+  # what _handle_PacketIn reads from a parsed probe, without parsing the whole frame
+  type = 0x5577
+
+  def __init__(self, data):
+    self.payload = data[14:]
+
+  def find(self, name):
+    return self if name == "ethernet" else None
+
+class SimConnection(object):
+  def __init__(self, sim, name, dpid, ports):
+    self.sim = sim
+    self.name = name
+    self.dpid = dpid
+    self.features = Record(ports=[Record(name="%s-eth%d" % (name, port), port_no=port, hw_addr=None) for port in ports])
+    self.ports = dict((port.port_no, port) for port in self.features.ports)
+    self.rules = {} # flow_key => flow_mod, the permanent rules the controller installed
+
+  def send(self, msg):
+    self.sim.handle_message(self, msg)
+
+class Simulator(object):
+  def __init__(self, trace, duration, control_delay=1.0, jitter=0.0, seed=1, fast_forward=False):
+    self.duration = int(duration * 1000000000) # [ns]
+    self.control_delay = trace.get("control_delay", control_delay) # one way, controller <=> switch [ms]
+    self.jitter = trace.get("jitter", jitter) # uniform noise added to every probe crossing a link [ms]
+    self.random = random.Random(seed)
+    self.now = 0 # virtual time of the controller [ns]
+    self.skipped = 0 # simulated time fast-forwarded: the trace is that far ahead of the controller [ns]
+    self.events = [] # controller and switch events, in controller time
+    self.sequence = 0
+    self.delays = {} # link name => true delay [ms]
+    self.traffic = {} # "src<->dst" => offered rate [Mbit/s]
+    self.changes = [] # (simulated time [ns], sequence, func, args) of the trace, in order
+    for entry in trace.get("delays", []):
+      self.add_change(entry["time"], self.set_delay, entry["link"], entry["delay"])
+    for entry in trace.get("traffic", []):
+      self.add_change(entry["time"], self.set_traffic, entry["conn"], entry["rate"])
+    self.changes.sort()
+    self.next_change = 0
+    self.requests = trace.get("requests")
+    self.fast_forward = fast_forward
+    self.settled = None # (paths, delays, rates) at the last recompute
+    self.steady = 0 # recomputes since the decisions last changed
+    self.jumps = 0
+
+    # byte counters are integrated lazily: bytes at the last rate change plus rate * time since then
+    self.port_bytes = {} # (dpid, port, "rx"/"tx") => (bytes, rate [bit/s], since [ns])
+    self.flow_bytes = {} # "src<->dst" => (bytes, rate [bit/s], since [ns])
+
+    # results
+    self.violation_time = {} # "src<->dst" => time spent over its delay bound [ns]
+    self.violations = {} # "src<->dst" => number of violation episodes
+    self.violating = {} # "src<->dst" => start of the current violation [ns]
+    self.recoveries = [] # duration of the finished violations [s]
+    self.unrouted_time = {} # "src<->dst" => time without a path [ns]
+    self.reroutes = {} # "src<->dst" => number of path changes
+    self.decision_times = RingBuffer(1000000) # wall time of every find_matching_link run [ms]
+    self.state_time = 0 # time up to which the SLA state has been accounted [ns]
+    self.paths = {} # "src<->dst" => link names of the path at the last check
+
+  def now_ns(self):
+    return self.now
+
+  def time(self):
+    # simulated time [ns]: the controller's plus the time fast-forwarded
+    return self.now + self.skipped
+
+  def schedule(self, delay, func, *args):
+    # run func(*args) delay [s] from now
+    heapq.heappush(self.events, (self.now + int(delay * 1000000000), self.sequence, func, args))
+    self.sequence += 1
+
+  def add_change(self, t, func, *args):
+    # run func(*args) at the simulated time t [s] of the trace
+    self.changes.append((int(t * 1000000000), self.sequence, func, args))
+    self.sequence += 1
+
+  def every(self, interval, func):
+    def tick():
+      func()
+      self.schedule(interval, tick)
+    self.schedule(interval, tick)
+
+  # --- network ---
+
+  def setup(self):
+    qos.clock = Clock(source=self.now_ns)
+    if self.requests is not None:
+      qos.apply_requests(self.requests)
+    for link in qos.links.values():
+      self.delays.setdefault(link.name, 0.0)
+    ports = {}
+    for link in qos.links.values():
+      ports.setdefault(link.src, set()).add(link.src_port)
+      ports.setdefault(link.dst, set()).add(link.dst_port)
+    for switch, port, ip in qos.HOSTS.values():
+      ports.setdefault(switch, set()).add(port)
+    self.openflow.connections.clear()
+    qos.network_ready = True # the controller's timers are run by the simulator
+    for dpid, name in enumerate(sorted(ports), 1):
+      connection = SimConnection(self, name, dpid, sorted(ports[name]))
+      self.openflow.connections[dpid] = connection
+      qos._handle_ConnectionUp(Record(connection=connection, dpid=dpid))
+    self.link_by_port = dict(((link.src, link.src_port), link) for link in qos.links.values())
+    self.every(qos.STATS_INTERVAL, qos._timer_func)
+    if qos.ECHO_RATE > 0:
+      self.every(1.0 / qos.ECHO_RATE, qos._echo_func)
+    self.every(1.0 / qos.PROBE_RATE, qos._probe_func)
+    self.every(qos.RECOMPUTE_INTERVAL, self.recompute)
+    # jumps are whole multiples of every timer period, the timers keep their phase against the trace
+    periods = [qos.STATS_INTERVAL, 1.0 / qos.PROBE_RATE, qos.RECOMPUTE_INTERVAL] + ([1.0 / qos.ECHO_RATE] if qos.ECHO_RATE > 0 else [])
+    self.jump_unit = 1
+    for period in periods:
+      period = int(round(period * 1000000000))
+      self.jump_unit = self.jump_unit * period // gcd(self.jump_unit, period)
+
+  def set_delay(self, name, delay):
+    self.account()
+    self.delays[name] = float(delay)
+    self.check()
+
+  def set_traffic(self, key, rate):
+    self.account()
+    self.traffic[key] = float(rate)
+    self.update_rates()
+
+  def control(self):
+    # one way delay of the control channel [s]
+    return self.control_delay / 1000.0
+
+  def handle_message(self, connection, msg):
+    if isinstance(msg, of.ofp_packet_out):
+      link = self.link_by_port.get((connection.name, msg.actions[0].port)) if msg.data else None
+      if link is not None:
+        delay = self.delays[link.name] + self.random.uniform(0, self.jitter)
+        self.schedule(self.control() + delay / 1000.0 + self.control(), self.probe_in, link, msg.data)
+    elif isinstance(msg, of.ofp_flow_mod):
+      key = qos.flow_key(msg.priority, msg.match)
+      if msg.command in (of.OFPFC_DELETE, of.OFPFC_DELETE_STRICT):
+        connection.rules.pop(key, None)
+      else:
+        connection.rules[key] = msg
+    elif isinstance(msg, of.ofp_echo_request):
+      # through of_01's dispatch table, as POX passes the reply on
+      self.schedule(2 * self.control(), of_01.handlers[of.OFPT_ECHO_REPLY], connection, msg)
+    elif isinstance(msg, of.ofp_barrier_request):
+      self.schedule(2 * self.control(), self.barrier_in, connection, msg)
+    elif isinstance(msg, of.ofp_stats_request):
+      if isinstance(msg.body, of.ofp_port_stats_request):
+        self.schedule(2 * self.control(), self.port_stats, connection, msg)
+      else:
+        self.schedule(2 * self.control(), self.flow_stats, connection, msg)
+
+  def probe_in(self, link, data):
+    connection = self.openflow.connections[qos.switch_dpids[link.dst]]
+    qos._handle_PacketIn(Record(connection=connection, dpid=connection.dpid, port=link.dst_port, parsed=ProbePacket(data), ofp=None))
+
+  def barrier_in(self, connection, msg):
+    qos._handle_BarrierIn(Record(connection=connection, dpid=connection.dpid, xid=msg.xid, ofp=msg))
+
+  def counter(self, table, key):
+    value, rate, since = table.get(key, (0.0, 0.0, self.now))
+    return value + rate / 8 * (self.now - since) / 1e9
+
+  def port_stats(self, connection, msg):
+    stats = []
+    for port in sorted(connection.ports):
+      rx = self.counter(self.port_bytes, (connection.dpid, port, "rx"))
+      tx = self.counter(self.port_bytes, (connection.dpid, port, "tx"))
+      stats.append(Record(port_no=port, rx_bytes=int(rx), tx_bytes=int(tx), rx_packets=int(rx) // 1500, tx_packets=int(tx) // 1500))
+    qos._handle_portstats_received(Record(connection=connection, dpid=connection.dpid, ofp=[msg], stats=stats))
+
+  def flow_stats(self, connection, msg):
+    ingress = dict(((dpid, key), conn) for conn, (dpid, key) in qos.conn_flows.items() if dpid == connection.dpid)
+    stats = []
+    for key, rule in connection.rules.items():
+      conn = ingress.get((connection.dpid, key))
+      byte_count = int(self.counter(self.flow_bytes, conn)) if conn is not None else 0
+      stats.append(Record(priority=rule.priority, match=rule.match, byte_count=byte_count, packet_count=byte_count // 1500))
+    qos._handle_flowstats_received(Record(connection=connection, dpid=connection.dpid, stats=stats))
+
+  def update_rates(self):
+    # traffic of every connection on the path the controller gave it, in the request's direction
+    rates = {}
+    flows = {}
+    for key, path in qos.conn_paths.items():
+      conn = key.split("#")[0]
+      rate = self.traffic.get(conn, 0.0) * 1000000
+      if "#" in key:
+        rate /= qos.FLOW_BUCKETS
+      flows[conn] = flows.get(conn, 0.0) + rate
+      for edge in path:
+        src, dst = qos.switch_dpids[edge.src], qos.switch_dpids[edge.dst]
+        rates[(src, edge.out_port, "tx")] = rates.get((src, edge.out_port, "tx"), 0.0) + rate
+        rates[(dst, edge.in_port, "rx")] = rates.get((dst, edge.in_port, "rx"), 0.0) + rate
+    for table, new in ((self.port_bytes, rates), (self.flow_bytes, flows)):
+      for key in set(table) | set(new):
+        table[key] = (self.counter(table, key), new.get(key, 0.0), self.now)
+
+  # --- controller decisions and SLA accounting ---
+
+  def recompute(self):
+    self.account()
+    start = monotonic_ns()
+    qos.find_matching_link()
+    self.decision_times.append((monotonic_ns() - start) / 1e6)
+    self.update_rates()
+    self.check()
+    if self.fast_forward:
+      self.settle()
+
+  def settle(self):
+    # jump to the next change of the trace once the controller's decisions and inputs have stopped moving
+    delays = dict((name, link.delay) for name, link in qos.links.items())
+    rates = dict((name, link.rate) for name, link in qos.links.items())
+    same = lambda a, b: a == b or abs(a - b) <= FAST_FORWARD_TOLERANCE * max(abs(a), abs(b)) < float("inf")
+    if (self.settled is not None and self.paths == self.settled[0] and set(delays) == set(self.settled[1]) and
+        all(same(delays[name], self.settled[1][name]) and same(rates[name], self.settled[2][name]) for name in delays)):
+      self.steady += 1
+    else:
+      self.steady = 0
+    self.settled = (self.paths, delays, rates)
+    if self.steady < FAST_FORWARD_SETTLE:
+      return
+    now = qos.clock.us()
+    if any(now - route.changed < route.hold_down * 1000000 for route in qos.routes.values()):
+      return # a hold-down ending may change the paths
+    target = self.changes[self.next_change][0] if self.next_change < len(self.changes) else self.duration
+    target = min(target, self.duration)
+    # the change lands after the events due now (this recompute among them) but before those of the next period
+    skip = (target - self.time() - 1) // self.jump_unit * self.jump_unit
+    if skip > 0:
+      self.account()
+      self.skipped += skip
+      self.jumps += 1
+      self.steady = 0
+
+  def account(self):
+    # add the time since the last check to the violations and unrouted connections found then
+    elapsed = self.time() - self.state_time
+    for key in self.violating:
+      self.violation_time[key] = self.violation_time.get(key, 0) + elapsed
+    for node in qos.req_conn:
+      key = qos.conn_key(node)
+      if key not in self.paths:
+        self.unrouted_time[key] = self.unrouted_time.get(key, 0) + elapsed
+    self.state_time = self.time()
+
+  def check(self):
+    # true delay of every routed connection against its bound; paths only change here or with the delays
+    paths = {}
+    for node in qos.req_conn:
+      key = qos.conn_key(node)
+      parts = [qos.conn_paths[qos.conn_key(part)] for part in qos.placements(node) if qos.conn_key(part) in qos.conn_paths]
+      if not parts:
+        continue
+      paths[key] = [[edge.key for edge in path] for path in parts]
+      if key in self.paths and self.paths[key] != paths[key]:
+        self.reroutes[key] = self.reroutes.get(key, 0) + 1
+      delay = max(sum(self.delays[name] for name in names) for names in paths[key])
+      if delay > node["min_delay"] * qos.DELAY_TOLERANCE:
+        if key not in self.violating:
+          self.violating[key] = self.time()
+          self.violations[key] = self.violations.get(key, 0) + 1
+      elif key in self.violating:
+        self.recoveries.append((self.time() - self.violating.pop(key)) / 1e9)
+    for key in list(self.violating):
+      if key not in paths:
+        self.recoveries.append((self.time() - self.violating.pop(key)) / 1e9)
+    self.paths = paths
+
+  def install(self):
+    # the emulated switches take the place of the openflow component, before qos_controller.launch registers its listeners
+    self.openflow = SimOpenFlow()
+    core.register("openflow", self.openflow)
+
+  def run(self):
+    self.setup()
+    self.check()
+    events = 0
+    start = time.time()
+    while True:
+      # the trace changes come first at the same simulated time, as they were scheduled first
+      change = self.changes[self.next_change][0] if self.next_change < len(self.changes) else None
+      event = self.events[0][0] + self.skipped if self.events else None
+      if change is not None and (event is None or change <= event):
+        if change > self.duration:
+          break
+        t, sequence, func, args = self.changes[self.next_change]
+        self.next_change += 1
+        self.now = t - self.skipped
+      elif event is not None and event <= self.duration:
+        self.now, sequence, func, args = heapq.heappop(self.events)
+      else:
+        break
+      func(*args)
+      events += 1
+    self.now = self.duration - self.skipped
+    self.account()
+    self.elapsed = time.time() - start
+    self.event_count = events
+
+  def report(self):
+    times = self.decision_times
+    simulated = self.duration / 1e9
+    return {
+      "simulated_s": simulated,
+      "wall_s": self.elapsed,
+      "simulated_min_per_s": simulated / 60 / self.elapsed if self.elapsed > 0 else None,
+      "events": self.event_count,
+      "fast_forward": {"jumps": self.jumps, "skipped_s": self.skipped / 1e9},
+      "connections": [qos.conn_key(node) for node in qos.req_conn],
+      "violations": self.violations,
+      "violation_s": dict((key, value / 1e9) for key, value in self.violation_time.items()),
+      "unrouted_s": dict((key, value / 1e9) for key, value in self.unrouted_time.items()),
+      "recovery_s": {"mean": sum(self.recoveries) / len(self.recoveries) if self.recoveries else None,
+                     "max": max(self.recoveries) if self.recoveries else None},
+      "reroutes": self.reroutes,
+      "flaps": dict((key, route.flaps) for key, route in qos.routes.items() if route.flaps),
+      "flow_mods": {"sent": qos.flow_mods_sent, "suppressed": qos.flow_mods_suppressed},
+      "decision_ms": {"runs": len(times), "mean": times.mean(), "p50": times.percentile(50),
+                      "p99": times.percentile(99), "max": times.max()},
+      "probes": dict((link.name, {"sent": link.probes_sent, "received": link.probes_received, "lost": link.probes_lost})
+                     for link in qos.links.values()),
+    }
+
+def print_report(report):
+  print "simulated %.0f s in %.2f s (%.0f simulated minutes per second, %d events)" % (
+    report["simulated_s"], report["wall_s"], report["simulated_min_per_s"] or 0, report["events"])
+  if report["fast_forward"]["jumps"]:
+    print "fast-forwarded %.0f s in %d jumps" % (report["fast_forward"]["skipped_s"], report["fast_forward"]["jumps"])
+  for key in report["connections"]:
+    print "%-10s violations %3d (%7.1f s over the bound) | unrouted %7.1f s | reroutes %3d" % (key,
+      report["violations"].get(key, 0), report["violation_s"].get(key, 0.0), report["unrouted_s"].get(key, 0.0),
+      report["reroutes"].get(key, 0))
+  recovery = report["recovery_s"]
+  if recovery["mean"] is not None:
+    print "time to leave a violation: mean %.2f s, max %.2f s" % (recovery["mean"], recovery["max"])
+  print "flow_mods: sent %d, suppressed %d" % (report["flow_mods"]["sent"], report["flow_mods"]["suppressed"])
+  decision = report["decision_ms"]
+  if decision["runs"]:
+    print "find_matching_link: %d runs, mean %.3f ms, p50 %.3f ms, p99 %.3f ms, max %.3f ms" % (
+      decision["runs"], decision["mean"], decision["p50"], decision["p99"], decision["max"])
+
+def main():
+  parser = argparse.ArgumentParser(description="Replay a delay/traffic trace into qos_controller with virtual time.")
+  parser.add_argument("--trace", help="JSON trace, the qos_net.py delay schedule if not given")
+  parser.add_argument("--duration", type=float, default=3600, help="simulated time [s]")
+  parser.add_argument("--requests", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "conn_req_parralel.json"),
+                      help="request file, unless the trace has requests")
+  parser.add_argument("--control_delay", type=float, default=1.0, help="one way controller <=> switch delay [ms]")
+  parser.add_argument("--jitter", type=float, default=0.0, help="uniform noise added to every probe [ms]")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--fast_forward", action="store_true", help="skip the steady time between two changes of the trace")
+  parser.add_argument("--option", action="append", default=[], metavar="NAME=VALUE",
+                      help="qos_controller.launch option, e.g. --option estimator=kalman (repeatable)")
+  parser.add_argument("--json", help="write the report to this file")
+  parser.add_argument("--verbose", action="store_true", help="show the controller output")
+  args = parser.parse_args()
+
+  if args.trace:
+    with open(args.trace) as f:
+      trace = json.load(f)
+  else:
+    trace = qos_net_trace(args.duration)
+  options = dict(option.split("=", 1) for option in args.option)
+  options.update(requests=args.requests, reload_interval=0, api_port=0)
+
+  stdout = sys.stdout
+  if not args.verbose:
+    sys.stdout = open(os.devnull, "w")
+  try:
+    sim = Simulator(trace, args.duration, args.control_delay, args.jitter, args.seed, args.fast_forward)
+    sim.install()
+    qos.launch(**options)
+    sim.run()
+  finally:
+    sys.stdout = stdout
+  report = sim.report()
+  print_report(report)
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+  main()
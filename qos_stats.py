@@ -0,0 +1,308 @@
+# Measurement clock and statistics for the QoS controller (qos_controller.py).
+# The module does not depend on POX so the same code can be used by offline tools.
+
+from array import array
+import time
+
+# Monotonic clock: NTP slews and steps of the wall clock must not show up in delay measurements.
+try:
+  from time import monotonic_ns
+except ImportError:
+  # Python 2: clock_gettime(CLOCK_MONOTONIC) from the C library (Linux)
+  try:
+    import ctypes, ctypes.util
+
+    class _timespec(ctypes.Structure):
+      _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    _CLOCK_MONOTONIC = 1
+    _libc = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"), use_errno=True)
+    _clock_gettime = _libc.clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    _ts = _timespec()
+    _ts_ref = ctypes.byref(_ts)
+
+    def monotonic_ns():
+      if _clock_gettime(_CLOCK_MONOTONIC, _ts_ref) != 0:
+        raise OSError(ctypes.get_errno(), "clock_gettime(CLOCK_MONOTONIC) failed")
+      return _ts.tv_sec * 1000000000 + _ts.tv_nsec
+  except (OSError, AttributeError):
+    def monotonic_ns():
+      return int(time.time() * 1000000000) # no monotonic clock available, fall back to the wall clock
+
+class Clock:
+  # Time elapsed since the clock was created, as integers in ns or us. source can be replaced by any
+  # function returning ns (e.g. a virtual clock for offline runs).
+  def __init__(self, source=monotonic_ns):
+    self.source = source
+    self.origin = source()
+
+  def ns(self):
+    return self.source() - self.origin
+
+  def us(self):
+    return (self.source() - self.origin) // 1000
+
+class RingBuffer:
+  # Fixed-capacity history of samples kept in a flat array of doubles: append is O(1) and the memory used
+  # is 8 bytes * capacity per buffer whatever the number of samples appended.
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.data = array('d', [0.0]) * capacity
+    self.start = 0 # index of the oldest sample
+    self.count = 0 # number of samples retained (<= capacity)
+    self.total = 0 # number of samples ever appended
+
+  def __len__(self):
+    return self.count
+
+  def append(self, value):
+    if self.count < self.capacity:
+      self.data[(self.start + self.count) % self.capacity] = value
+      self.count += 1
+    else:
+      self.data[self.start] = value
+      self.start = (self.start + 1) % self.capacity
+    self.total += 1
+
+  def clear(self):
+    self.start = 0
+    self.count = 0
+
+  def last(self, n=None):
+    # the n most recent samples (all retained ones if n is None), oldest first
+    if n is None or n > self.count:
+      n = self.count
+    first = (self.start + self.count - n) % self.capacity
+    end = first + n
+    if end <= self.capacity:
+      return self.data[first:end]
+    return self.data[first:] + self.data[:end - self.capacity]
+
+  def latest(self):
+    if self.count == 0:
+      return None
+    return self.data[(self.start + self.count - 1) % self.capacity]
+
+  def mean(self, n=None):
+    window = self.last(n)
+    if not window:
+      return None
+    return sum(window) / len(window)
+
+  def min(self, n=None):
+    window = self.last(n)
+    return min(window) if window else None
+
+  def max(self, n=None):
+    window = self.last(n)
+    return max(window) if window else None
+
+  def percentile(self, p, n=None):
+    # nearest-rank percentile, p in [0, 100]
+    window = sorted(self.last(n))
+    if not window:
+      return None
+    rank = int(round(p / 100.0 * (len(window) - 1)))
+    return window[max(0, min(rank, len(window) - 1))]
+
+# Delay estimators: every estimator turns the stream of delay samples of one link into the delay used for routing.
+# Outliers (further than outlier_k standard deviations from the estimate, and further than min_dev and rel_dev of the
+# estimate: on a stable link the variance is about 0) are dropped, unless more than max_outliers of them come in a row
+# at the same level (on the same side, within min_dev / rel_dev of each other), which is taken as a real change of the
+# delay: the estimator then restarts from the new level, seeded with the samples that announced it. A lone spike is
+# dropped, a step is followed after max_outliers + 1 samples.
+# variance is the EWMA of the squared deviation of the accepted samples from the previous estimate.
+
+class Estimator:
+  def __init__(self, outlier_k=3.0, max_outliers=1, warmup=5, min_dev=1.0, rel_dev=0.5, beta=0.25):
+    self.outlier_k = outlier_k       # 0 disables outlier rejection
+    self.max_outliers = max_outliers # longer runs of consistent outliers are a level shift
+    self.warmup = warmup             # samples accepted unconditionally after a (re)start
+    self.min_dev = min_dev           # deviations below this are never outliers, whatever the variance
+    self.rel_dev = rel_dev           # nor deviations below this share of the estimate
+    self.beta = beta                 # weight of a new sample in the variance
+    self.outliers = 0                # number of samples rejected so far
+    self.reset()
+
+  def reset(self):
+    self.value = None
+    self.variance = 0.0
+    self.samples = 0
+    self.pending = [] # the outliers of the current run
+
+  def tolerance(self, level):
+    return max(self.min_dev, self.rel_dev * abs(level))
+
+  def is_outlier(self, sample):
+    if not self.outlier_k or self.samples < self.warmup:
+      return False
+    deviation = abs(sample - self.value)
+    return deviation > self.tolerance(self.value) and deviation > self.outlier_k * self.variance ** 0.5
+
+  def update(self, sample):
+    if self.is_outlier(sample):
+      last = self.pending[-1] if self.pending else None
+      if last is None or (last > self.value) != (sample > self.value) or abs(sample - last) > self.tolerance(last):
+        self.pending = [] # not at the level of the previous outliers: a new run
+      self.pending.append(sample)
+      if len(self.pending) <= self.max_outliers:
+        self.outliers += 1
+        return self.value
+      shift = self.pending[:-1]
+      self.reset()
+      for earlier in shift:
+        self.accept(earlier)
+    self.pending = []
+    return self.accept(sample)
+
+  def accept(self, sample):
+    previous = self.value
+    self.value = self.estimate(sample)
+    if previous is not None:
+      self.variance = (1 - self.beta) * self.variance + self.beta * (sample - previous) ** 2
+    self.samples += 1
+    return self.value
+
+  def estimate(self, sample):
+    raise NotImplementedError
+
+class MeanEstimator(Estimator):
+  # mean of the last window samples
+  def __init__(self, window=2, **kw):
+    self.window = window
+    Estimator.__init__(self, **kw)
+
+  def reset(self):
+    Estimator.reset(self)
+    self.hist = RingBuffer(self.window)
+
+  def estimate(self, sample):
+    self.hist.append(sample)
+    return self.hist.mean()
+
+class EwmaEstimator(Estimator):
+  # exponentially weighted moving average
+  def __init__(self, alpha=0.25, **kw):
+    self.alpha = alpha
+    Estimator.__init__(self, **kw)
+
+  def estimate(self, sample):
+    if self.value is None:
+      return float(sample)
+    return (1 - self.alpha) * self.value + self.alpha * sample
+
+class MedianEstimator(Estimator):
+  # median of the last window samples
+  def __init__(self, window=5, **kw):
+    self.window = window
+    Estimator.__init__(self, **kw)
+
+  def reset(self):
+    Estimator.reset(self)
+    self.hist = RingBuffer(self.window)
+
+  def estimate(self, sample):
+    self.hist.append(sample)
+    return self.hist.percentile(50)
+
+class MinFilterEstimator(Estimator):
+  # minimum of the last window samples; queueing and controller delays only ever add to the propagation delay
+  def __init__(self, window=5, **kw):
+    self.window = window
+    Estimator.__init__(self, **kw)
+
+  def reset(self):
+    Estimator.reset(self)
+    self.hist = RingBuffer(self.window)
+
+  def estimate(self, sample):
+    self.hist.append(sample)
+    return self.hist.min()
+
+class KalmanEstimator(Estimator):
+  # scalar Kalman filter for a delay modelled as a random walk (process noise q) measured with noise r
+  def __init__(self, q=1.0, r=25.0, **kw):
+    self.q = q
+    self.r = r
+    Estimator.__init__(self, **kw)
+
+  def reset(self):
+    Estimator.reset(self)
+    self.p = self.r
+
+  def estimate(self, sample):
+    if self.value is None:
+      self.p = self.r
+      return float(sample)
+    p = self.p + self.q
+    gain = p / (p + self.r)
+    self.p = (1 - gain) * p
+    return self.value + gain * (sample - self.value)
+
+ESTIMATORS = {
+  "mean": MeanEstimator,
+  "ewma": EwmaEstimator,
+  "median": MedianEstimator,
+  "min": MinFilterEstimator,
+  "kalman": KalmanEstimator,
+}
+
+def make_estimator(name, **kw):
+  if name not in ESTIMATORS:
+    raise ValueError("unknown delay estimator '%s', expected one of: %s" % (name, ", ".join(sorted(ESTIMATORS))))
+  return ESTIMATORS[name](**kw)
+
+class PortCounters:
+  # Byte and packet counters of every switch port, turned into rates over the time between two samples.
+  # All ports share flat arrays (one slot per (switch, port)), so a poll over thousands of ports only updates
+  # numbers in place. Per slot: the last rx_bytes, tx_bytes, rx_packets, tx_packets in counters, the derived
+  # rx/tx bit/s and rx/tx packet/s in rates, and the time of the last sample [us] in times.
+  def __init__(self):
+    self.slots = {} # (dpid, port_no) => slot
+    self.counters = array('d')
+    self.rates = array('d')
+    self.times = array('d')
+
+  def __len__(self):
+    return len(self.slots)
+
+  def slot(self, key):
+    i = self.slots.get(key)
+    if i is None:
+      i = self.slots[key] = len(self.slots)
+      self.counters.extend((0.0, 0.0, 0.0, 0.0))
+      self.rates.extend((0.0, 0.0, 0.0, 0.0))
+      self.times.append(-1.0)
+    return i
+
+  def update(self, key, now, rx_bytes, tx_bytes, rx_packets, tx_packets):
+    i = self.slot(key)
+    base = 4 * i
+    counters = self.counters
+    last = self.times[i]
+    if last >= 0 and now > last:
+      d_rx_bytes = rx_bytes - counters[base]
+      d_tx_bytes = tx_bytes - counters[base + 1]
+      d_rx_packets = rx_packets - counters[base + 2]
+      d_tx_packets = tx_packets - counters[base + 3]
+      if min(d_rx_bytes, d_tx_bytes, d_rx_packets, d_tx_packets) >= 0: # a counter going back means the port was reset
+        interval = (now - last) / 1000000.0
+        rates = self.rates
+        rates[base] = 8 * d_rx_bytes / interval
+        rates[base + 1] = 8 * d_tx_bytes / interval
+        rates[base + 2] = d_rx_packets / interval
+        rates[base + 3] = d_tx_packets / interval
+    counters[base] = rx_bytes
+    counters[base + 1] = tx_bytes
+    counters[base + 2] = rx_packets
+    counters[base + 3] = tx_packets
+    self.times[i] = now
+    return i
+
+  def get(self, key):
+    # (rx bit/s, tx bit/s, rx packet/s, tx packet/s) of a port, zeros if it was never sampled twice
+    i = self.slots.get(key)
+    if i is None:
+      return (0.0, 0.0, 0.0, 0.0)
+    return tuple(self.rates[4 * i:4 * i + 4])
@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# Append-only time-series store of the link measurements of the QoS controller (qos_controller.py).
+# The module does not depend on POX so the same code can be used by offline tools.
+# Overall operation:
+#    - a store is a directory of segment files <prefix>-<creation time>.qts, written one after the other: a 32-byte header
+#      then fixed-size 24-byte records (time [us], series id, kind, value), in time order,
+#    - a series is a named source, e.g. "link:s1-s2", "switch:s1", "port:s1:4"; its id is only valid within a segment,
+#      the names are in <segment>.series (JSON, rewritten when a series is added),
+#    - records are packed into a buffer and written when it is full or on flush(), so an append is a struct pack and
+#      the disk is written once per buffer; a segment is closed when it reaches segment_bytes or segment_seconds,
+#      its per-series index (record numbers of every series) is then written to <segment>.idx,
+#    - readers map the segments with mmap; closed segments are read through their index, the one being written is scanned.
+# e.g. python qos_store.py /var/lib/qos --list
+#      python qos_store.py /var/lib/qos --series=link:s1-s2 --kind=delay_sample --start=2026-10-01T00:00:00 > s1-s2.csv
+
+import argparse
+import calendar
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+MAGIC = b"QOSTS\x00\x00\x01"
+HEADER = struct.Struct("<8sIIqq") # magic, version, record size, origin [us since the epoch], creation [us since the epoch]
+RECORD = struct.Struct("<qIHxxd") # time [us since origin], series id, kind, value
+INDEX_ENTRY = struct.Struct("<II") # series id, number of records, followed by their record numbers (uint32)
+VERSION = 1
+
+# kinds of records and the unit of their value
+KINDS = {
+  "delay_sample": 1,   # link delay sample, compensated for the OWDs [ms]
+  "delay_estimate": 2, # link delay estimate used for routing [ms]
+  "probe_lost": 3,     # probe not received within the probe timeout (value 1)
+  "owd": 4,            # smoothed one-way delay controller <=> switch [us]
+  "rx_bytes": 5,       # port counter delta since the previous poll [bytes]
+  "tx_bytes": 6,
+}
+KIND_NAMES = dict((value, name) for name, value in KINDS.items())
+
+def wall_us():
+  return int(time.time() * 1000000)
+
+class Writer:
+  def __init__(self, directory, prefix="qos", origin=None, segment_bytes=64 << 20, segment_seconds=86400, keep=0, buffer_records=4096):
+    self.directory = directory
+    self.prefix = prefix
+    self.origin = wall_us() if origin is None else origin # wall time [us] of the time 0 of the appended records
+    self.segment_bytes = segment_bytes
+    self.segment_seconds = segment_seconds
+    self.keep = keep # number of segments kept, the oldest ones are deleted; 0 keeps all
+    self.buf = bytearray(RECORD.size * buffer_records)
+    self.used = 0 # records in buf
+    self.file = None
+    self.stamp = None # creation second of the current segment, and its number within that second
+    self.sequence = 0
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self.open_segment()
+
+  def open_segment(self):
+    created = wall_us()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(created / 1e6))
+    # segments created within the same second are numbered on from the previous one, not from a name freed by
+    # prune, which would sort before the segments it follows
+    n = self.sequence + 1 if stamp == self.stamp else 1
+    while True:
+      self.path = os.path.join(self.directory, "%s-%s%s.qts" % (self.prefix, stamp, "-%d" % n if n > 1 else ""))
+      if not os.path.exists(self.path):
+        break
+      n += 1
+    self.stamp, self.sequence = stamp, n
+    self.file = io.open(self.path, "wb")
+    self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.origin, created))
+    self.created = created
+    self.count = 0 # records in the segment, written or buffered
+    self.ids = {} # series name => id
+    self.index = {} # series id => array of record numbers
+    self.write_series()
+    self.prune()
+
+  def series(self, name):
+    # id of the series name in the current segment
+    i = self.ids.get(name)
+    if i is None:
+      i = self.ids[name] = len(self.ids) + 1
+      self.index[i] = array("I")
+      self.write_series()
+    return i
+
+  def write_series(self):
+    with open(self.path[:-4] + ".series", "w") as f:
+      json.dump(dict((str(i), name) for name, i in self.ids.items()), f, sort_keys=True)
+
+  def append(self, t, name, kind, value):
+    # t [us since origin], name of the series, kind from KINDS
+    i = self.ids.get(name) or self.series(name)
+    RECORD.pack_into(self.buf, self.used * RECORD.size, t, i, kind, value)
+    self.index[i].append(self.count)
+    self.count += 1
+    self.used += 1
+    if self.used * RECORD.size == len(self.buf):
+      self.flush()
+
+  def flush(self):
+    # write the buffered records, and start a new segment when the current one is full or old enough
+    if self.used:
+      self.file.write(memoryview(self.buf)[:self.used * RECORD.size])
+      self.file.flush()
+      self.used = 0
+    if HEADER.size + self.count * RECORD.size >= self.segment_bytes or wall_us() - self.created >= self.segment_seconds * 1000000:
+      self.rotate()
+
+  def rotate(self):
+    self.close()
+    self.open_segment()
+
+  def close(self):
+    if self.file is None:
+      return
+    if self.used:
+      self.file.write(memoryview(self.buf)[:self.used * RECORD.size])
+      self.used = 0
+    self.file.close()
+    self.file = None
+    self.write_series()
+    with io.open(self.path[:-4] + ".idx", "wb") as f:
+      for i in sorted(self.index):
+        numbers = self.index[i]
+        f.write(INDEX_ENTRY.pack(i, len(numbers)))
+        f.write(numbers.tobytes() if hasattr(numbers, "tobytes") else numbers.tostring())
+
+  def prune(self):
+    if self.keep <= 0:
+      return
+    for path in segment_paths(self.directory, self.prefix)[:-self.keep]:
+      for extension in (".qts", ".series", ".idx"):
+        try:
+          os.remove(path[:-4] + extension)
+        except OSError:
+          pass
+
+def segment_paths(directory, prefix="qos"):
+  # segment files of a store, oldest first (their names start with the creation time)
+  names = [name for name in os.listdir(directory) if name.startswith(prefix + "-") and name.endswith(".qts")]
+  return [os.path.join(directory, name) for name in sorted(names, key=lambda name: (name.split("-", 1)[1][:15], len(name), name))]
+
+class Segment:
+  def __init__(self, path):
+    self.path = path
+    with open(path, "rb") as f:
+      size = os.fstat(f.fileno()).st_size
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+    if self.mm is None or size < HEADER.size:
+      raise ValueError("%s: not a segment" % path)
+    magic, version, record_size, self.origin, self.created = HEADER.unpack_from(self.mm, 0)
+    if magic != MAGIC or record_size != RECORD.size:
+      raise ValueError("%s: not a segment of this version" % path)
+    self.count = (size - HEADER.size) // RECORD.size # a record being written at the end is left out
+    with open(path[:-4] + ".series") as f:
+      self.ids = dict((name, int(i)) for i, name in json.load(f).items())
+    self.index = self.load_index()
+
+  def load_index(self):
+    # series id => array of record numbers, None while the segment is being written (no index yet)
+    try:
+      with open(self.path[:-4] + ".idx", "rb") as f:
+        data = f.read()
+    except IOError:
+      return None
+    index = {}
+    offset = 0
+    while offset < len(data):
+      i, n = INDEX_ENTRY.unpack_from(data, offset)
+      offset += INDEX_ENTRY.size
+      numbers = array("I")
+      chunk = data[offset:offset + 4 * n]
+      if hasattr(numbers, "frombytes"):
+        numbers.frombytes(chunk)
+      else:
+        numbers.fromstring(chunk)
+      index[i] = numbers
+      offset += 4 * n
+    return index
+
+  def time_at(self, n):
+    return RECORD.unpack_from(self.mm, HEADER.size + n * RECORD.size)[0]
+
+  def records(self, name=None, kind=None, start=None, end=None):
+    # (time [us since the epoch], series name, kind, value) of the records of series name (all if None) between
+    # start and end [us since the epoch]
+    names = dict((i, series) for series, i in self.ids.items())
+    if name is not None and name not in self.ids:
+      return
+    wanted = self.ids.get(name)
+    lo = None if start is None else start - self.origin
+    hi = None if end is None else end - self.origin
+    unpack = RECORD.unpack_from
+    if wanted is not None and self.index is not None:
+      numbers = self.index.get(wanted, array("I"))
+      first = 0
+      if lo is not None:
+        # binary search on the time of the series' records
+        a, b = 0, len(numbers)
+        while a < b:
+          m = (a + b) // 2
+          if self.time_at(numbers[m]) < lo:
+            a = m + 1
+          else:
+            b = m
+        first = a
+      for n in numbers[first:]:
+        t, i, k, value = unpack(self.mm, HEADER.size + n * RECORD.size)
+        if hi is not None and t > hi:
+          break
+        if kind is None or k == kind:
+          yield (self.origin + t, name, k, value)
+      return
+    first = 0
+    if lo is not None:
+      a, b = 0, self.count
+      while a < b:
+        m = (a + b) // 2
+        if self.time_at(m) < lo:
+          a = m + 1
+        else:
+          b = m
+      first = a
+    for n in range(first, self.count):
+      t, i, k, value = unpack(self.mm, HEADER.size + n * RECORD.size)
+      if hi is not None and t > hi:
+        break
+      if (wanted is None or i == wanted) and (kind is None or k == kind):
+        yield (self.origin + t, names.get(i), k, value)
+
+  def close(self):
+    self.mm.close()
+
+def read(directory, name=None, kind=None, start=None, end=None, prefix="qos"):
+  # records of a whole store, in time order; kind is a name of KINDS or its number
+  if kind in KINDS:
+    kind = KINDS[kind]
+  for path in segment_paths(directory, prefix):
+    try:
+      segment = Segment(path)
+    except (ValueError, IOError):
+      continue
+    try:
+      for record in segment.records(name, kind, start, end):
+        yield record
+    finally:
+      segment.close()
+
+def parse_time(text):
+  # "2026-10-01T12:00:00" (UTC) or seconds since the epoch => us since the epoch
+  try:
+    return int(float(text) * 1000000)
+  except ValueError:
+    return int(calendar.timegm(time.strptime(text, "%Y-%m-%dT%H:%M:%S")) * 1000000)
+
+def main():
+  parser = argparse.ArgumentParser(description="Read the time-series store of qos_controller as CSV.")
+  parser.add_argument("directory")
+  parser.add_argument("--prefix", default="qos")
+  parser.add_argument("--list", action="store_true", help="list the segments and their series")
+  parser.add_argument("--series", help="e.g. link:s1-s2, switch:s1, port:s1:4 (all if not given)")
+  parser.add_argument("--kind", choices=sorted(KINDS))
+  parser.add_argument("--start", help="UTC time (2026-10-01T12:00:00) or seconds since the epoch")
+  parser.add_argument("--end")
+  args = parser.parse_args()
+
+  if args.list:
+    for path in segment_paths(args.directory, args.prefix):
+      segment = Segment(path)
+      print("%s %d records, %s, series: %s" % (os.path.basename(path), segment.count,
+            "indexed" if segment.index is not None else "being written", " ".join(sorted(segment.ids))))
+      segment.close()
+    return
+  start = parse_time(args.start) if args.start else None
+  end = parse_time(args.end) if args.end else None
+  out = sys.stdout
+  out.write("time,series,kind,value\n")
+  for t, name, kind, value in read(args.directory, args.series, args.kind, start, end, args.prefix):
+    out.write("%.6f,%s,%s,%r\n" % (t / 1e6, name, KIND_NAMES.get(kind, kind), value))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,36 @@
+# Stand-ins for the POX objects qos_controller is handed, shared by the offline tools (qos_sim.py, qos_replay.py,
+# qos_bench.py) and the frames the emulated hosts of qos_fleet.py and qos_bench.py send.
+# The module does not depend on POX.
+
+import socket
+import struct
+
+class Record(object):
+  # attribute bag used for the events and the stats entries handed to the controller
+  def __init__(self, **kw):
+    self.__dict__.update(kw)
+
+class SimOpenFlow(object):
+  # stands for core.openflow: connections by dpid and the listeners registered by qos_controller.launch
+  def __init__(self):
+    self.connections = {}
+    self.listeners = {}
+
+  def getConnection(self, dpid):
+    return self.connections.get(dpid)
+
+  def addListenerByName(self, name, handler, **kw):
+    self.listeners[name] = handler
+
+def mac(dpid, port):
+  # MAC address of a switch port (or of the host behind it)
+  return struct.pack("!HI", dpid & 0xFFFF, port)
+
+def ip_bytes(ip):
+  return socket.inet_aton(ip)
+
+def arp_request(src_mac, src_ip, dst_ip):
+  # broadcast ARP who-has dst_ip
+  eth = b"\xff" * 6 + src_mac + struct.pack("!H", 0x0806)
+  arp = struct.pack("!HHBBH", 1, 0x0800, 6, 4, 1) + src_mac + ip_bytes(src_ip) + b"\x00" * 6 + ip_bytes(dst_ip)
+  return eth + arp
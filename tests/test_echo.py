@@ -0,0 +1,103 @@
+# Echo replies reach qos_controller through the patched of_01 dispatch table; in the barrier fallback the replies
+# to barriers sent right after a flow_mod are matched but give no OWD sample.
+# Needs POX on the path (and Python 2, as the controller), skipped otherwise.
+
+import unittest
+
+try:
+  import pox.openflow.of_01 as of_01
+  import pox.openflow.libopenflow_01 as of
+  from pox.core import core
+  import qos_controller as qos
+  from qos_stats import Clock
+except (ImportError, SyntaxError):
+  qos = None
+
+class Connection(object):
+  def __init__(self, dpid):
+    self.dpid = dpid
+    self.sent = []
+
+  def send(self, msg):
+    self.sent.append(msg)
+
+class OpenFlow(object):
+  # stands for core.openflow
+  def __init__(self, connections):
+    self.connections = connections
+
+  def getConnection(self, dpid):
+    return self.connections.get(dpid)
+
+class BarrierIn(object):
+  def __init__(self, connection, msg):
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.xid = msg.xid
+    self.ofp = msg
+
+@unittest.skipIf(qos is None, "needs POX and Python 2")
+class EchoTest(unittest.TestCase):
+  def setUp(self):
+    self.now = [0]
+    self.saved = (qos.clock, qos.echo_request, qos.echo_handler, of_01.handlers[of.OFPT_ECHO_REPLY],
+                  of_01.handlerMap[of.OFPT_ECHO_REPLY], getattr(core, "openflow", None))
+    qos.clock = Clock(source=lambda: self.now[0])
+    self.connection = Connection(1)
+    core.register("openflow", OpenFlow({1: self.connection}))
+    for state in (qos.pending_requests, qos.OWD, qos.owd_updated, qos.flow_mod_times, qos.samples_dropped):
+      state.clear()
+    qos.echo_matched.clear()
+
+  def tearDown(self):
+    (qos.clock, qos.echo_request, qos.echo_handler, of_01.handlers[of.OFPT_ECHO_REPLY],
+     of_01.handlerMap[of.OFPT_ECHO_REPLY], openflow) = self.saved
+    core.register("openflow", openflow)
+
+  def advance(self, seconds):
+    self.now[0] += int(seconds * 1e9)
+
+  def test_patched_handler_gets_echo_reply(self):
+    self.assertTrue(qos.hook_echo_replies())
+    self.assertTrue(qos.send_echo_request(1))
+    request = self.connection.sent[-1]
+    self.advance(0.004)
+    of_01.handlers[of.OFPT_ECHO_REPLY](self.connection, of.ofp_echo_reply(xid=request.xid))
+    self.assertIn(1, qos.echo_matched)
+    self.assertEqual(qos.OWD[1], 2000)
+    self.assertNotIn(request.xid, qos.pending_requests)
+
+  def test_hook_is_applied_once(self):
+    qos.hook_echo_replies()
+    handler = of_01.handlers[of.OFPT_ECHO_REPLY]
+    qos.hook_echo_replies()
+    self.assertIs(of_01.handlers[of.OFPT_ECHO_REPLY], handler)
+
+  def barrier_round_trip(self, seconds):
+    qos.send_echo_request(1)
+    request = self.connection.sent[-1]
+    self.advance(seconds)
+    qos._handle_BarrierIn(BarrierIn(self.connection, request))
+
+  def test_barrier_after_flow_mod_gives_no_sample(self):
+    qos.echo_request = of.ofp_barrier_request
+    qos.flow_mod_times[1] = qos.clock.us()
+    self.advance(qos.BARRIER_SETTLE / 2)
+    self.barrier_round_trip(0.004)
+    self.assertNotIn(1, qos.OWD)
+    self.assertEqual(qos.samples_dropped[1], 1)
+    self.assertEqual(qos.pending_requests, {})
+
+    self.advance(qos.BARRIER_SETTLE)
+    self.barrier_round_trip(0.004)
+    self.assertEqual(qos.OWD[1], 2000)
+    self.assertEqual(qos.samples_dropped[1], 1)
+
+  def test_barrier_without_flow_mods_gives_sample(self):
+    qos.echo_request = of.ofp_barrier_request
+    self.barrier_round_trip(0.006)
+    self.assertEqual(qos.OWD[1], 3000)
+    self.assertEqual(qos.samples_dropped, {})
+
+if __name__ == "__main__":
+  unittest.main()
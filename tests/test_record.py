@@ -0,0 +1,98 @@
+# qos_record round trip: every event type through a Recorder and back from read_events, plus cut recordings.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from qos_record import (CONNECTION_UP, EVENT, FLOW_STATS, LINK, LINK_CHANGE, OWD, PACKET_IN, PORT_STATS, TYPE_NAMES, Recorder,
+                        read_events)
+from qos_stubs import Record, arp_request, mac
+
+def connection(dpid, ports=()):
+  return Record(dpid=dpid, features=Record(ports=list(ports)))
+
+class RecordTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "test.qrec")
+    self.now = 0
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def clock(self):
+    self.now += 1000
+    return self.now
+
+  def record(self, buffer_size=1 << 16):
+    # one event of every type, the recorder flushed in between when buffer_size is small
+    recorder = Recorder(self.path, self.clock, {"options": {"solver": "assign"}, "requests": []}, buffer_size=buffer_size)
+    ports = [Record(port_no=1, hw_addr=mac(1, 1), name="s1-eth1"), Record(port_no=2, hw_addr=None, name="s1-eth2")]
+    recorder.connection_up(Record(connection=connection(1, ports), dpid=1))
+    frame = arp_request(mac(1, 1), "10.0.0.1", "10.0.0.4")
+    recorder.packet_in(Record(connection=connection(1), ofp=Record(in_port=1, buffer_id=7, data=frame)))
+    recorder.packet_in(Record(connection=connection(1), ofp=Record(in_port=2, buffer_id=None, data=b"")))
+    stats = [Record(port_no=1, rx_bytes=1 << 40, tx_bytes=2, rx_packets=3, tx_packets=4)]
+    recorder.port_stats(Record(connection=connection(1), ofp=[Record(xid=42)], stats=stats))
+    match = Record(in_port=None, dl_type=0x0800, nw_src="10.0.0.1", nw_dst="10.0.0.4", nw_proto=None, tp_src=None, tp_dst=None)
+    flows = [Record(priority=100, match=match, byte_count=1500, packet_count=1), Record(priority=1, match=Record(), byte_count=0, packet_count=0)]
+    recorder.flow_stats(Record(connection=connection(2), stats=flows))
+    recorder.owd(3, 1234)
+    link = Record(dpid1=1, port1=4, dpid2=2, port2=1)
+    recorder.link(Record(link=link, added=True))
+    recorder.link(Record(link=link, added=False))
+    recorder.close()
+    return frame
+
+  def check(self, events, frame):
+    self.assertEqual([event.type for event in events], [CONNECTION_UP, PACKET_IN, PACKET_IN, PORT_STATS, FLOW_STATS, OWD, LINK, LINK])
+    self.assertEqual([event.time for event in events], [1000 * (n + 1) for n in range(8)])
+    up = events[0]
+    self.assertEqual(up.dpid, 1)
+    self.assertEqual([(p.port_no, p.hw_addr, p.name) for p in up.ports], [(1, mac(1, 1), "s1-eth1"), (2, b"\x00" * 6, "s1-eth2")])
+    self.assertEqual((events[1].in_port, events[1].buffer_id, events[1].data), (1, 7, frame))
+    self.assertEqual((events[2].in_port, events[2].buffer_id, events[2].data), (2, 0xFFFFFFFF, b""))
+    stats = events[3]
+    self.assertEqual(stats.xid, 42)
+    self.assertEqual([(f.port_no, f.rx_bytes, f.tx_bytes, f.rx_packets, f.tx_packets) for f in stats.stats], [(1, 1 << 40, 2, 3, 4)])
+    flows = events[4]
+    self.assertEqual(flows.dpid, 2)
+    self.assertEqual([(f.priority, f.match, f.byte_count, f.packet_count) for f in flows.stats],
+                     [(100, {"dl_type": 0x0800, "nw_src": "10.0.0.1", "nw_dst": "10.0.0.4"}, 1500, 1), (1, {}, 0, 0)])
+    self.assertEqual((events[5].dpid, events[5].owd), (3, 1234))
+    for event, added in zip(events[6:], (True, False)):
+      self.assertEqual((event.dpid, event.port1, event.dpid2, event.port2, event.added), (1, 4, 2, 1, added))
+
+  def test_round_trip(self):
+    for buffer_size in (1 << 16, 1):
+      frame = self.record(buffer_size)
+      header, events = read_events(self.path)
+      self.assertEqual(header, {"options": {"solver": "assign"}, "requests": []})
+      self.check(list(events), frame)
+      self.now = 0
+    self.assertEqual(set(TYPE_NAMES), set([CONNECTION_UP, PACKET_IN, PORT_STATS, OWD, LINK, FLOW_STATS]))
+
+  def test_cut_recording(self):
+    frame = self.record()
+    size = os.path.getsize(self.path)
+    link_record = EVENT.size + LINK_CHANGE.size # the last event
+    # cut in the payload of the last record, in its header, and right after the record before it
+    for cut in (1, link_record - EVENT.size + 1, link_record):
+      with open(self.path, "r+b") as f:
+        f.truncate(size - cut)
+      header, events = read_events(self.path)
+      events = list(events)
+      self.assertEqual(len(events), 7)
+      self.check(events + [Record(type=LINK, time=8000, dpid=1, port1=4, dpid2=2, port2=1, added=False)], frame)
+    with open(self.path, "r+b") as f:
+      f.truncate(size - 2 * link_record)
+    self.assertEqual(len(list(read_events(self.path)[1])), 6)
+
+  def test_not_a_recording(self):
+    with open(self.path, "wb") as f:
+      f.write(b"QOSTS\x00\x00\x01" + b"\x00" * 24)
+    self.assertRaises(ValueError, read_events, self.path)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,186 @@
+# qos_routing on small instances that can be checked by hand, plus the 10k-request case within a recompute interval.
+
+import itertools
+import random
+import time
+import unittest
+
+from qos_routing import Graph, assign, constrained_path, delays_to, simple_paths
+
+def first_fit(demands, candidates, capacity):
+  # requests in the given order, each on its first candidate that fits
+  load = [0.0] * len(capacity)
+  choice = []
+  for d, paths in zip(demands, candidates):
+    chosen = None
+    for c, path in enumerate(paths):
+      if all(load[l] + d <= capacity[l] for l in path):
+        chosen = c
+        break
+    if chosen is not None:
+      for l in paths[chosen]:
+        load[l] += d
+    choice.append(chosen)
+  return choice
+
+def loads(demands, candidates, capacity, choice):
+  load = [0.0] * len(capacity)
+  for i, c in enumerate(choice):
+    if c is not None:
+      for l in candidates[i][c]:
+        load[l] += demands[i]
+  return load
+
+class AssignTest(unittest.TestCase):
+  def check_capacity(self, demands, candidates, capacity, choice):
+    for l, used in enumerate(loads(demands, candidates, capacity, choice)):
+      self.assertLessEqual(used, capacity[l] + 1e-9)
+
+  def test_admits_what_first_fit_misses(self):
+    # a and c both want link 0 or 1, b link 1 or 2: first fit leaves c out, moving b to link 2 admits it
+    demands = [6, 6, 6]
+    candidates = [[(0,), (1,)], [(1,), (2,)], [(0,), (1,)]]
+    capacity = [10, 10, 10]
+    self.assertEqual(first_fit(demands, candidates, capacity), [0, 0, None])
+    for spread in (True, False):
+      choice = assign(demands, candidates, capacity, spread=spread)
+      self.assertNotIn(None, choice)
+      self.check_capacity(demands, candidates, capacity, choice)
+
+  def test_capacity(self):
+    # 7 + 4 > 10: the largest request is placed first and the others do not fit next to it
+    demands = [4, 7, 5]
+    candidates = [[(0,)], [(0,)], [(0,)]]
+    self.assertEqual(assign(demands, candidates, [10]), [None, 0, None])
+    self.assertEqual(assign(demands, candidates, [0]), [None, None, None])
+    self.assertEqual(assign([3], [[]], [10]), [None])
+
+  def test_multi_link_path(self):
+    # the two-link path is full on link 1, so the second request takes the longer one
+    demands = [5, 5]
+    candidates = [[(0, 1)], [(0, 1), (2, 3, 4)]]
+    capacity = [10, 5, 10, 10, 10]
+    self.assertEqual(assign(demands, candidates, capacity), [0, 1])
+
+  def test_keep(self):
+    candidates = [[(0,), (1,)]]
+    self.assertEqual(assign([3], candidates, [10, 10], keep=[1]), [1])
+    self.assertEqual(assign([6], candidates, [10, 5], keep=[1]), [0]) # no longer fits
+    # a kept request not held is moved to admit another one
+    self.assertEqual(assign([6, 6], [[(0,)], [(0,), (1,)]], [10, 10], keep=[None, 0]), [0, 1])
+    self.assertEqual(assign([6, 6], [[(0,)], [(0,), (1,)]], [10, 10], keep=[None, 0], hold=[False, True]), [None, 0])
+
+  def test_hold(self):
+    demands = [6, 6, 6]
+    candidates = [[(0,), (1,)], [(1,), (2,)], [(0,), (1,)]]
+    capacity = [10, 10, 10]
+    keep = [0, 0, None]
+    self.assertEqual(assign(demands, candidates, capacity, keep=keep), [0, 1, 1])
+    # b cannot be moved to make room for c
+    self.assertEqual(assign(demands, candidates, capacity, keep=keep, hold=[True, True, False]), [0, 0, None])
+
+  def test_rebalance(self):
+    demands = [3, 3]
+    candidates = [[(0,), (1,)], [(0,), (1,)]]
+    capacity = [10, 10]
+    self.assertEqual(sorted(assign(demands, candidates, capacity, keep=[0, 0])), [0, 1])
+    self.assertEqual(assign(demands, candidates, capacity, keep=[0, 0], hold=[True, True]), [0, 0])
+    # link 0 at 60%: moved off above a 50% limit, left as it is below 70%
+    self.assertEqual(sorted(assign(demands, candidates, capacity, keep=[0, 0], limit=0.5)), [0, 1])
+    self.assertEqual(assign(demands, candidates, capacity, keep=[0, 0], limit=0.7), [0, 0])
+    self.assertEqual(assign(demands, candidates, capacity, keep=[0, 0], spread=False), [0, 0])
+
+  def check_order_independent(self, requests, capacity, orders, spread=True):
+    # the same requests are admitted, on the same paths, in every order
+    results = set()
+    for order in orders:
+      demands = [requests[name][0] for name in order]
+      candidates = [requests[name][1] for name in order]
+      choice = assign(demands, candidates, capacity, spread=spread)
+      self.check_capacity(demands, candidates, capacity, choice)
+      results.add(tuple(sorted((name, None if c is None else candidates[i][c]) for i, (name, c) in enumerate(zip(order, choice)))))
+    self.assertEqual(len(results), 1)
+
+  def test_order_independent(self):
+    requests = {
+      "a": (6, [(0,), (1,)]),
+      "b": (5, [(1,), (2,)]),
+      "c": (6, [(1,), (0,)]),
+      "d": (4, [(2,)]),
+      "e": (3, [(0, 2)]),
+    }
+    for spread in (True, False):
+      self.check_order_independent(requests, [10, 10, 10], itertools.permutations(sorted(requests)), spread)
+
+  def test_order_independent_random(self):
+    rnd = random.Random(1)
+    requests = {}
+    for i in range(40):
+      paths = list(set(tuple(sorted(rnd.sample(range(8), rnd.randint(1, 3)))) for c in range(rnd.randint(1, 4))))
+      requests[i] = (rnd.randint(1, 5), sorted(paths, key=lambda path: rnd.random()))
+    orders = []
+    for i in range(50):
+      order = list(requests)
+      rnd.shuffle(order)
+      orders.append(order)
+    for spread in (True, False):
+      self.check_order_independent(requests, [10] * 8, orders, spread)
+
+  def test_10k_requests(self):
+    # 10k equal requests over 250 parallel single-link paths, room for 2/3 of them
+    paths = [(l,) for l in range(250)]
+    demands = [1.0] * 10000
+    candidates = [paths] * 10000
+    capacity = [27.0] * 250
+    start = time.time()
+    choice = assign(demands, candidates, capacity)
+    elapsed = time.time() - start
+    self.assertEqual(sum(c is not None for c in choice), 27 * 250)
+    self.assertLess(elapsed, 2.0) # RECOMPUTE_INTERVAL is 1 s, with room for slow machines
+
+def diamond():
+  # s1 => s5 over s2 (20 ms), s3 (10 ms) or s4 (60 ms), plus s2 => s3 (1 ms)
+  graph = Graph()
+  for middle, delay in ((2, 10), (3, 5), (4, 30)):
+    graph.add_edge(1, middle, delay, "s1-s%d" % middle, middle + 2, 1)
+    graph.add_edge(middle, 5, delay, "s%d-s5" % middle, 2, middle - 1)
+  graph.add_edge(2, 3, 1, "s2-s3", 3, 3)
+  return graph
+
+def switches(path):
+  return [path[0].src] + [edge.dst for edge in path] if path else []
+
+class PathTest(unittest.TestCase):
+  def test_delays_to(self):
+    h = delays_to(diamond(), 5)
+    self.assertEqual(h, {5: 0, 2: 6, 3: 5, 4: 30, 1: 10})
+
+  def test_simple_paths(self):
+    graph = diamond()
+    paths = simple_paths(graph, 1, 5, 25, 5)
+    self.assertEqual([switches(path) for path in paths], [[1, 3, 5], [1, 2, 3, 5], [1, 2, 5]])
+    self.assertEqual([switches(path) for path in simple_paths(graph, 1, 5, 100, 1)], [[1, 3, 5]])
+    self.assertEqual(len(simple_paths(graph, 1, 5, 100, 10)), 4)
+    self.assertEqual(simple_paths(graph, 1, 5, 9, 5), [])
+    self.assertEqual(simple_paths(graph, 1, 1, 0, 5), [[]])
+    self.assertEqual(simple_paths(graph, 5, 1, 100, 5), []) # no edge back
+
+  def test_constrained_path(self):
+    graph = diamond()
+    # the most delay budget is used first: s4 within 100 ms, s2 within 25 ms, s3 within 10 ms
+    self.assertEqual(switches(constrained_path(graph, 1, 5, 100)), [1, 4, 5])
+    self.assertEqual(switches(constrained_path(graph, 1, 5, 25)), [1, 2, 5])
+    self.assertEqual(switches(constrained_path(graph, 1, 5, 10)), [1, 3, 5])
+    self.assertIsNone(constrained_path(graph, 1, 5, 9))
+    self.assertEqual(constrained_path(graph, 1, 1, 0), [])
+
+  def test_constrained_path_usable_and_cost(self):
+    graph = diamond()
+    no_s3 = lambda edge: "s3" not in edge.key
+    self.assertEqual(switches(constrained_path(graph, 1, 5, 25, usable=no_s3)), [1, 2, 5])
+    self.assertIsNone(constrained_path(graph, 1, 5, 15, usable=no_s3))
+    load = {"s1-s2": 3, "s1-s3": 1, "s1-s4": 2}
+    self.assertEqual(switches(constrained_path(graph, 1, 5, 100, cost=lambda edge: load.get(edge.key, 0))), [1, 3, 5])
+
+if __name__ == "__main__":
+  unittest.main()
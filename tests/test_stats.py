@@ -0,0 +1,80 @@
+# Outlier rejection of qos_stats.Estimator.update, run on every estimator of ESTIMATORS.
+
+import unittest
+
+from qos_stats import ESTIMATORS, make_estimator
+
+STEADY = [100, 102, 98, 101, 99] * 4 # [ms] a delay with a little jitter
+
+def settled(name, **kw):
+  estimator = make_estimator(name, **kw)
+  for sample in STEADY:
+    estimator.update(sample)
+  return estimator
+
+class EstimatorTest(unittest.TestCase):
+  def test_lone_spike_is_dropped(self):
+    for name in sorted(ESTIMATORS):
+      estimator = settled(name)
+      value = estimator.value
+      self.assertEqual(estimator.update(500), value, name)
+      self.assertEqual(estimator.outliers, 1, name)
+      estimator.update(100)
+      self.assertAlmostEqual(estimator.value, 100, delta=3, msg=name)
+      self.assertEqual(estimator.outliers, 1, name)
+
+  def test_step_is_followed(self):
+    for name in sorted(ESTIMATORS):
+      for max_outliers in (1, 2, 3):
+        estimator = settled(name, max_outliers=max_outliers)
+        value = estimator.value
+        for i in range(max_outliers):
+          self.assertEqual(estimator.update(200), value, name)
+        # the run is longer than max_outliers: a new level, taken from the samples of the run
+        self.assertEqual(estimator.update(200), 200, name)
+        self.assertEqual(estimator.outliers, max_outliers, name)
+        self.assertEqual(estimator.samples, max_outliers + 1, name) # and a new warmup
+
+  def test_warmup(self):
+    for name in sorted(ESTIMATORS):
+      estimator = make_estimator(name, warmup=5)
+      for sample in (100, 100, 100, 100):
+        estimator.update(sample)
+      # the 5th sample is still accepted whatever it is, the 6th far off is not
+      estimator.update(1000)
+      self.assertEqual(estimator.samples, 5, name)
+      self.assertEqual(estimator.outliers, 0, name)
+      estimator = make_estimator(name, warmup=5)
+      for sample in (100, 100, 100, 100, 100):
+        estimator.update(sample)
+      self.assertEqual(estimator.update(1000), 100, name)
+      self.assertEqual(estimator.outliers, 1, name)
+      # a level shift restarts the warmup
+      estimator.update(1000)
+      self.assertEqual(estimator.samples, 2, name)
+
+  def test_alternating_outliers_are_not_a_run(self):
+    for name in sorted(ESTIMATORS):
+      estimator = settled(name)
+      value = estimator.value
+      for sample in (200, 0, 200, 0, 200, 0):
+        self.assertEqual(estimator.update(sample), value, name)
+      self.assertEqual(estimator.outliers, 6, name)
+
+  def test_scattered_outliers_are_not_a_run(self):
+    # same side of the estimate but not at one level
+    for name in sorted(ESTIMATORS):
+      estimator = settled(name)
+      value = estimator.value
+      for sample in (200, 400, 800):
+        self.assertEqual(estimator.update(sample), value, name)
+
+  def test_rejection_disabled(self):
+    for name in sorted(ESTIMATORS):
+      estimator = settled(name, outlier_k=0)
+      estimator.update(500)
+      self.assertEqual(estimator.samples, len(STEADY) + 1, name)
+      self.assertEqual(estimator.outliers, 0, name)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,75 @@
+# qos_store round trip: records written over several segments (rotated, pruned) and read back by time range.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from qos_store import HEADER, KINDS, RECORD, Segment, Writer, read, segment_paths
+
+ORIGIN = 1790000000 * 1000000 # [us since the epoch]
+
+class StoreTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write(self, records, **kw):
+    # 10 records per segment, written 5 at a time: a segment is full at every other buffer
+    writer = Writer(self.directory, origin=ORIGIN, segment_bytes=HEADER.size + 10 * RECORD.size, buffer_records=5, **kw)
+    for n in range(records):
+      writer.append(1000 * n, "link:s1-s2" if n % 2 else "switch:s1", KINDS["delay_sample"] if n % 2 else KINDS["owd"], float(n))
+    return writer
+
+  def test_rotate(self):
+    writer = self.write(35)
+    paths = segment_paths(self.directory)
+    self.assertEqual(len(paths), 4)
+    segments = [Segment(path) for path in paths]
+    try:
+      self.assertEqual([segment.count for segment in segments], [10, 10, 10, 5])
+      self.assertEqual([segment.index is not None for segment in segments], [True, True, True, False])
+    finally:
+      for segment in segments:
+        segment.close()
+    writer.close()
+    self.assertEqual([value for t, name, kind, value in read(self.directory)], [float(n) for n in range(35)])
+
+  def test_read_across_segments(self):
+    writer = self.write(35)
+    # records 7..23 span three segments; the last one is read while being written, then through its index
+    for closed in (False, True):
+      if closed:
+        writer.close()
+      records = list(read(self.directory, start=ORIGIN + 7000, end=ORIGIN + 23000))
+      self.assertEqual([value for t, name, kind, value in records], [float(n) for n in range(7, 24)])
+      self.assertEqual(records[0], (ORIGIN + 7000, "link:s1-s2", KINDS["delay_sample"], 7.0))
+      link = list(read(self.directory, "link:s1-s2", "delay_sample", start=ORIGIN + 8000, end=ORIGIN + 32000))
+      self.assertEqual([value for t, name, kind, value in link], [float(n) for n in range(9, 33, 2)])
+      self.assertEqual(list(read(self.directory, "switch:s1", "delay_sample")), [])
+      self.assertEqual(list(read(self.directory, "port:s1:4")), [])
+      tail = list(read(self.directory, "switch:s1", start=ORIGIN + 28500))
+      self.assertEqual([value for t, name, kind, value in tail], [30.0, 32.0, 34.0])
+
+  def test_prune(self):
+    writer = self.write(35, keep=2)
+    writer.close()
+    paths = segment_paths(self.directory)
+    self.assertEqual(len(paths), 2)
+    names = sorted(os.listdir(self.directory))
+    self.assertEqual(len(names), 2 * 3) # .qts, .series and .idx of each
+    self.assertEqual([value for t, name, kind, value in read(self.directory)], [float(n) for n in range(20, 35)])
+
+  def test_partial_record(self):
+    writer = self.write(25)
+    writer.flush()
+    with open(writer.path, "ab") as f:
+      f.write(b"\x01" * (RECORD.size // 2)) # a record being written
+    values = [value for t, name, kind, value in read(self.directory, start=ORIGIN + 18000)]
+    self.assertEqual(values, [float(n) for n in range(18, 25)])
+    writer.file.close()
+
+if __name__ == "__main__":
+  unittest.main()